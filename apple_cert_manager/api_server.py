@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote
+from apple_cert_manager.config import config
+from .logging_config import log_context
+
+logging = logging.getLogger(__name__)
+
+# 已完成的工作保留多久（秒）供查詢與下載
+FINISHED_JOB_TTL = 3600
+# 讀取 request body 的上限
+MAX_BODY_SIZE = 64 * 1024
+
+
+def _default_register_device(apple_id, device_name, device_udid):
+    from . import profile
+    return profile.register_device(apple_id, device_name, device_udid, refresh_profile_on_conflict=False)
+
+def _default_refresh_profile(apple_id):
+    from . import profile
+    profile.get_provisioning_profile(apple_id)
+
+def _default_resign(apple_id, output_path):
+    from . import resign_ipa
+    return resign_ipa.resign_ipa(apple_id, output_path=output_path)
+
+def _default_get_accounts():
+    from . import apple_accounts
+    return [dict(account) for account in apple_accounts.get_accounts()]
+
+
+class Job:
+    """ 單一帳號的工作：註冊裝置 → 更新描述檔 → 重簽名
+
+    同一帳號還沒開始執行的工作會合併後來的請求（裝置清單累加、重簽名旗標合併），
+    所以一個帳號最多只有一個執行中與一個等待中的工作。
+    """
+
+    def __init__(self, apple_id):
+        self.id = uuid.uuid4().hex
+        self.apple_id = apple_id
+        self.devices = {}  # udid -> name
+        self.resign = False
+        self.state = "queued"
+        self.error = None
+        self.ipa_path = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self.condition = threading.Condition()
+        self.add_event("queued")
+
+    def add_event(self, stage, **fields):
+        with self.condition:
+            self.events.append({"time": round(time.time(), 3), "job_id": self.id, "stage": stage, **fields})
+            self.condition.notify_all()
+
+    def covers(self, devices, resign):
+        """ 此工作是否已包含請求內容（執行中的工作只能接手完全被涵蓋的請求） """
+        return all(udid in self.devices for udid in devices) and (self.resign or not resign)
+
+    def merge(self, devices, resign):
+        self.devices.update(devices)
+        self.resign = self.resign or resign
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed")
+
+    def wait_events(self, start, timeout):
+        """ 等待 start 之後的新事件，回傳 (新事件, 是否已結束) """
+        with self.condition:
+            if len(self.events) <= start and not self.finished:
+                self.condition.wait(timeout)
+            return self.events[start:], self.finished
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "apple_id": self.apple_id,
+            "state": self.state,
+            "devices": [{"udid": udid, "name": name} for udid, name in self.devices.items()],
+            "resign": self.resign,
+            "error": self.error,
+            "ipa_ready": bool(self.ipa_path),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """ 📋 依帳號合併並排程工作 """
+
+    def __init__(self, max_workers=4, register_device=None, refresh_profile=None, resign=None, output_dir=None):
+        """
+        Args:
+            resign (callable): 接收 (apple_id, 輸出路徑)，回傳產生的 IPA 路徑
+            output_dir (str): 每個工作各自的 IPA 輸出目錄（預設為 `${IPA_DIR_PATH}/api-jobs`），
+                同一帳號之後的工作不會覆蓋之前工作提供下載的檔案；工作過期時一併刪除
+        """
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api-job")
+        self.register_device = register_device or _default_register_device
+        self.refresh_profile = refresh_profile or _default_refresh_profile
+        self.resign = resign or _default_resign
+        self.output_dir = output_dir or os.path.join(config.ipa_dir_path, "api-jobs")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.running = {}  # apple_id -> Job
+        self.pending = {}  # apple_id -> Job
+
+    def submit(self, apple_id, devices=None, resign=False):
+        """ 提交請求，回傳 (工作, 是否合併到既有工作) """
+        devices = devices or {}
+        with self.lock:
+            self._prune()
+            running = self.running.get(apple_id)
+            if running and running.covers(devices, resign):
+                return running, True
+            pending = self.pending.get(apple_id)
+            if pending:
+                pending.merge(devices, resign)
+                return pending, True
+            job = Job(apple_id)
+            job.merge(devices, resign)
+            self.jobs[job.id] = job
+            if running:
+                self.pending[apple_id] = job
+            else:
+                self._start(job)
+            return job, False
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _start(self, job):
+        self.running[job.apple_id] = job
+        self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        with log_context(apple_id=job.apple_id, job_id=job.id):
+            self._run_job(job)
+
+    def _run_job(self, job):
+        job.state = "running"
+        job.add_event("started")
+        try:
+            for udid, name in list(job.devices.items()):
+                created = self.register_device(job.apple_id, name, udid)
+                job.add_event("device_registered", udid=udid, created=bool(created))
+            if job.devices:
+                self.refresh_profile(job.apple_id)
+                job.add_event("profile_refreshed")
+            if job.resign:
+                job.add_event("resigning")
+                os.makedirs(self.output_dir, exist_ok=True)
+                job.ipa_path = self.resign(job.apple_id, os.path.join(self.output_dir, f"{job.id}.ipa"))
+                job.add_event("resigned", ipa_ready=bool(job.ipa_path))
+            job.state = "done"
+        except Exception as e:
+            logging.error(f"❌ 工作 {job.id} ({job.apple_id}) 失敗: {e}")
+            job.error = str(e)
+            job.state = "failed"
+            partial_path = os.path.join(self.output_dir, f"{job.id}.ipa")
+            if not job.ipa_path and os.path.exists(partial_path):
+                os.remove(partial_path)
+        finally:
+            job.finished_at = time.time()
+            job.add_event(job.state, error=job.error)
+            with self.lock:
+                self.running.pop(job.apple_id, None)
+                pending = self.pending.pop(job.apple_id, None)
+                if pending:
+                    self._start(pending)
+
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and now - job.finished_at > FINISHED_JOB_TTL]
+        for job_id in expired:
+            self._remove_output(self.jobs.pop(job_id))
+
+    def _remove_output(self, job):
+        if job.ipa_path and os.path.exists(job.ipa_path):
+            try:
+                os.remove(job.ipa_path)
+            except OSError as e:
+                logging.warning(f"⚠️ 無法刪除工作 {job.id} 的 IPA: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    """ 🌐 API 路由
+
+    GET  /accounts                列出帳號
+    GET  /accounts/<apple_id>     查詢單一帳號
+    POST /devices                 {"apple_id", "name", "udid", "resign"} 註冊裝置（可選擇順便重簽名）
+    POST /resign                  {"apple_id"} 重簽名
+    GET  /jobs/<id>               工作狀態
+    GET  /jobs/<id>/events        以 NDJSON 串流工作進度
+    GET  /jobs/<id>/ipa           下載重簽名後的 IPA
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug("%s " + format, self.address_string(), *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=str, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("請求內容過大")
+        body = self.rfile.read(length) if length else b"{}"
+        data = json.loads(body or b"{}")
+        if not isinstance(data, dict):
+            raise ValueError("請求內容必須是 JSON 物件")
+        return data
+
+    def _path_parts(self):
+        return [unquote(part) for part in urlparse(self.path).path.strip("/").split("/") if part]
+
+    def do_GET(self):
+        parts = self._path_parts()
+        manager = self.server.manager
+        if parts == ["accounts"]:
+            return self._send_json(200, self.server.get_accounts())
+        if len(parts) == 2 and parts[0] == "accounts":
+            account = next((acc for acc in self.server.get_accounts() if acc["apple_id"] == parts[1]), None)
+            if not account:
+                return self._send_json(404, {"error": f"找不到 Apple ID: {parts[1]}"})
+            return self._send_json(200, account)
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = manager.get(parts[1])
+            if not job:
+                return self._send_json(404, {"error": f"找不到工作: {parts[1]}"})
+            if len(parts) == 2:
+                return self._send_json(200, job.to_dict())
+            if parts[2:] == ["events"]:
+                return self._stream_events(job)
+            if parts[2:] == ["ipa"]:
+                return self._send_ipa(job)
+        self._send_json(404, {"error": "找不到路徑"})
+
+    def do_POST(self):
+        parts = self._path_parts()
+        try:
+            data = self._read_json()
+        except ValueError as e:
+            return self._send_json(400, {"error": f"無效的請求: {e}"})
+        apple_id = data.get("apple_id")
+        if not apple_id:
+            return self._send_json(400, {"error": "缺少 apple_id"})
+
+        if parts == ["devices"]:
+            if not data.get("udid") or not data.get("name"):
+                return self._send_json(400, {"error": "缺少 name 或 udid"})
+            job, coalesced = self.server.manager.submit(
+                apple_id, devices={data["udid"]: data["name"]}, resign=bool(data.get("resign", False))
+            )
+        elif parts == ["resign"]:
+            job, coalesced = self.server.manager.submit(apple_id, resign=True)
+        else:
+            return self._send_json(404, {"error": "找不到路徑"})
+        self._send_json(202, {"job": job.to_dict(), "coalesced": coalesced})
+
+    def _stream_events(self, job):
+        """ 以 chunked NDJSON 推送進度，直到工作結束 """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        while True:
+            events, finished = job.wait_events(sent, timeout=15)
+            for event in events:
+                line = json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+            sent += len(events)
+            if finished and not events:
+                break
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_ipa(self, job):
+        if not job.ipa_path or not os.path.exists(job.ipa_path):
+            return self._send_json(409 if not job.finished else 404, {"error": "IPA 尚未產生"})
+        with open(job.ipa_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Disposition", f'attachment; filename="{job.apple_id.split("@")[0]}.ipa"')
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            while chunk := f.read(1024 * 1024):
+                self.wfile.write(chunk)
+
+
+class ApiServer(ThreadingHTTPServer):
+    """ 🌐 本地 HTTP API 伺服器，依賴的動作都可注入，方便以假簽名器與替身 API 測試 """
+
+    daemon_threads = True
+
+    def __init__(self, host=None, port=None, manager=None, get_accounts=None):
+        host = host or config.api_server_host
+        port = config.api_server_port if port is None else port
+        super().__init__((host, port), _ApiHandler)
+        self.manager = manager or JobManager(max_workers=config.api_server_workers or 4)
+        self.get_accounts = get_accounts or _default_get_accounts
+
+
+def run_api_server(host=None, port=None):
+    """ 🚀 以前景方式啟動本地 HTTP API """
+    server = ApiServer(host, port)
+    logging.info(f"✅ HTTP API 已啟動: http://{server.server_address[0]}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.manager.shutdown()
+        logging.info("🛑 HTTP API 已停止")
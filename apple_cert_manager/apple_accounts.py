@@ -3,10 +3,6 @@ import os
 import json
 import sys
 import logging
-import concurrent.futures
-from . import match
-from . import local_file
-from . import certificate
 from . import database
 from apple_cert_manager.config import config
 from datetime import datetime
@@ -68,8 +64,8 @@ def get_account_by_apple_id(apple_id):
         raise
 
 @ensure_database_initialized
-def insert_account(apple_id, issuer_id, key_id):
-    """ 🚀 插入 Apple 開發者帳號，如果已存在則跳過 """
+def insert_account(apple_id, issuer_id, key_id, match=True):
+    """ 🚀 插入 Apple 開發者帳號，如果已存在則跳過；match=False 時只寫入資料庫，不建立憑證與 profile """
     try:
         conn = sqlite3.connect(config.db_path)
         cursor = conn.cursor()
@@ -90,7 +86,9 @@ def insert_account(apple_id, issuer_id, key_id):
         conn.commit()
         conn.close()
         logger.info(f"✅ 新增 Apple ID `{apple_id}` 成功")
-        match.match_apple_account(apple_id)
+        if match:
+            from . import match as match_  # 延遲載入：查詢類指令不需要載入憑證 / 網路相關模組
+            match_.match_apple_account(apple_id)
         return True  # ✅ 插入成功
 
     except sqlite3.Error as e:
@@ -154,7 +152,7 @@ def clear_cert_id(apple_id):
         
 
 def insert_from_json(json_path=None):
-    """ 🚀 從 JSON 批量插入 Apple 帳號（不覆蓋現有帳號），插入後並行執行 match.match_apple_account """
+    """ 🚀 從 JSON 批量插入 Apple 帳號（不覆蓋現有帳號），插入後以 cert_pipeline 批量建立憑證與 profile """
 
     json_path = json_path or config.JSON_PATH  # ✅ 預設 JSON 檔案
     if not os.path.exists(json_path):
@@ -167,16 +165,17 @@ def insert_from_json(json_path=None):
             if not isinstance(accounts, list):
                 logger.info("❌ JSON 格式錯誤，應該是陣列")
                 return
-
-            # 🚀 使用 ThreadPoolExecutor 來並行插入帳號
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                list(executor.map(lambda acc: insert_account(
-                    acc.get("apple_id"),
-                    acc.get("issuer_id"),
-                    acc.get("key_id")
-                ), accounts))
         except json.JSONDecodeError:
             logger.info("❌ JSON 解析錯誤")
+            return
+
+    # ✅ 先寫入資料庫（很快），再把新帳號交給分階段的工作池建立憑證與 profile
+    inserted = [
+        acc.get("apple_id") for acc in accounts
+        if insert_account(acc.get("apple_id"), acc.get("issuer_id"), acc.get("key_id"), match=False)
+    ]
+    from . import cert_pipeline  # 延遲載入：查詢類指令不需要載入憑證 / 網路相關模組
+    return cert_pipeline.match_accounts(inserted)
 
 
 @ensure_database_initialized
@@ -195,6 +194,7 @@ def delete_account(apple_id):
         return False
 
     cert_id = row[0]  # 取得 `cert_id`
+    from . import auth, certificate, local_file
     # ✅ 如果 `cert_id` 存在，則刪除本地憑證檔案
     if cert_id:
         certificate.remove_keychain_certificate_by_id(cert_id)
@@ -203,6 +203,7 @@ def delete_account(apple_id):
     cursor.execute("DELETE FROM accounts WHERE apple_id = ?", (apple_id,))
     conn.commit()
     conn.close()
+    auth.clear_token_cache(apple_id)
     logger.info(f"✅ 已刪除 Apple ID: {apple_id}")
 
     
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from apple_cert_manager.config import config
+
+logging = logging.getLogger(__name__)
+
+# 串流計算雜湊時每次讀取的大小
+CHUNK_SIZE = 1024 * 1024
+# manifest 格式版本（欄位有變動時遞增，舊的 manifest 直接視為不符）
+# v2：來源 IPA 改用中央目錄指紋
+MANIFEST_VERSION = 2
+
+# ✅ 檔案雜湊快取：(路徑, 大小, mtime) 不變就不必重讀（批量重簽名時每個帳號都用同一個來源 IPA）
+_digest_cache = {}
+_digest_lock = threading.Lock()
+# 同一個檔案只讓一個執行緒計算：依路徑分配到固定數量的鎖，不會隨處理過的檔案數增加
+DIGEST_LOCK_STRIPES = 64
+_digest_locks = [threading.Lock() for _ in range(DIGEST_LOCK_STRIPES)]
+
+
+def file_digest(path):
+    """ 串流計算檔案的 SHA-256，內容未變更時直接使用快取 """
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    with _digest_locks[hash(key[0]) % DIGEST_LOCK_STRIPES]:  # 其他執行緒等結果
+        with _digest_lock:
+            if key in _digest_cache:
+                return _digest_cache[key]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with _digest_lock:
+            _digest_cache[key] = digest
+    return digest
+
+def input_key(inputs):
+    """ 把所有輸入的雜湊合成單一鍵值 """
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def store_dir():
+    """ 快取根目錄（產物、manifest 與來源 IPA 指紋都放在這裡） """
+    return config.artifact_dir_path or os.path.join(config.ipa_dir_path, ".artifacts")
+
+def _object_path(digest):
+    return os.path.join(store_dir(), "objects", digest[:2], f"{digest}.ipa")
+
+def _manifest_path(apple_id):
+    return os.path.join(store_dir(), "manifests", f"{apple_id}.json")
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _link_or_copy(source, destination):
+    """ 同一個檔案系統用 hard link（不複製內容），否則複製 """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def load_manifest(apple_id):
+    """ 讀取帳號上次重簽名的 manifest，不存在或格式錯誤時回傳 None """
+    try:
+        with open(_manifest_path(apple_id), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def lookup(apple_id, inputs):
+    """ 🔍 輸入與上次相同且產物仍在時，回傳快取產物的路徑 """
+    manifest = load_manifest(apple_id)
+    if not manifest or manifest.get("input_key") != input_key(inputs):
+        return None
+    object_path = _object_path(manifest["output"])
+    if not os.path.exists(object_path):
+        return None
+    os.utime(object_path)  # 更新最後使用時間，GC 依此判斷
+    return object_path
+
+def store(apple_id, inputs, output_path):
+    """ 💾 把產物依內容雜湊存入儲存區並更新帳號的 manifest，回傳產物雜湊 """
+    digest = file_digest(output_path)
+    object_path = _object_path(digest)
+    if os.path.exists(object_path):
+        os.utime(object_path)
+    else:
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp_path = f"{object_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        _link_or_copy(output_path, tmp_path)
+        os.replace(tmp_path, object_path)
+    _write_atomic(_manifest_path(apple_id), {
+        "version": MANIFEST_VERSION,
+        "apple_id": apple_id,
+        "inputs": inputs,
+        "input_key": input_key(inputs),
+        "output": digest,
+        "output_size": os.path.getsize(object_path),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    return digest
+
+def materialize(object_path, output_path):
+    """ 把快取的產物放到輸出位置 """
+    if os.path.exists(output_path):
+        if os.path.samefile(object_path, output_path):
+            return output_path
+        os.remove(output_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    _link_or_copy(object_path, output_path)
+    return output_path
+
+def gc(max_age_days=None, max_size_mb=None, dry_run=False):
+    """ 🧹 清理產物：超過 max_age_days 沒被使用的先刪，總量超過 max_size_mb 時再從最舊的開始刪
+
+    沒有被任何 manifest 參照的舊產物會優先刪除；參數為 0 代表不限制。
+
+    Returns:
+        dict: 刪除的檔案數、釋放的空間與剩餘的檔案數、大小。
+    """
+    max_age_days = config.artifact_max_age_days if max_age_days is None else max_age_days
+    max_size_mb = config.artifact_max_size_mb if max_size_mb is None else max_size_mb
+    objects_dir = os.path.join(store_dir(), "objects")
+    manifests_dir = os.path.join(store_dir(), "manifests")
+
+    referenced = set()
+    if os.path.isdir(manifests_dir):
+        for name in os.listdir(manifests_dir):
+            if name.endswith(".json"):
+                manifest = load_manifest(name[:-len(".json")])
+                if manifest:
+                    referenced.add(manifest["output"])
+
+    now = time.time()
+    objects = []
+    if os.path.isdir(objects_dir):
+        for root, _, files in os.walk(objects_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                if name.endswith(".tmp"):
+                    if now - stat.st_mtime > 3600:  # 中斷的寫入
+                        objects.append((path, stat.st_size, 0, False))
+                    continue
+                objects.append((path, stat.st_size, stat.st_mtime, name[:-len(".ipa")] in referenced))
+
+    removed = []
+    if max_age_days:
+        cutoff = now - max_age_days * 86400
+        removed = [obj for obj in objects if obj[2] < cutoff]
+    remaining = [obj for obj in objects if obj not in removed]
+    if max_size_mb:
+        budget = max_size_mb * 1024 * 1024
+        total = sum(obj[1] for obj in remaining)
+        # 未被參照的優先，其次依最後使用時間由舊到新
+        for obj in sorted(remaining, key=lambda obj: (obj[3], obj[2])):
+            if total <= budget:
+                break
+            removed.append(obj)
+            total -= obj[1]
+        remaining = [obj for obj in remaining if obj not in removed]
+
+    for path, size, _, _ in removed:
+        if dry_run:
+            logging.info(f"🧹 (dry run) 將刪除: {path} ({size} bytes)")
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"⚠️ 刪除產物失敗: {path}: {e}")
+    result = {
+        "removed": len(removed),
+        "freed_bytes": sum(obj[1] for obj in removed),
+        "remaining": len(remaining),
+        "remaining_bytes": sum(obj[1] for obj in remaining),
+    }
+    logging.info(f"🧹 產物清理完成: 刪除 {result['removed']} 個（{result['freed_bytes']} bytes），"
+                 f"剩餘 {result['remaining']} 個（{result['remaining_bytes']} bytes）")
+    return result
@@ -1,12 +1,41 @@
-import jwt
 import os
 import logging
+import threading
+import time
 from apple_cert_manager.config import config 
 from . import apple_accounts
 from datetime import datetime, timedelta
 
 logging = logging.getLogger(__name__)
 
+# Token 有效期 20 分鐘，剩餘不足 5 分鐘時重新產生
+TOKEN_LIFETIME = timedelta(minutes=20)
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+# ✅ 快取已產生的 token，常駐模式下可重複使用，避免每次都讀 .p8 與查資料庫
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+def get_token(apple_id):
+    """ 取得快取中的 JWT Token，過期前自動重新產生 """
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(apple_id)
+        if cached and cached[1] - now > TOKEN_REFRESH_MARGIN:
+            return cached[0]
+    token = generate_token(apple_id)
+    with _token_cache_lock:
+        _token_cache[apple_id] = (token, now + TOKEN_LIFETIME.total_seconds())
+    return token
+
+def clear_token_cache(apple_id=None):
+    """ 清除 token 快取（帳號刪除或金鑰更換時使用） """
+    with _token_cache_lock:
+        if apple_id is None:
+            _token_cache.clear()
+        else:
+            _token_cache.pop(apple_id, None)
+
 
 def generate_token(apple_id):
     """ 生成 JWT Token 用於 App Store Connect API """
@@ -27,7 +56,7 @@ def generate_token(apple_id):
     payload = {
         "iss": issuer_id,
         "iat": datetime.utcnow(),
-        "exp": datetime.utcnow() + timedelta(minutes=20),
+        "exp": datetime.utcnow() + TOKEN_LIFETIME,
         "aud": "appstoreconnect-v1",
     }
     headers = {
@@ -36,5 +65,6 @@ def generate_token(apple_id):
         "typ": "JWT",
     }
 
+    import jwt  # PyJWT + cryptography 載入較慢，需要簽發 token 時才載入
     token = jwt.encode(payload, private_key, algorithm="ES256", headers=headers)
     return token
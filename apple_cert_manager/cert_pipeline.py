@@ -0,0 +1,205 @@
+import os
+import time
+import queue
+import logging
+import threading
+import contextvars
+from apple_cert_manager.config import config
+from . import apple_accounts
+from . import certificate
+from . import profile
+from . import metrics
+from .logging_config import log_context, new_job_id
+
+logging = logging.getLogger(__name__)
+
+# 每個階段的佇列最多放幾倍於工作數的項目（避免產生金鑰遠遠超前 API 呼叫）
+QUEUE_FACTOR = 2
+_DONE = object()
+
+
+class Pipeline:
+    """ 🏭 以佇列串接的多階段工作池：每個階段有自己的執行緒數，項目完成一個階段就交給下一個階段
+
+    一般階段的函式接收並回傳同一個 job（dict）；拋出例外時該 job 停止，記錄失敗的階段與錯誤。
+    批次階段（batch=True）會把佇列中已到達的 job 一起交給函式，函式回傳與 jobs 對應的錯誤列表（成功為 None）。
+    """
+
+    def __init__(self, stages):
+        self.stages = [stage if len(stage) == 4 else (*stage, False) for stage in stages]  # [(名稱, 函式, 執行緒數, 批次)]
+        self.queues = [queue.Queue(maxsize=max(workers * QUEUE_FACTOR, 1)) for _, _, workers, _ in self.stages]
+        self.results = []
+        self._lock = threading.Lock()
+        self._finished_workers = [0] * len(self.stages)
+
+    def _finish(self, job, error=None, stage=None):
+        job["status"] = "failed" if error else "succeeded"
+        job["error"] = str(error) if error else None
+        job["failed_stage"] = stage
+        job["seconds"] = round(time.perf_counter() - job.pop("_started"), 3)
+        with self._lock:
+            self.results.append(job)
+
+    def _process(self, index, jobs):
+        name, func, _, batch = self.stages[index]
+        if batch:
+            try:
+                with metrics.span(name, batch=len(jobs)):
+                    errors = func(jobs)
+            except Exception as e:
+                errors = [e] * len(jobs)
+            outcomes = list(zip(jobs, errors))
+        else:
+            job, error = jobs[0], None
+            with log_context(apple_id=job["apple_id"], job_id=job["job_id"]):
+                try:
+                    with metrics.span(name):
+                        job = func(job)
+                except Exception as e:
+                    error = e
+            outcomes = [(job, error)]
+        for job, error in outcomes:
+            if error:
+                with log_context(apple_id=job["apple_id"], job_id=job["job_id"]):
+                    logging.error(f"❌ {name} 失敗: {error}")
+                self._finish(job, error, name)
+            elif index + 1 < len(self.stages):
+                self.queues[index + 1].put(job)
+            else:
+                self._finish(job)
+
+    def _worker(self, index):
+        _, _, workers, batch = self.stages[index]
+        inbox = self.queues[index]
+        finished = False
+        while not finished:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            jobs = [job]
+            while batch:
+                try:
+                    job = inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _DONE:
+                    finished = True
+                    break
+                jobs.append(job)
+            self._process(index, jobs)
+        # 這個階段的最後一個執行緒結束後，才通知下一個階段收工
+        with self._lock:
+            self._finished_workers[index] += 1
+            last = self._finished_workers[index] == workers
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1][2]):
+                self.queues[index + 1].put(_DONE)
+
+    def run(self, jobs):
+        threads = []
+        for index, (name, _, workers, _) in enumerate(self.stages):
+            for number in range(workers):
+                # 工作執行緒沿用呼叫端的 context（例如 metrics.collect 的範圍）
+                thread = threading.Thread(target=contextvars.copy_context().run, args=(self._worker, index),
+                                          name=f"{name}-{number}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        for job in jobs:
+            job["_started"] = time.perf_counter()
+            self.queues[0].put(job)
+        for _ in range(self.stages[0][2]):
+            self.queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        return self.results
+
+
+def _needs_certificate(apple_id):
+    account = apple_accounts.get_account_by_apple_id(apple_id)
+    cert_id = account["cert_id"]
+    return not cert_id or not os.path.exists(certificate.get_cert_path(cert_id))
+
+def _keygen(job):
+    """ CPU：產生私鑰與 CSR """
+    if job["needs_cert"]:
+        job["request"] = certificate.prepare_csr(job["apple_id"])
+    return job
+
+def _submit(job):
+    """ 網路：刪除多餘的舊憑證並提交 CSR """
+    if job["needs_cert"]:
+        job["cert_id"] = certificate.request_certificate(job["request"])
+    return job
+
+def _install(jobs):
+    """ 鑰匙圈：已到達的帳號合併成一批導入（Keychain 每個分片只解鎖一次，身分庫只更新一次索引）並寫回資料庫 """
+    pending = [job for job in jobs if job["needs_cert"]]
+    errors = {}
+    if pending:
+        results = certificate.import_identities([
+            (job["request"]["private_key"], job["cert_id"]) for job in pending
+        ])
+        for job, error in zip(pending, results):
+            job.pop("request")  # 私鑰已導入 Keychain 或身分庫，不再保留在記憶體
+            if error:
+                errors[job["apple_id"]] = error
+                continue
+            with log_context(apple_id=job["apple_id"], job_id=job["job_id"]):
+                try:
+                    apple_accounts.update_cert_id(job["apple_id"], job["cert_id"])
+                    logging.info(f"✅ 已建立帳號: {job['apple_id']} 新的憑證✅")
+                except Exception as e:
+                    errors[job["apple_id"]] = e
+    return [errors.get(job["apple_id"]) for job in jobs]
+
+def _provision(job):
+    """ 網路：建立描述檔 """
+    profile.get_provisioning_profile(job["apple_id"])
+    logging.info(f"✅ 已建立帳號: {job['apple_id']} 新的憑證與profile檔案✅")
+    return job
+
+def match_accounts(apple_ids, keygen_workers=None, api_workers=None):
+    """ 🚀 為多個帳號建立憑證與描述檔（match.match_apple_account 的批量版）
+
+    產生金鑰（CPU）、提交 CSR 與建立描述檔（網路）、導入鑰匙圈（單一執行緒、批次導入）分成各自的工作池，
+    以佇列串接：第一個帳號的金鑰產生完就開始呼叫 API，不必等整批帳號依序跑完。
+    已有憑證的帳號會略過前三個階段，只更新描述檔。
+
+    Returns:
+        list: 每個帳號的結果（apple_id、cert_id、status、error、failed_stage、seconds）。
+    """
+    keygen_workers = keygen_workers or config.cert_keygen_workers or os.cpu_count() or 1
+    api_workers = api_workers or config.cert_api_workers or 8
+    jobs = []
+    for apple_id in apple_ids:
+        jobs.append({
+            "apple_id": apple_id,
+            "job_id": new_job_id(),
+            "needs_cert": _needs_certificate(apple_id),
+            "cert_id": None,
+        })
+    if not jobs:
+        return []
+
+    logging.info(f"🏭 開始批量設定 {len(jobs)} 個帳號（需要新憑證 {sum(job['needs_cert'] for job in jobs)} 個），"
+                 f"產生金鑰 {keygen_workers} 個執行緒，API {api_workers} 個執行緒")
+    started = time.perf_counter()
+    pipeline = Pipeline([
+        ("keygen", _keygen, keygen_workers),
+        ("submit_csr", _submit, api_workers),
+        ("keychain_import", _install, 1, True),
+        ("provision", _provision, api_workers),
+    ])
+    with metrics.collect() as run_spans:
+        results = sorted(pipeline.run(jobs), key=lambda job: job["apple_id"])
+    for job in results:
+        job.pop("request", None)
+        job.pop("needs_cert", None)
+
+    failed = [job for job in results if job["status"] == "failed"]
+    logging.info(f"🏭 批量設定完成：成功 {len(results) - len(failed)}，失敗 {len(failed)}，"
+                 f"總耗時 {time.perf_counter() - started:.1f} 秒")
+    for job in failed:
+        logging.error(f"❌ {job['apple_id']} 於 {job['failed_stage']} 失敗: {job['error']}")
+    logging.info(run_spans.format_summary("批量設定各階段耗時"))
+    return results
@@ -1,16 +1,22 @@
-import subprocess
 import os
 from . import auth
 import re
 import hashlib
 import base64
 import logging
-from . import apple_accounts
+from logging import DEBUG
 from . import local_file
 from apple_cert_manager.http_client import http_client
 from apple_cert_manager.config import config 
 from . import keychain
+from . import keychain_shards
+from . import identity_store
+from . import runner
 from datetime import datetime
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
         
 logging = logging.getLogger(__name__)
         
@@ -26,8 +32,8 @@ def revoke_certificate(apple_id, cert_id):
         requests.exceptions.RequestException: 如果 API 請求失敗。
     """
     try:
-        token = auth.generate_token(apple_id)
-        url = f"https://api.appstoreconnect.apple.com/v1/certificates/{cert_id}"
+        token = auth.get_token(apple_id)
+        url = f"{config.api_base_url}/certificates/{cert_id}"
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
         http_client.delete(url, headers=headers)
         logging.info(f"成功刪除遠端憑證 ID: {cert_id}")
@@ -103,18 +109,20 @@ def list_certificates(apple_id):
         requests.exceptions.RequestException: 如果 API 請求失敗。
         KeyError: 如果回應格式無效。
     """
-    url = "https://api.appstoreconnect.apple.com/v1/certificates"
+    url = f"{config.api_base_url}/certificates"
     try:
-        token = auth.generate_token(apple_id)
+        token = auth.get_token(apple_id)
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        response = http_client.get(url, headers=headers)  # 使用 http_client，內含超時和重試
-        data = response.json()
+        data = http_client.get_json(url, headers=headers)  # 使用 http_client，內含超時、重試與同時請求合併
         if "data" not in data:
             raise KeyError("list_certificates 無效的 API 回應格式，缺少 'data' 鍵")
         certificates = data["data"]
         logging.info(f"成功獲取 {len(certificates)} 個憑證，Apple ID: {apple_id}")
-        for cert in certificates:
-            logging.info(f"憑證ID: {cert['id']}, 名稱: {cert['attributes']['name']} 類型: {cert['attributes']['certificateType']} 到期日期: {format_expiration_date(cert['attributes']['expirationDate'])}")
+        if logging.isEnabledFor(DEBUG):  # 逐筆明細只在 DEBUG 輸出，避免批次時的格式化成本
+            for cert in certificates:
+                attributes = cert['attributes']
+                logging.debug("憑證ID: %s, 名稱: %s 類型: %s 到期日期: %s", cert['id'], attributes['name'],
+                              attributes['certificateType'], format_expiration_date(attributes['expirationDate']))
         return certificates
     except Exception as e:
         raise Exception.error(f"獲取憑證列表時發生錯誤: {e}")
@@ -132,17 +140,23 @@ def filter_distribution_certificates(certificates):
         cert for cert in certificates if cert['attributes']['certificateType'] in ["DISTRIBUTION", "IOS_DISTRIBUTION"]
     ]
 
-def find_private_key(cert_name, keychain_path):
+def find_private_key(cert_name, keychain_path=None):
     """搜尋私鑰。
 
+    IDENTITY_BACKEND=file 時直接查詢記憶體中的身分庫索引，不需要 `security`。
+
     Args:
         cert_name (str): 憑證名稱。
+        keychain_path (str): 要搜尋的 Keychain（僅 IDENTITY_BACKEND=keychain 使用）。
 
     Returns:
         str or None: 私鑰的 SHA-1 哈希值，若未找到則返回 None。
     """
+    if config.identity_backend == "file":
+        return identity_store.find_by_name(cert_name)
+    keychain_path = keychain_path or os.path.expanduser(config.keychain_path)
     search_command = ["security", "find-identity", "-v", "-p", "codesigning", keychain_path]
-    result = subprocess.run(search_command, capture_output=True, text=True)
+    result = runner.run(search_command, check=False)
     if result.returncode == 0:
         for line in result.stdout.split('\n'):
             if cert_name in line:
@@ -164,7 +178,7 @@ def get_cert_name_from_file(cert_file_path):
         logging.warning(f"憑證檔案不存在: {cert_file_path}")
         return None
     get_cert_name_command = ["openssl", "x509", "-noout", "-subject", "-in", cert_file_path]
-    result = subprocess.run(get_cert_name_command, capture_output=True, text=True)
+    result = runner.run(get_cert_name_command, check=False)
     common_name_match = re.search(r"CN\s?=\s?([^,]+)", result.stdout)
     cert_name = common_name_match.group(1).strip() if common_name_match else None
     if cert_name:
@@ -191,7 +205,7 @@ def get_cer_sha1(cert_id):
     return sha1.hexdigest().upper()
 
 def remove_keychain_certificate(cert):
-    """從 macOS Keychain 刪除指定的憑證與私鑰。
+    """從 macOS Keychain（IDENTITY_BACKEND=file 時為身分庫）刪除指定的憑證與私鑰。
 
     Args:
         cert (dict): 憑證資料，包含 'attributes' 鍵。
@@ -201,26 +215,41 @@ def remove_keychain_certificate(cert):
         raise ValueError("無效的憑證資料，缺少 'attributes' 或 'name'")
     
     cert_name = cert['attributes']['name']
-    keychain_path = os.path.expanduser(config.keychain_path)
-    keychain.unlock_keychain()
+    if config.identity_backend == "file":
+        cert_id = cert.get('id') or identity_store.lookup_sha1(find_private_key(cert_name) or "")
+        if cert_id and identity_store.remove(cert_id):
+            logging.info(f"成功刪除憑證 '{cert_name}' 的私鑰和相關聯身份")
+        else:
+            logging.error(f"未找到與憑證名稱 '{cert_name}' 相關的私鑰")
+        return
+    keychain_path = keychain_shards.keychain_for(cert['id']) if 'id' in cert else os.path.expanduser(config.keychain_path)
+    keychain.unlock_keychain(keychain_path)
     key_hash = find_private_key(cert_name, keychain_path)
     if key_hash:
         delete_identity_command = ["security", "delete-identity", "-Z", key_hash, keychain_path]
-        subprocess.run(delete_identity_command, check=True, capture_output=True, text=True)
+        runner.run(delete_identity_command)
         logging.info(f"成功刪除憑證 '{cert_name}' 的私鑰和相關聯身份")
+        if 'id' in cert:
+            keychain_shards.forget(cert['id'])
     else:
         logging.error(f"未找到與憑證名稱 '{cert_name}' 相關的私鑰")
     
 
 def remove_keychain_certificate_by_id(cert_id):
-    """透過 `cert_id` 刪除 macOS Keychain 中的憑證與私鑰。
+    """透過 `cert_id` 刪除 macOS Keychain（IDENTITY_BACKEND=file 時為身分庫）中的憑證與私鑰。
 
     Args:
         cert_id (str): 憑證 ID。
     """
-    keychain_path = os.path.expanduser(config.keychain_path)
+    if config.identity_backend == "file":
+        if identity_store.remove(cert_id):
+            logging.info(f"成功刪除憑證 ID '{cert_id}' 的私鑰和相關聯身份")
+        else:
+            logging.error(f"身分庫中沒有憑證 ID '{cert_id}' 的私鑰")
+        return
+    keychain_path = keychain_shards.keychain_for(cert_id)
     cert_file_path = get_cert_path(cert_id)
-    keychain.unlock_keychain()
+    keychain.unlock_keychain(keychain_path)
     cert_name = get_cert_name_from_file(cert_file_path)
     if not cert_name:
         logging.error(f"無法從 `.cer` 檔案 '{cert_file_path}' 讀取憑證名稱")
@@ -228,12 +257,29 @@ def remove_keychain_certificate_by_id(cert_id):
     
     key_hash = find_private_key(cert_name, keychain_path)
     if not key_hash:
+        # 身分已經不在 Keychain 中：只移除分片紀錄，不要以空的雜湊執行 delete-identity
         logging.error(f"未找到與憑證名稱 '{cert_name}' 相關的私鑰")
+        keychain_shards.forget(cert_id)
+        return
     
     delete_identity_command = ["security", "delete-identity", "-Z", key_hash, keychain_path]
-    subprocess.run(delete_identity_command, check=True, capture_output=True, text=True)
+    runner.run(delete_identity_command)
+    keychain_shards.forget(cert_id)
     logging.info(f"成功刪除憑證 ID '{cert_id}' 的私鑰和相關聯身份")
     
+def import_identities(identities):
+    """導入私鑰與憑證：依 IDENTITY_BACKEND 存入 Keychain 分片或身分庫。
+
+    Args:
+        identities (list): [(私鑰物件, 憑證 ID)]。
+
+    Returns:
+        list: 與 identities 對應的錯誤（成功為 None）。
+    """
+    if config.identity_backend == "file":
+        return identity_store.import_identities(identities)
+    return keychain_shards.import_identities(identities)
+
 def get_cert_path(cert_id):
     """生成憑證檔案路徑。
 
@@ -245,62 +291,39 @@ def get_cert_path(cert_id):
     """
     return os.path.join(config.cert_dir_path, f"{cert_id}.cer")
 
-def generate_csr(apple_id, csr_path, private_key_path):
-    """使用 OpenSSL 生成 CSR (憑證請求) 和私鑰。
+def generate_csr(apple_id):
+    """在記憶體中生成私鑰與 CSR (憑證請求)，私鑰不會寫入磁碟。
 
     Args:
         apple_id (str): Apple 開發者帳號 ID。
-        csr_path (str): CSR 檔案儲存路徑。
-        private_key_path (str): 私鑰儲存路徑。
 
-    Raises:
-        subprocess.CalledProcessError: 如果 OpenSSL 命令失敗。
-        subprocess.TimeoutExpired: 如果命令超時。
-        OSError: 如果檔案操作失敗。
+    Returns:
+        tuple: (RSA 私鑰物件, DER 格式的 CSR)。
     """
-    logging.info("正在生成私鑰...")
-    private_key_cmd = ["openssl", "genrsa", "-out", private_key_path, "2048"]
-    subprocess.run(private_key_cmd, check=True, capture_output=True, text=True, timeout=30)
-    if not os.path.exists(private_key_path) or os.path.getsize(private_key_path) == 0:
-        raise OSError(f"私鑰檔案未成功生成: {private_key_path}")
-    logging.info(f"私鑰已生成: {private_key_path}")
-    logging.info("正在生成 CSR...")
-    subject = f"/CN=Apple Development: {apple_id}"
-    csr_cmd = [
-        "openssl", "req", "-new", "-key", private_key_path, "-out", csr_path,
-        "-subj", subject, "-nodes", "-batch"
-    ]
-    subprocess.run(csr_cmd, check=True, capture_output=True, text=True, timeout=30)
-    if not os.path.exists(csr_path) or os.path.getsize(csr_path) == 0:
-        raise OSError(f"CSR 檔案未成功生成: {csr_path}")
-    logging.info(f"CSR 已生成: {csr_path}")
-    
-def submit_csr_to_apple(token, csr_path):
+    logging.info("正在生成私鑰與 CSR...")
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, f"Apple Development: {apple_id}")])
+    csr = x509.CertificateSigningRequestBuilder().subject_name(subject).sign(private_key, hashes.SHA256())
+    logging.info("私鑰與 CSR 已生成")
+    return private_key, csr.public_bytes(serialization.Encoding.DER)
+
+def submit_csr_to_apple(token, csr):
     """把 CSR 提交至 Apple 產生憑證。
 
     Args:
         token (str): JWT token。
-        csr_path (str): CSR 檔案路徑。
+        csr (bytes): DER 格式的 CSR。
 
     Returns:
         str: 新憑證的 ID。
 
     Raises:
-        FileNotFoundError: 如果 CSR 檔案不存在。
         requests.exceptions.RequestException: 如果 API 請求失敗。
     """
-    if not os.path.exists(csr_path):
-        raise FileNotFoundError(f"CSR 檔案不存在: {csr_path}")
-    
     logging.info("向 Apple 提交 CSR，請求新憑證...")
-    with open(csr_path, "rb") as f:
-        csr_raw_content = f.read()
-    csr_text = csr_raw_content.decode('utf-8', errors='ignore')
-    clean_csr = csr_text.replace("-----BEGIN CERTIFICATE REQUEST-----", "") \
-                        .replace("-----END CERTIFICATE REQUEST-----", "") \
-                        .replace("\n", "").strip()
+    clean_csr = base64.b64encode(csr).decode("ascii")
     
-    url = "https://api.appstoreconnect.apple.com/v1/certificates"
+    url = f"{config.api_base_url}/certificates"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     payload = {
         "data": {
@@ -324,9 +347,37 @@ def submit_csr_to_apple(token, csr_path):
     logging.info(f"憑證建立成功！憑證 ID: {cert_id}，已儲存於: {cert_path}")
     return cert_id
     
+def prepare_csr(apple_id):
+    """產生私鑰與 CSR（CPU 密集），回傳後續步驟需要的資料。
+
+    Args:
+        apple_id (str): Apple 開發者帳號 ID。
+
+    Returns:
+        dict: apple_id、private_key（私鑰物件，只存在記憶體）、csr（DER）。
+    """
+    private_key, csr = generate_csr(apple_id)
+    return {"apple_id": apple_id, "private_key": private_key, "csr": csr}
+
+def request_certificate(request):
+    """刪除多餘的舊憑證後提交 CSR（網路密集），回傳新憑證的 ID。
+
+    Args:
+        request (dict): prepare_csr 的回傳值。
+
+    Returns:
+        str: 新憑證的 ID。
+    """
+    apple_id = request["apple_id"]
+    revoke_oldest_distribution_certificate(apple_id)
+    token = auth.get_token(apple_id)
+    return submit_csr_to_apple(token, request["csr"])
+
 def create_certificate(apple_id):
     """透過 Apple API 創建 iOS Distribution 憑證。
 
+    大量帳號請改用 cert_pipeline，產生金鑰、提交 CSR 與導入鑰匙圈會在各自的工作池同時進行。
+
     Args:
         apple_id (str): Apple 開發者帳號 ID。
 
@@ -337,32 +388,13 @@ def create_certificate(apple_id):
         Exception: 如果創建流程失敗。
     """
     logging.info("開始創建憑證流程...")
-    account = apple_accounts.get_account_by_apple_id(apple_id)
-    key_id = account['key_id']
-    certs_dir = config.cert_dir_path
-    csr_path = os.path.join(certs_dir, f"{key_id}.certSigningRequest")
-    private_key_path = os.path.join(certs_dir, f"{key_id}.pem")
     try:
-        revoke_oldest_distribution_certificate(apple_id)
-        generate_csr(apple_id, csr_path, private_key_path)
-        token = auth.generate_token(apple_id)
-        cert_id = submit_csr_to_apple(token, csr_path)
-        cert_path = get_cert_path(cert_id)
-        keychain.import_cert_to_keychain(private_key_path, cert_path)
+        request = prepare_csr(apple_id)
+        cert_id = request_certificate(request)
+        error = import_identities([(request["private_key"], cert_id)])[0]
+        if error:
+            raise error
         logging.info("憑證創建流程完成")
         return cert_id
     except Exception as e:
         raise Exception(f"憑證創建失敗: {apple_id} 錯誤:{e}")
-    finally:
-        for path in [csr_path, private_key_path]:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except OSError as e:
-                    logging.error(f"刪除檔案失敗: {path}, 錯誤: {e}")
-    
-
-
-
-
-
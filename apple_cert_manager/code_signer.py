@@ -0,0 +1,130 @@
+import os
+import logging
+import plistlib
+import subprocess
+import concurrent.futures
+from apple_cert_manager.config import config
+from . import identity_store
+from . import keychain_shards
+from . import runner
+
+logging = logging.getLogger(__name__)
+
+
+class CodesignSigner:
+    """ 🔏 使用 `codesign` 與憑證所在的 Keychain 分片簽名（只能在 macOS 執行） """
+
+    name = "codesign"
+
+    def __init__(self, signing_identity, cert_id):
+        self.signing_identity = signing_identity
+        self.keychain_path = keychain_shards.keychain_for(cert_id)
+
+    def validate(self):
+        try:
+            output = runner.run(
+                ["security", "find-identity", "-v", "-p", "codesigning"] + ([self.keychain_path] if self.keychain_path else [])
+            ).stdout
+        except subprocess.CalledProcessError as e:
+            logging.error(f"無法驗證簽名身份: {e.stderr or e.stdout or str(e)}")
+            raise
+        if self.signing_identity not in output:
+            raise ValueError(f"簽名身份無效或不在鑰匙圈中: {self.signing_identity}")
+        logging.info(f"簽名身份驗證通過: {self.signing_identity}")
+
+    def prepare(self):
+        # 只準備這個憑證所在的分片，不改寫整個搜尋列表，並行的簽名工作互不干擾
+        keychain_shards.prepare(self.keychain_path)
+
+    def command(self, path, entitlements_path=None):
+        if entitlements_path:
+            return [
+                "codesign", "--force", "--sign", self.signing_identity,
+                "--entitlements", entitlements_path, "--keychain", self.keychain_path,
+                "--generate-entitlement-der", "--timestamp", "--options", "runtime",
+                path
+            ]
+        return [
+            "codesign", "--force", "--sign", self.signing_identity,
+            "--keychain", self.keychain_path, "--generate-entitlement-der",
+            path
+        ]
+
+    def sign(self, path, entitlements_path=None):
+        try:
+            runner.run(self.command(path, entitlements_path))
+        except subprocess.CalledProcessError as e:
+            logging.error(f"簽名應用失敗: {path}: {e.stderr or e.stdout or str(e)}")
+            raise
+
+    def sign_many(self, paths, entitlements_path=None, description=""):
+        """ 同一層、彼此獨立的 bundle 在一個事件迴圈內同時簽名 """
+        try:
+            runner.run_many([self.command(path, entitlements_path) for path in paths],
+                            max_concurrency=config.codesign_concurrency or None)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"簽名{description}失敗: {e.cmd[-1]}: {e.stderr or e.stdout or str(e)}")
+            raise
+
+
+class PythonSigner:
+    """ 🐍 在程式內簽名（macho_signer），不需要 codesign 與 Keychain，可以在 Linux 執行
+
+    身分取自身分庫（identity_store）：`${CERT_DIR_PATH}/<cert_id>.p12`（以 KEYCHAIN_PASSWORD 加密）。
+    """
+
+    name = "python"
+
+    def __init__(self, signing_identity, cert_id):
+        self.signing_identity = signing_identity
+        self.cert_id = cert_id
+        self.identity = None
+
+    def validate(self):
+        # 只查詢記憶體中的索引；從 Keychain 匯出、還沒有索引的 PKCS#12 第一次使用時補上索引
+        entry = identity_store.lookup(self.cert_id)
+        if entry is None and os.path.exists(identity_store.blob_path(self.cert_id)):
+            entry = identity_store.index_blob(self.cert_id)
+        if entry is None:
+            raise FileNotFoundError(f"身分庫中沒有憑證 {self.cert_id} 的簽名身分: {identity_store.blob_path(self.cert_id)}")
+        if entry["sha1"] != self.signing_identity:
+            raise ValueError(f"簽名身份無效，身分庫中的憑證 {entry['sha1']} 與 {self.signing_identity} 不符")
+        logging.info(f"簽名身份驗證通過: {self.signing_identity}")
+
+    def prepare(self):
+        if self.identity is None:
+            self.identity = identity_store.load_identity(self.cert_id)
+
+    def sign(self, path, entitlements_path=None):
+        from . import macho_signer
+        entitlements = None
+        if entitlements_path:
+            with open(entitlements_path, "rb") as f:
+                entitlements = plistlib.load(f)
+        try:
+            macho_signer.sign_bundle(path, self.identity, entitlements, runtime=bool(entitlements_path))
+        except (OSError, ValueError) as e:
+            logging.error(f"簽名應用失敗: {path}: {e}")
+            raise
+
+    def sign_many(self, paths, entitlements_path=None, description=""):
+        """ 雜湊計算會釋放 GIL，彼此獨立的 bundle 以執行緒同時簽名 """
+        if not paths:
+            return
+        workers = config.codesign_concurrency or os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+            futures = [executor.submit(self.sign, path, entitlements_path) for path in paths]
+        errors = [future.exception() for future in futures if future.exception()]
+        if errors:
+            logging.error(f"簽名{description}失敗: {errors[0]}")
+            raise errors[0]
+
+
+SIGNERS = {signer.name: signer for signer in (CodesignSigner, PythonSigner)}
+
+def create_signer(signing_identity, cert_id, backend=None):
+    """ 🔏 依 SIGNER_BACKEND（codesign 或 python）建立簽名器 """
+    backend = backend or config.signer_backend or "codesign"
+    if backend not in SIGNERS:
+        raise ValueError(f"不支援的簽名方式: {backend}")
+    return SIGNERS[backend](signing_identity, cert_id)
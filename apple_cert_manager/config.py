@@ -1,6 +1,9 @@
 import os
 from dotenv import load_dotenv
 
+DEFAULT_API_BASE_URL = "https://api.appstoreconnect.apple.com/v1"
+DEFAULT_STORED_EXTENSIONS = "png,jpg,jpeg,car,mp4,m4a,mp3,zip"
+
 class Config:
     """ 📌 動態讀取 `.env` 並提供存取設定的方式 """
 
@@ -17,7 +20,45 @@ class Config:
         self.json_path = None
         self.keychain_path = None
         self.keychain_password = None
+        self.keychain_shards = None
+        self.identity_backend = None
+        self.identity_store_path = None
         self.bundle_id = None
+        # 📌 App Store Connect API 位置（測試時可指向本地替身伺服器）
+        self.api_base_url = DEFAULT_API_BASE_URL
+        # 📌 常駐模式 (daemon) 設定
+        self.daemon_socket_path = None
+        self.daemon_expiry_scan_interval = None
+        self.daemon_cert_renewal_interval = None
+        self.daemon_profile_refresh_interval = None
+        self.daemon_keychain_unlock_interval = None
+        self.cert_expiry_warning_days = None
+        self.cert_rotation_window_days = None
+        self.cert_rotation_daily_cap = None
+        # 📌 本地 HTTP API 設定
+        self.api_server_host = None
+        self.api_server_port = None
+        self.api_server_workers = None
+        # 📌 重簽名產物快取設定
+        self.artifact_dir_path = None
+        self.artifact_max_age_days = None
+        self.artifact_max_size_mb = None
+        # 📌 重新打包設定
+        self.ipa_repackage_mode = None
+        self.ipa_compress_level = None
+        self.ipa_compress_workers = None
+        self.ipa_stored_extensions = None
+        self.codesign_concurrency = None
+        self.signer_backend = None
+        # 📌 重簽名工作目錄設定
+        self.scratch_dir_path = None
+        self.scratch_reserve_mb = None
+        # 📌 批量建立憑證的工作池設定
+        self.cert_keygen_workers = None
+        self.cert_api_workers = None
+        # 📌 清理描述檔的並行設定
+        self.profile_cleanup_workers = None
+        self.profile_delete_concurrency = None
 
     def load(self, env_path):
         """ 🚀 載入 `.env` 環境變數 """
@@ -42,7 +83,80 @@ class Config:
         self.json_path = os.getenv("JSON_PATH")
         self.keychain_path = os.getenv("KEYCHAIN_PATH")
         self.keychain_password = os.getenv("KEYCHAIN_PASSWORD")
+        # 身分分散到幾個 Keychain（第 0 個就是 KEYCHAIN_PATH），並行簽名時各自使用自己的分片
+        self.keychain_shards = self._get_int("KEYCHAIN_SHARDS", 1)
+        if self.keychain_shards < 1:
+            raise ValueError(f"❌ `.env` 變數 KEYCHAIN_SHARDS 必須大於 0: {self.keychain_shards}")
+        # 身分（私鑰 + 憑證）存放方式（keychain：macOS Keychain；file：身分庫目錄中加密的 PKCS#12，預設為 CERT_DIR_PATH）
+        self.identity_backend = (os.getenv("IDENTITY_BACKEND") or "keychain").lower()
+        if self.identity_backend not in ("keychain", "file"):
+            raise ValueError(f"❌ `.env` 變數 IDENTITY_BACKEND 必須是 keychain 或 file: {self.identity_backend}")
+        self.identity_store_path = os.getenv("IDENTITY_STORE_PATH")
         self.bundle_id = os.getenv("BUNDLE_ID")
+        self.api_base_url = (os.getenv("APP_STORE_CONNECT_API_URL") or DEFAULT_API_BASE_URL).rstrip("/")
+
+        # 📌 **常駐模式設定（間隔單位為秒，0 代表停用該排程）**
+        default_socket_path = os.path.join(self.root_dir, "daemon.sock") if self.root_dir else None
+        self.daemon_socket_path = os.getenv("DAEMON_SOCKET_PATH") or default_socket_path
+        self.daemon_expiry_scan_interval = self._get_int("DAEMON_EXPIRY_SCAN_INTERVAL", 6 * 3600)
+        self.daemon_cert_renewal_interval = self._get_int("DAEMON_CERT_RENEWAL_INTERVAL", 24 * 3600)
+        self.daemon_profile_refresh_interval = self._get_int("DAEMON_PROFILE_REFRESH_INTERVAL", 24 * 3600)
+        self.daemon_keychain_unlock_interval = self._get_int("DAEMON_KEYCHAIN_UNLOCK_INTERVAL", 10 * 60)
+        self.cert_expiry_warning_days = self._get_int("CERT_EXPIRY_WARNING_DAYS", 30)
+        # 憑證換發：在到期前 N 天內分散換發，每天最多換發幾個
+        self.cert_rotation_window_days = self._get_int("CERT_ROTATION_WINDOW_DAYS", 30)
+        if self.cert_rotation_window_days < 1:
+            raise ValueError(f"❌ `.env` 變數 CERT_ROTATION_WINDOW_DAYS 必須大於 0: {self.cert_rotation_window_days}")
+        self.cert_rotation_daily_cap = self._get_int("CERT_ROTATION_DAILY_CAP", 10)
+        if self.cert_rotation_daily_cap < 1:
+            raise ValueError(f"❌ `.env` 變數 CERT_ROTATION_DAILY_CAP 必須大於 0: {self.cert_rotation_daily_cap}")
+
+        # 📌 **本地 HTTP API 設定**
+        self.api_server_host = os.getenv("API_SERVER_HOST") or "127.0.0.1"
+        self.api_server_port = self._get_int("API_SERVER_PORT", 8080)
+        self.api_server_workers = self._get_int("API_SERVER_WORKERS", 4)
+
+        # 📌 **重簽名產物快取（依內容雜湊存放，0 代表不限制）**
+        default_artifact_dir = os.path.join(self.root_dir, "artifacts") if self.root_dir else None
+        self.artifact_dir_path = os.getenv("ARTIFACT_DIR_PATH") or default_artifact_dir
+        self.artifact_max_age_days = self._get_int("ARTIFACT_MAX_AGE_DAYS", 30)
+        self.artifact_max_size_mb = self._get_int("ARTIFACT_MAX_SIZE_MB", 0)
+
+        # 📌 **重簽名工作目錄（可指向 tmpfs；依剩餘空間決定同時執行的工作數，保留 SCRATCH_RESERVE_MB 不用）**
+        self.scratch_dir_path = os.getenv("SCRATCH_DIR_PATH") or (
+            os.path.join(self.ipa_dir_path, ".work") if self.ipa_dir_path else None
+        )
+        self.scratch_reserve_mb = self._get_int("SCRATCH_RESERVE_MB", 1024)
+
+        # 📌 **批量建立憑證（產生金鑰依 CPU 數、呼叫 Apple API 依網路並行數；0 代表使用預設值）**
+        self.cert_keygen_workers = self._get_int("CERT_KEYGEN_WORKERS", 0)
+        self.cert_api_workers = self._get_int("CERT_API_WORKERS", 8)
+
+        # 📌 **清理無效描述檔（同時處理的帳號數、每個帳號同時刪除的描述檔數）**
+        self.profile_cleanup_workers = self._get_int("PROFILE_CLEANUP_WORKERS", 4)
+        self.profile_delete_concurrency = self._get_int("PROFILE_DELETE_CONCURRENCY", 4)
+
+        # 📌 **重新打包（delta：只重新壓縮有變更的成員；full：整個 Payload 平行重新壓縮；zip：使用 zip 指令）**
+        self.ipa_repackage_mode = (os.getenv("IPA_REPACKAGE_MODE") or "delta").lower()
+        if self.ipa_repackage_mode not in ("delta", "full", "zip"):
+            raise ValueError(f"❌ `.env` 變數 IPA_REPACKAGE_MODE 必須是 delta、full 或 zip: {self.ipa_repackage_mode}")
+        self.ipa_compress_level = self._get_int("IPA_COMPRESS_LEVEL", 6)
+        self.ipa_compress_workers = self._get_int("IPA_COMPRESS_WORKERS", 0)
+        # 同時執行的 codesign 數（彼此獨立的 Framework / 擴展；0 為 CPU 數）
+        self.codesign_concurrency = self._get_int("CODESIGN_CONCURRENCY", 0)
+        # 簽名方式（codesign：使用 Keychain 與 codesign；python：在程式內簽名，可在 Linux 執行）
+        # 身分不在 Keychain 時 codesign 無法使用，預設改為 python
+        default_signer = "python" if self.identity_backend == "file" else "codesign"
+        self.signer_backend = (os.getenv("SIGNER_BACKEND") or default_signer).lower()
+        if self.signer_backend not in ("codesign", "python"):
+            raise ValueError(f"❌ `.env` 變數 SIGNER_BACKEND 必須是 codesign 或 python: {self.signer_backend}")
+        if self.identity_backend == "file" and self.signer_backend == "codesign":
+            raise ValueError("❌ `.env` 變數 IDENTITY_BACKEND=file 時 SIGNER_BACKEND 必須是 python（codesign 只能使用 Keychain 中的身分）")
+        # 已壓縮過的資源直接儲存，不再 deflate
+        stored_extensions = os.getenv("IPA_STORED_EXTENSIONS") or DEFAULT_STORED_EXTENSIONS
+        self.ipa_stored_extensions = tuple(
+            f".{extension.strip().lstrip('.').lower()}" for extension in stored_extensions.split(",") if extension.strip()
+        )
 
         # ✅ **確保環境變數已載入**
         self.env_loaded = True
@@ -67,5 +181,16 @@ class Config:
             else:
                 print(f"⚠️ {dir_name} 未設定或為空，跳過建立")
 
+    @staticmethod
+    def _get_int(name, default):
+        """ 讀取整數型態的環境變數，未設定時使用預設值 """
+        value = os.getenv(name)
+        if value is None or value.strip() == "":
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"❌ `.env` 變數 {name} 必須是整數: {value}")
+
 # 🚀 **創建 `config` 實例**
 config = Config()
@@ -0,0 +1,287 @@
+import os
+import json
+import time
+import signal
+import socket
+import logging
+import threading
+import socketserver
+from apple_cert_manager.config import config
+from .logging_config import log_context, new_job_id
+
+logging = logging.getLogger(__name__)
+
+# 單一請求/回應的最大長度，避免異常連線佔用記憶體
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def _command_query(args):
+    from . import apple_accounts
+    return [dict(account) for account in apple_accounts.get_accounts()]
+
+def _command_add(args):
+    from . import apple_accounts
+    return apple_accounts.insert_account(args["apple_id"], args["issuer_id"], args["key_id"])
+
+def _command_delete(args):
+    from . import apple_accounts
+    return apple_accounts.delete_account(args["apple_id"])
+
+def _command_import(args):
+    from . import apple_accounts
+    apple_accounts.insert_from_json(args.get("json") or config.json_path)
+
+def _command_register_device(args):
+    from .register_device_and_resign import register_device_and_resign
+    register_device_and_resign(args["apple_id"], args["name"], args["uuid"])
+
+def _command_resign(args):
+    from . import resign_ipa
+    if args.get("apple_id"):
+        _, result = resign_ipa.resign_single_account({"apple_id": args["apple_id"]}, force=bool(args.get("force")))
+        return result
+    resign_ipa.batch_resign_all_accounts(force=bool(args.get("force")))
+
+def _command_revoke_expired_cert(args):
+    from . import revoke_expired_cert
+    revoke_expired_cert.revoke_expired_certificates()
+
+def _command_rotate_certs(args):
+    from . import rotation
+    return rotation.rotate_certs(dry_run=bool(args.get("dry_run")))
+
+def _command_plan_rotation(args):
+    from . import rotation
+    return rotation.show_rotation_plan(args.get("days") or 14)
+
+def _command_scan_expiry(args):
+    from . import revoke_expired_cert
+    return revoke_expired_cert.scan_certificate_expiry()
+
+def _command_refresh_profiles(args):
+    from . import profile
+    return profile.refresh_all_profiles()
+
+def _command_metrics(args):
+    from . import metrics
+    return {"http": metrics.http_metrics.snapshot(), "tools": metrics.tool_metrics.snapshot(),
+            "stages": metrics.recorder.summary()}
+
+def _unlock_keychain():
+    if config.identity_backend == "file":  # 身分庫不需要解鎖
+        return
+    from . import keychain_shards
+    keychain_shards.unlock_all()
+
+# 📌 可以透過 Unix socket 執行的指令
+COMMANDS = {
+    "query": _command_query,
+    "add": _command_add,
+    "delete": _command_delete,
+    "import": _command_import,
+    "register_device": _command_register_device,
+    "resign": _command_resign,
+    "revoke_expired_cert": _command_revoke_expired_cert,
+    "rotate_certs": _command_rotate_certs,
+    "plan_rotation": _command_plan_rotation,
+    "scan_expiry": _command_scan_expiry,
+    "refresh_profiles": _command_refresh_profiles,
+    "metrics": _command_metrics,
+}
+
+# 📌 只讀指令不需要取得工作鎖，可以與排程同時執行
+READ_ONLY_COMMANDS = {"query", "metrics", "plan_rotation"}
+
+
+class ScheduledJob:
+    """ 以固定間隔執行的排程工作 """
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = time.monotonic() + interval
+        self.last_run = None
+        self.last_error = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "next_run_in": max(0, round(self.next_run - time.monotonic())),
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ 一個連線對應一個 JSON 請求，一行請求、一行回應 """
+
+    def handle(self):
+        line = self.rfile.readline(MAX_MESSAGE_SIZE)
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not isinstance(request.get("args") or {}, dict):
+                response = {"ok": False, "error": "無效的請求格式: 請求與 args 必須是 JSON 物件"}
+            else:
+                response = self.server.owner.execute(request.get("command"), request.get("args") or {})
+        except json.JSONDecodeError as e:
+            response = {"ok": False, "error": f"無效的請求格式: {e}"}
+        except Exception as e:  # 任何錯誤都要回覆，避免 client 等不到回應
+            logging.error(f"❌ 處理請求失敗: {e}")
+            response = {"ok": False, "error": f"處理請求失敗: {e}"}
+        self.wfile.write(json.dumps(response, default=str).encode("utf-8") + b"\n")
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """ 🚀 常駐服務：保持 HTTP session / token / keychain 狀態，定期執行排程並接受 socket 指令 """
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or config.daemon_socket_path
+        if not self.socket_path:
+            raise ValueError("❌ 未設定 DAEMON_SOCKET_PATH（或 ROOT_DIR），無法啟動常駐服務")
+        # ✅ 所有會修改憑證 / 描述檔 / 鑰匙圈的工作都要先取得此鎖，避免排程與指令互相干擾
+        self.work_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.server = None
+        self.started_at = None
+        self.jobs = [
+            job for job in (
+                ScheduledJob("scan_expiry", config.daemon_expiry_scan_interval, _command_scan_expiry),
+                # 依換發計畫每天只換發排定的一小批，避免同一天到期的憑證一起換發
+                ScheduledJob("rotate_certs", config.daemon_cert_renewal_interval, _command_rotate_certs),
+                ScheduledJob("refresh_profiles", config.daemon_profile_refresh_interval, _command_refresh_profiles),
+                ScheduledJob("unlock_keychain", config.daemon_keychain_unlock_interval, lambda args: _unlock_keychain()),
+            ) if job.interval > 0
+        ]
+
+    def execute(self, command, args):
+        """ 執行單一指令，回傳可序列化的結果 """
+        if command == "status":
+            return {"ok": True, "result": self.status()}
+        func = COMMANDS.get(command)
+        if not func:
+            return {"ok": False, "error": f"不支援的指令: {command}"}
+        with log_context(apple_id=args.get("apple_id"), job_id=new_job_id()):
+            return self._execute(command, func, args)
+
+    def _execute(self, command, func, args):
+        logging.info(f"📥 收到指令: {command} {args}")
+        try:
+            if command in READ_ONLY_COMMANDS:
+                result = func(args)
+            else:
+                with self.work_lock:
+                    result = func(args)
+            return {"ok": True, "result": result}
+        except Exception as e:
+            logging.error(f"❌ 指令 {command} 執行失敗: {e}")
+            return {"ok": False, "error": str(e)}
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "uptime": round(time.monotonic() - self.started_at) if self.started_at else 0,
+            "jobs": [job.status() for job in self.jobs],
+        }
+
+    def _run_job(self, job):
+        logging.info(f"⏰ 執行排程: {job.name}")
+        try:
+            with self.work_lock, log_context(job_id=new_job_id()):
+                job.func({})
+            job.last_error = None
+        except Exception as e:
+            job.last_error = str(e)
+            logging.error(f"❌ 排程 {job.name} 執行失敗: {e}")
+        finally:
+            job.last_run = time.strftime("%Y-%m-%d %H:%M:%S")
+            job.next_run = time.monotonic() + job.interval
+
+    def _scheduler_loop(self):
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            for job in self.jobs:
+                if job.next_run <= now and not self.stop_event.is_set():
+                    self._run_job(job)
+            if not self.jobs:
+                self.stop_event.wait()
+                break
+            wait = min(job.next_run for job in self.jobs) - time.monotonic()
+            self.stop_event.wait(max(wait, 0))
+
+    def _prepare_socket(self):
+        if os.path.exists(self.socket_path):
+            if is_daemon_running(self.socket_path):
+                raise RuntimeError(f"❌ 常駐服務已在執行中: {self.socket_path}")
+            os.remove(self.socket_path)  # 清除上次異常結束留下的 socket
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+
+    def serve_forever(self):
+        """ 啟動 socket 伺服器與排程，直到收到 SIGINT / SIGTERM """
+        self._prepare_socket()
+        self.server = _UnixServer(self.socket_path, _RequestHandler)
+        self.server.owner = self
+        os.chmod(self.socket_path, 0o600)  # 🔒 僅限目前使用者存取
+        self.started_at = time.monotonic()
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda signum, frame: self.stop())
+
+        # 🔥 啟動時先解鎖鑰匙圈，讓之後的簽名不用再等待
+        try:
+            _unlock_keychain()
+        except Exception as e:
+            logging.warning(f"⚠️ 啟動時解鎖鑰匙圈失敗: {e}")
+
+        server_thread = threading.Thread(target=self.server.serve_forever, name="daemon-socket", daemon=True)
+        server_thread.start()
+        logging.info(f"✅ 常駐服務已啟動: {self.socket_path}")
+        for job in self.jobs:
+            logging.info(f"  - 排程 {job.name}: 每 {job.interval} 秒")
+        try:
+            self._scheduler_loop()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            logging.info("🛑 常駐服務已停止")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def send_command(command, args=None, socket_path=None, timeout=None):
+    """ 📨 透過 Unix socket 把指令送給常駐服務，回傳服務的回應 """
+    socket_path = socket_path or config.daemon_socket_path
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"command": command, "args": args or {}}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as reader:
+            line = reader.readline(MAX_MESSAGE_SIZE)
+    if not line:
+        raise ConnectionError("常駐服務未回應")
+    return json.loads(line)
+
+
+def is_daemon_running(socket_path=None):
+    """ 檢查常駐服務是否可連線 """
+    socket_path = socket_path or config.daemon_socket_path
+    if not socket_path or not os.path.exists(socket_path):
+        return False
+    try:
+        send_command("status", socket_path=socket_path, timeout=2)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def run_daemon(socket_path=None):
+    """ 🚀 以前景方式啟動常駐服務 """
+    Daemon(socket_path).serve_forever()
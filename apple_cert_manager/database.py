@@ -25,6 +25,14 @@ def initialize_database():
     )
     """)
 
+    # ✅ 建立 `keychain_shards` 表格（憑證 ID -> 所在的 Keychain 分片）
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS keychain_shards (
+        cert_id TEXT PRIMARY KEY,
+        shard INTEGER NOT NULL
+    )
+    """)
+
     conn.commit()
     conn.close()
     logging.info(f"✅ SQLite 資料庫已初始化: {db_path}")
@@ -1,76 +1,195 @@
 # http_client.py
+import json
+import base64
 import logging
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import threading
+import time
+from . import metrics
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 
+def credential_key(headers):
+    """ 取得請求使用的憑證：App Store Connect JWT 取 (kid, iss)，同一把 API 金鑰先後簽發的 token 視為相同；
+    無法解析時直接使用 Authorization 標頭 """
+    authorization = (headers or {}).get("Authorization", "")
+    token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+    try:
+        header_segment, payload_segment = token.split(".")[:2]
+        header = json.loads(base64.urlsafe_b64decode(header_segment + "=" * (-len(header_segment) % 4)))
+        payload = json.loads(base64.urlsafe_b64decode(payload_segment + "=" * (-len(payload_segment) % 4)))
+        return header["kid"], payload["iss"]
+    except (ValueError, KeyError, TypeError):
+        return authorization
+
+
+# urllib3 在同一個執行緒內同步重試，依執行緒記錄目前請求已重試的次數
+_retry_state = threading.local()
+
+
+def _counting_retry_class():
+    """ 建立會記錄重試次數的 Retry 子類別（延遲到建立客戶端時才載入 urllib3）
+
+    重試用盡時 requests 拋出 RetryError / ConnectionError，拿不到 response 的重試紀錄，
+    所以在每次 `increment()` 成功（代表會再送一次）時自行計數。
+    """
+    from urllib3.util.retry import Retry
+
+    class CountingRetry(Retry):
+        def increment(self, *args, **kwargs):
+            new_retry = super().increment(*args, **kwargs)
+            _retry_state.count = getattr(_retry_state, "count", 0) + 1
+            return new_retry
+
+    return CountingRetry
+
+
+class SingleFlight:
+    """ 🛫 合併同時進行的相同呼叫：同一個 key 只有第一個呼叫者真的執行，其他人等待並共用結果（或例外） """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """ 回傳 (結果, 是否共用了其他呼叫者的結果) """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
 class HttpClient:
     """封裝帶有重試和超時的 HTTP 客戶端"""
-    def __init__(self, timeout=10, retries=3, backoff_factor=1):
+    def __init__(self, timeout=10, retries=3, backoff_factor=1, pool_maxsize=32):
         """
         初始化 HTTP 客戶端。
-        
+
         Args:
             timeout (int): 每個請求的超時時間（秒），預設 10 秒。
             retries (int): 最大重試次數，預設 3 次。
             backoff_factor (float): 重試間隔的增長因子，預設 1（秒）。
+            pool_maxsize (int): 每個 host 保留的連線數，預設 32（批次清理 / 建立時多個執行緒同時呼叫 API）。
         """
+        # requests / urllib3 載入較慢，只有真的要發送請求時才載入
+        import requests
+        from requests.adapters import HTTPAdapter
+
         self.session = requests.Session()
         self.timeout = timeout
-        
+        self.single_flight = SingleFlight()
+
         # 配置重試策略
-        retry_strategy = Retry(
+        retry_strategy = _counting_retry_class()(
             total=retries,
             backoff_factor=backoff_factor,
             status_forcelist=[429, 500, 502, 503, 504],  # 重試的狀態碼
-            allowed_methods=["GET", "POST", "DELETE", "PUT"]  # 支持的重試方法
+            allowed_methods=["GET", "POST", "DELETE", "PUT", "PATCH"]  # 支持的重試方法
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=pool_maxsize)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
 
-    def get(self, url, headers=None, **kwargs):
-        """發送 GET 請求"""
+    def _request(self, method, url, **kwargs):
+        """發送請求並在失敗時記錄錯誤，同時統計端點的次數、重試、傳輸量與延遲"""
+        import requests
+        started = time.perf_counter()
+        response = None
+        _retry_state.count = 0
         try:
-            response = self.session.get(url, headers=headers, timeout=self.timeout, **kwargs)
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
-            logging.error(f"GET 請求失敗: {url}, 錯誤: {e}")
+            logging.error(f"{method} 請求失敗: {url}, 錯誤: {e}")
             raise
+        finally:
+            self._record(method, url, response, time.perf_counter() - started, _retry_state.count)
+
+    @staticmethod
+    def _record(method, url, response, seconds, retries):
+        """ 重試次數與最終結果分開記錄：重試用盡時沒有 response，狀態記為 error，但重試次數照算 """
+        if response is None:
+            metrics.http_metrics.record(method, url, "error", seconds, retries=retries)
+            return
+        body = response.request.body if response.request is not None else None
+        metrics.http_metrics.record(
+            method, url, response.status_code, seconds,
+            retries=retries,
+            bytes_sent=len(body) if body else 0,
+            bytes_received=len(response.content),
+        )
+
+    def get(self, url, headers=None, **kwargs):
+        """發送 GET 請求"""
+        return self._request("GET", url, headers=headers, **kwargs)
+
+    def get_json(self, url, headers=None):
+        """發送 GET 請求並回傳解析後的 JSON
+
+        同一時間對相同 URL、以相同憑證（JWT 的 kid / iss）發出的請求只送出一次，解析結果由所有呼叫者共用
+        （呼叫端不應修改回傳的物件）；省下的呼叫次數記在端點統計的 `coalesced`。
+        """
+        key = (url, credential_key(headers))
+        data, shared = self.single_flight.do(key, lambda: self.get(url, headers=headers).json())
+        if shared:
+            metrics.http_metrics.increment(metrics.endpoint_template("GET", url), "coalesced")
+        return data
 
     def post(self, url, headers=None, data=None, json=None, **kwargs):
         """發送 POST 請求"""
-        try:
-            response = self.session.post(url, headers=headers, data=data, json=json, timeout=self.timeout, **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            logging.error(f"POST 請求失敗: {url}, 錯誤: {e}")
-            raise
+        return self._request("POST", url, headers=headers, data=data, json=json, **kwargs)
 
     def delete(self, url, headers=None, **kwargs):
         """發送 DELETE 請求"""
-        try:
-            response = self.session.delete(url, headers=headers, timeout=self.timeout, **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            logging.error(f"DELETE 請求失敗: {url}, 錯誤: {e}")
-            raise
+        return self._request("DELETE", url, headers=headers, **kwargs)
 
     def put(self, url, headers=None, data=None, json=None, **kwargs):
         """發送 PUT 請求"""
-        try:
-            response = self.session.put(url, headers=headers, data=data, json=json, timeout=self.timeout, **kwargs)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            logging.error(f"PUT 請求失敗: {url}, 錯誤: {e}")
-            raise
+        return self._request("PUT", url, headers=headers, data=data, json=json, **kwargs)
+
+    def patch(self, url, headers=None, data=None, json=None, **kwargs):
+        """發送 PATCH 請求"""
+        return self._request("PATCH", url, headers=headers, data=data, json=json, **kwargs)
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    """取得單例客戶端，第一次呼叫時才建立（連同 requests 的載入）"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClient(timeout=10, retries=3, backoff_factor=1)
+    return _http_client
+
+class _LazyHttpClient:
+    """代理物件：讓 `from ... import http_client` 不必在 import 時就建立 session"""
+    def __getattr__(self, name):
+        return getattr(get_http_client(), name)
 
-# 創建單例客戶端
-http_client = HttpClient(timeout=10, retries=3, backoff_factor=1)
\ No newline at end of file
+# 創建單例客戶端（延遲建立）
+http_client = _LazyHttpClient()
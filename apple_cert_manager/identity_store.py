@@ -0,0 +1,184 @@
+import os
+import json
+import logging
+import threading
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+from apple_cert_manager.config import config
+
+logging = logging.getLogger(__name__)
+
+INDEX_FILENAME = "identities.json"
+
+# ✅ 索引快取：索引檔 (大小, mtime) 不變就直接使用記憶體中的對照表（其他程序寫入後會自動重新讀取）
+_index = {"key": None, "entries": {}, "by_sha1": {}, "by_name": {}}
+# ✅ 已解密的身分：cert_id -> (PKCS#12 的 mtime, Identity)
+_identities = {}
+_lock = threading.Lock()
+
+
+def store_dir():
+    """ 身分庫目錄（預設與 `.cer` 同在 CERT_DIR_PATH） """
+    return os.path.expanduser(config.identity_store_path or config.cert_dir_path)
+
+def blob_path(cert_id):
+    return os.path.join(store_dir(), f"{cert_id}.p12")
+
+def _index_path():
+    return os.path.join(store_dir(), INDEX_FILENAME)
+
+def _password():
+    if not config.keychain_password:
+        raise ValueError("❌ `.env` 變數 KEYCHAIN_PASSWORD 未設定，無法加密身分庫中的 PKCS#12")
+    return config.keychain_password.encode("utf-8")
+
+def _read_index():
+    """ 讀取索引並更新記憶體中的對照表（呼叫端需持有 _lock） """
+    path = _index_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        key = None
+    else:
+        key = (path, stat.st_size, stat.st_mtime_ns)
+    if key == _index["key"] and (key or not _index["entries"]):
+        return _index["entries"]
+    entries = {}
+    if key:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ 無法讀取身分庫索引 {path}: {e}")
+    _index.update({
+        "key": key,
+        "entries": entries,
+        "by_sha1": {entry["sha1"]: cert_id for cert_id, entry in entries.items()},
+        "by_name": {entry["name"]: cert_id for cert_id, entry in entries.items()},
+    })
+    return entries
+
+def _write_index(entries):
+    path = _index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    _index["key"] = None  # 下次查詢時重新建立對照表
+
+def _entry(certificate):
+    names = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    teams = certificate.subject.get_attributes_for_oid(NameOID.ORGANIZATIONAL_UNIT_NAME)
+    return {
+        "sha1": certificate.fingerprint(hashes.SHA1()).hex().upper(),
+        "name": names[0].value if names else "",
+        "team_id": teams[0].value if teams else "",
+        "not_after": certificate.not_valid_after_utc.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+def _write_blob(path, data):
+    """ PKCS#12 只給擁有者讀寫，寫完才換上正式檔名 """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def lookup(cert_id):
+    """ 🔍 依憑證 ID 查詢身分（sha1、name、team_id、not_after），不存在時回傳 None """
+    with _lock:
+        return _read_index().get(cert_id)
+
+def lookup_sha1(sha1):
+    """ 🔍 依憑證 SHA-1 查詢憑證 ID，不存在時回傳 None """
+    with _lock:
+        _read_index()
+        return _index["by_sha1"].get(sha1.upper())
+
+def find_by_name(cert_name):
+    """ 🔍 依憑證名稱查詢 SHA-1（與 `security find-identity` 相同，名稱可以省略結尾的 Team ID） """
+    with _lock:
+        entries = _read_index()
+        cert_id = _index["by_name"].get(cert_name)
+        if cert_id is None:
+            cert_id = next((cert_id for cert_id, entry in entries.items() if cert_name in entry["name"]), None)
+        return entries[cert_id]["sha1"] if cert_id else None
+
+def import_identities(identities):
+    """ 🔐 把身分以 PKCS#12（KEYCHAIN_PASSWORD 加密）存入身分庫，整批只更新一次索引
+
+    Args:
+        identities (list): [(私鑰物件, 憑證 ID)]，憑證讀取自 `${CERT_DIR_PATH}/<cert_id>.cer`
+
+    Returns:
+        list: 與 identities 對應的錯誤（成功為 None）
+    """
+    from . import certificate  # 避免循環匯入：certificate 會使用本模組
+    errors = [None] * len(identities)
+    added = {}
+    os.makedirs(store_dir(), exist_ok=True)
+    for index, (private_key, cert_id) in enumerate(identities):
+        try:
+            with open(certificate.get_cert_path(cert_id), "rb") as f:
+                cert = x509.load_der_x509_certificate(f.read())
+            data = pkcs12.serialize_key_and_certificates(
+                cert_id.encode("utf-8"), private_key, cert, None, serialization.BestAvailableEncryption(_password())
+            )
+            _write_blob(blob_path(cert_id), data)
+            added[cert_id] = _entry(cert)
+        except (OSError, ValueError) as e:
+            errors[index] = e
+    if added:
+        with _lock:
+            entries = dict(_read_index())
+            entries.update(added)
+            _write_index(entries)
+        logging.info(f"🔐 已將 {len(added)} 個身分存入身分庫: {store_dir()}")
+    return errors
+
+def index_blob(cert_id):
+    """ 把已放在身分庫目錄、但還沒有索引的 PKCS#12（例如從 Keychain 匯出的）加入索引 """
+    with open(blob_path(cert_id), "rb") as f:
+        _, cert, _ = pkcs12.load_key_and_certificates(f.read(), _password())
+    if cert is None:
+        raise ValueError(f"❌ PKCS#12 缺少憑證: {blob_path(cert_id)}")
+    entry = _entry(cert)
+    with _lock:
+        entries = dict(_read_index())
+        entries[cert_id] = entry
+        _write_index(entries)
+    return entry
+
+def remove(cert_id):
+    """ 🗑 刪除身分（PKCS#12 與索引），回傳是否有刪除 """
+    path = blob_path(cert_id)
+    removed = False
+    if os.path.exists(path):
+        os.remove(path)
+        removed = True
+    with _lock:
+        entries = _read_index()
+        if cert_id in entries:
+            entries = dict(entries)
+            del entries[cert_id]
+            _write_index(entries)
+            removed = True
+        _identities.pop(cert_id, None)
+    return removed
+
+def load_identity(cert_id, fetch_chain=True):
+    """ 🔓 解密並回傳簽名身分（macho_signer.Identity），依 PKCS#12 的修改時間快取 """
+    from . import macho_signer
+    path = blob_path(cert_id)
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _identities.get(cert_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    identity = macho_signer.load_identity(path, _password(), fetch_chain=fetch_chain)
+    with _lock:
+        _identities[cert_id] = (mtime, identity)
+    return identity
@@ -0,0 +1,229 @@
+import os
+import json
+import struct
+import hashlib
+import logging
+import threading
+from . import artifact_store
+
+logging = logging.getLogger(__name__)
+
+# 📌 zip 結構常數
+EOCD_SIGNATURE = b"PK\x05\x06"
+EOCD_FORMAT = "<4s4H2LH"
+EOCD_SIZE = struct.calcsize(EOCD_FORMAT)  # 22
+ZIP64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+ZIP64_LOCATOR_FORMAT = "<4sLQL"
+ZIP64_LOCATOR_SIZE = struct.calcsize(ZIP64_LOCATOR_FORMAT)  # 20
+ZIP64_EOCD_SIGNATURE = b"PK\x06\x06"
+ZIP64_EOCD_FORMAT = "<4sQ2H2L4Q"
+ZIP64_EOCD_SIZE = struct.calcsize(ZIP64_EOCD_FORMAT)  # 56
+CENTRAL_SIGNATURE = b"PK\x01\x02"
+CENTRAL_FORMAT = "<4s4B4HL2L5H2L"
+CENTRAL_SIZE = struct.calcsize(CENTRAL_FORMAT)  # 46
+ZIP64_EXTRA_ID = 0x0001
+MAX_COMMENT_SIZE = 0xFFFF
+
+# 讀取中央目錄時每次讀取的大小
+CHUNK_SIZE = 1024 * 1024
+# 指紋格式版本（解析方式有變動時遞增）
+FINGERPRINT_VERSION = 1
+
+# ✅ 行程內快取：realpath -> 指紋，大小與 mtime 沒變就不必再讀檔
+_memory_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _find_central_directory(f, file_size):
+    """ 從檔尾的 End of Central Directory 找出中央目錄的位置，回傳 (offset, size, 成員數) """
+    tail_size = min(file_size, EOCD_SIZE + MAX_COMMENT_SIZE)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    index = tail.rfind(EOCD_SIGNATURE)
+    if index < 0 or len(tail) - index < EOCD_SIZE:
+        raise ValueError("找不到 zip 的 End of Central Directory，檔案可能不是 IPA 或已損毀")
+    _, _, _, _, entries, cd_size, cd_offset, _ = struct.unpack(EOCD_FORMAT, tail[index:index + EOCD_SIZE])
+
+    if entries == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        # zip64：EOCD 前面緊接著 zip64 locator，再由它指向 zip64 EOCD
+        locator_start = index - ZIP64_LOCATOR_SIZE
+        if locator_start < 0:
+            f.seek(file_size - tail_size + index - ZIP64_LOCATOR_SIZE)
+            locator = f.read(ZIP64_LOCATOR_SIZE)
+        else:
+            locator = tail[locator_start:index]
+        signature, _, eocd64_offset, _ = struct.unpack(ZIP64_LOCATOR_FORMAT, locator)
+        if signature != ZIP64_LOCATOR_SIGNATURE:
+            raise ValueError("zip64 locator 格式錯誤")
+        f.seek(eocd64_offset)
+        record = struct.unpack(ZIP64_EOCD_FORMAT, f.read(ZIP64_EOCD_SIZE))
+        if record[0] != ZIP64_EOCD_SIGNATURE:
+            raise ValueError("zip64 End of Central Directory 格式錯誤")
+        entries, cd_size, cd_offset = record[7], record[8], record[9]
+    return cd_offset, cd_size, entries
+
+def _zip64_sizes(extra, file_size, compress_size):
+    """ 32 位元欄位放不下時，實際大小在 zip64 extra field 內 """
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from("<2H", extra, position)
+        if header_id == ZIP64_EXTRA_ID:
+            values = extra[position + 4:position + 4 + data_size]
+            offset = 0
+            if file_size == 0xFFFFFFFF:
+                file_size = struct.unpack_from("<Q", values, offset)[0]
+                offset += 8
+            if compress_size == 0xFFFFFFFF:
+                compress_size = struct.unpack_from("<Q", values, offset)[0]
+            break
+        position += 4 + data_size
+    return file_size, compress_size
+
+def read_central_directory(path):
+    """ 串流讀取中央目錄：一邊計算 SHA-256，一邊解析每個成員的 CRC 與大小
+
+    Returns:
+        tuple: (中央目錄的 SHA-256, {成員名稱: [crc32, 未壓縮大小, 壓縮後大小]})
+    """
+    sha256 = hashlib.sha256()
+    members = {}
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        cd_offset, cd_size, entries = _find_central_directory(f, file_size)
+        f.seek(cd_offset)
+        remaining = cd_size
+        buffer = b""
+        while remaining > 0 or buffer:
+            if remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ValueError("中央目錄不完整，檔案可能已損毀")
+                remaining -= len(chunk)
+                sha256.update(chunk)
+                buffer += chunk
+            position = 0
+            while len(buffer) - position >= CENTRAL_SIZE:
+                header = struct.unpack_from(CENTRAL_FORMAT, buffer, position)
+                if header[0] != CENTRAL_SIGNATURE:
+                    raise ValueError("中央目錄格式錯誤")
+                name_length, extra_length, comment_length = header[12], header[13], header[14]
+                record_size = CENTRAL_SIZE + name_length + extra_length + comment_length
+                if len(buffer) - position < record_size:
+                    break
+                name_start = position + CENTRAL_SIZE
+                name = buffer[name_start:name_start + name_length]
+                flags = header[5]
+                name = name.decode("utf-8" if flags & 0x800 else "cp437")
+                extra = buffer[name_start + name_length:name_start + name_length + extra_length]
+                file_size_, compress_size = _zip64_sizes(extra, header[11], header[10])
+                members[name] = [header[9], file_size_, compress_size]
+                position += record_size
+            buffer = buffer[position:]
+            if remaining == 0 and buffer:
+                raise ValueError("中央目錄結尾有無法解析的資料")
+    if len(members) != entries:
+        logging.warning(f"⚠️ 中央目錄成員數 ({len(members)}) 與記錄 ({entries}) 不符: {path}")
+    return sha256.hexdigest(), members
+
+def _cache_path(realpath):
+    name = hashlib.sha1(realpath.encode("utf-8")).hexdigest()
+    return os.path.join(artifact_store.store_dir(), "fingerprints", f"{name}.json")
+
+def _load_baseline(realpath):
+    """ 讀取上次 detect_changes 存下的指紋 """
+    try:
+        with open(_cache_path(realpath), "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return baseline if baseline.get("version") == FINGERPRINT_VERSION else None
+
+def _save_baseline(fingerprint_):
+    path = _cache_path(fingerprint_["path"])
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fingerprint_, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"⚠️ 無法保存 IPA 指紋: {e}")
+
+def _unchanged(cached, stat):
+    return cached is not None and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns
+
+def fingerprint(path, verify=False):
+    """ 🔍 取得 IPA 指紋
+
+    大小與 mtime 和上次相同時直接使用快取（只需一次 stat）；否則串流讀取中央目錄，
+    以其 SHA-256 作為指紋（中央目錄含每個成員的名稱、CRC32 與大小）。verify=True 時一律重新讀取。
+
+    Returns:
+        dict: path、size、mtime_ns、digest、entries，以及 members（成員名稱 -> [crc32, 大小, 壓縮後大小]）。
+    """
+    realpath = os.path.realpath(path)
+    stat = os.stat(realpath)
+    if not verify:
+        with _cache_lock:
+            cached = _memory_cache.get(realpath)
+        if not _unchanged(cached, stat):
+            cached = _load_baseline(realpath)
+        if _unchanged(cached, stat):
+            with _cache_lock:
+                _memory_cache[realpath] = cached
+            return cached
+    digest, members = read_central_directory(realpath)
+    result = {
+        "version": FINGERPRINT_VERSION,
+        "path": realpath,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": digest,
+        "entries": len(members),
+        "members": members,
+    }
+    with _cache_lock:
+        _memory_cache[realpath] = result
+    return result
+
+def diff_members(old_members, new_members):
+    """ 比較兩份成員清單，回傳新增、刪除與內容變更（CRC 或大小不同）的成員 """
+    added = sorted(name for name in new_members if name not in old_members)
+    removed = sorted(name for name in old_members if name not in new_members)
+    changed = sorted(
+        name for name, info in new_members.items()
+        if name in old_members and old_members[name][:2] != info[:2]
+    )
+    return {"added": added, "removed": removed, "changed": changed}
+
+def detect_changes(path):
+    """ 📦 與上次記錄的指紋比較，回傳 (目前指紋, 變更內容)；第一次檢查時變更內容為 None
+
+    目前的指紋會存成下次比較的基準。
+    """
+    realpath = os.path.realpath(path)
+    baseline = _load_baseline(realpath)
+    current = fingerprint(realpath)
+    if baseline is None:
+        changes = None
+    elif baseline["digest"] == current["digest"]:
+        changes = {"added": [], "removed": [], "changed": []}
+    else:
+        changes = diff_members(baseline["members"], current["members"])
+    if baseline is None or baseline["digest"] != current["digest"] or not _unchanged(baseline, os.stat(realpath)):
+        _save_baseline(current)
+    return current, changes
+
+def describe_changes(changes, limit=5):
+    """ 產生人類可讀的變更摘要 """
+    if changes is None:
+        return "首次記錄來源 IPA 指紋"
+    if not any(changes.values()):
+        return "來源 IPA 內容未變更"
+    parts = []
+    for key, label in (("changed", "變更"), ("added", "新增"), ("removed", "刪除")):
+        names = changes[key]
+        if names:
+            preview = ", ".join(names[:limit]) + (" ..." if len(names) > limit else "")
+            parts.append(f"{label} {len(names)} 個（{preview}）")
+    return "來源 IPA " + "，".join(parts)
@@ -0,0 +1,315 @@
+import os
+import stat
+import time
+import zlib
+import struct
+import logging
+import zipfile
+import threading
+import contextlib
+import concurrent.futures
+from .ipa_fingerprint import (
+    EOCD_SIGNATURE, EOCD_FORMAT,
+    ZIP64_LOCATOR_SIGNATURE, ZIP64_LOCATOR_FORMAT,
+    ZIP64_EOCD_SIGNATURE, ZIP64_EOCD_FORMAT, ZIP64_EOCD_SIZE,
+    CENTRAL_SIGNATURE, CENTRAL_FORMAT, ZIP64_EXTRA_ID,
+)
+
+logging = logging.getLogger(__name__)
+
+LOCAL_SIGNATURE = b"PK\x03\x04"
+LOCAL_FORMAT = "<4s5H3L2H"
+LOCAL_SIZE = struct.calcsize(LOCAL_FORMAT)  # 30
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+ZIP64_VERSION = 45
+DEFAULT_VERSION = 20
+UNIX_SYSTEM = 3
+FLAG_ENCRYPTED = 0x1
+FLAG_DATA_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+
+# 檔案系統時間戳記可能比 time.time() 粗略，比對修改時間時保留的誤差（秒）
+MTIME_SLACK = 2
+# 複製未變更成員時每次讀取的大小
+COPY_CHUNK_SIZE = 1024 * 1024
+# 大檔案切段平行壓縮的區段大小，以及每段沿用前一段結尾的字典大小（deflate 視窗為 32KB）
+DEFLATE_CHUNK_SIZE = 4 * 1024 * 1024
+DICTIONARY_SIZE = 32 * 1024
+# 每個執行緒預先讀取與壓縮的成員數
+PREFETCH_FACTOR = 4
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+def _encode_name(name):
+    try:
+        return name.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return name.encode("utf-8"), FLAG_UTF8
+
+def _strip_zip64(extra):
+    """ 保留其他 extra field（例如時間戳記），zip64 欄位由寫入時重新產生 """
+    kept = b""
+    position = 0
+    while position + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from("<2H", extra, position)
+        if header_id != ZIP64_EXTRA_ID:
+            kept += extra[position:position + 4 + data_size]
+        position += 4 + data_size
+    return kept
+
+def _deflate_chunk(data, level, zdict, last):
+    """ 壓縮一段資料；非最後一段以 full flush 結尾，多段直接串接仍是同一個合法的 deflate 串流 """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict) if zdict else \
+        zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+
+def is_stored_name(name, stored_extensions):
+    """ 已壓縮過的資源（png、car、mp4…）再 deflate 幾乎沒有效果，直接儲存 """
+    return os.path.splitext(name)[1].lower() in stored_extensions
+
+def compress_member(name, raw, level, chunk_executor, stored_extensions=()):
+    """ 壓縮單一成員，回傳 (壓縮方式, crc32, 原始大小, 資料)
+
+    大檔案切成 DEFLATE_CHUNK_SIZE 的區段交給 chunk_executor 平行壓縮（每段以前一段結尾作為字典，
+    與 pigz 相同）；壓縮後沒有比較小、等級為 0 或屬於 stored_extensions 時直接儲存。
+    """
+    crc = zlib.crc32(raw)
+    if level <= 0 or not raw or is_stored_name(name, stored_extensions):
+        return zipfile.ZIP_STORED, crc, len(raw), raw
+    if len(raw) <= DEFLATE_CHUNK_SIZE or chunk_executor is None:
+        data = _deflate_chunk(raw, level, None, True)
+    else:
+        view = memoryview(raw)
+        starts = range(0, len(raw), DEFLATE_CHUNK_SIZE)
+        futures = [
+            chunk_executor.submit(
+                _deflate_chunk, view[start:start + DEFLATE_CHUNK_SIZE], level,
+                bytes(view[max(0, start - DICTIONARY_SIZE):start]) if start else None,
+                start + DEFLATE_CHUNK_SIZE >= len(raw),
+            )
+            for start in starts
+        ]
+        data = b"".join(future.result() for future in futures)
+    if len(data) >= len(raw):
+        return zipfile.ZIP_STORED, crc, len(raw), raw
+    return zipfile.ZIP_DEFLATED, crc, len(raw), data
+
+def _read_member(path):
+    if os.path.islink(path):
+        return os.readlink(path).encode("utf-8")
+    with open(path, "rb") as f:
+        return f.read()
+
+def _prepare_member(name, path, source_info, level, chunk_executor, stored_extensions):
+    """ 讀取磁碟上的檔案；和來源成員的 CRC 相同就回傳 None（直接沿用原本的壓縮資料） """
+    raw = _read_member(path)
+    if source_info is not None and source_info.file_size == len(raw) and source_info.CRC == zlib.crc32(raw):
+        return None
+    return compress_member(name, raw, level, chunk_executor, stored_extensions)
+
+
+class _Writer:
+    """ 依序寫入 local header 與資料，最後寫出中央目錄（必要時使用 zip64） """
+
+    def __init__(self, out):
+        self.out = out
+        self.central = []
+
+    def add(self, name, method, flags, date_time, crc, compress_size, file_size,
+            external_attr, create_system, create_version, extra, data_source):
+        offset = self.out.tell()
+        name_bytes, name_flag = _encode_name(name)
+        flags = (flags & ~FLAG_DATA_DESCRIPTOR & ~FLAG_UTF8) | name_flag
+        dos_time, dos_date = _dos_datetime(date_time)
+        zip64 = file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT
+        local_extra = extra
+        if zip64:
+            local_extra = struct.pack("<2H2Q", ZIP64_EXTRA_ID, 16, file_size, compress_size) + extra
+        version = ZIP64_VERSION if zip64 else DEFAULT_VERSION
+        self.out.write(struct.pack(
+            LOCAL_FORMAT, LOCAL_SIGNATURE, version, flags, method, dos_time, dos_date, crc,
+            ZIP64_LIMIT if zip64 else compress_size, ZIP64_LIMIT if zip64 else file_size,
+            len(name_bytes), len(local_extra),
+        ))
+        self.out.write(name_bytes)
+        self.out.write(local_extra)
+        data_source(self.out)
+        self.central.append((name_bytes, flags, method, dos_time, dos_date, crc, compress_size, file_size,
+                             external_attr, create_system, create_version, extra, offset))
+
+    def close(self):
+        cd_offset = self.out.tell()
+        for (name_bytes, flags, method, dos_time, dos_date, crc, compress_size, file_size,
+             external_attr, create_system, create_version, extra, offset) in self.central:
+            zip64_values = [value for value in (file_size, compress_size, offset) if value >= ZIP64_LIMIT]
+            if zip64_values:
+                extra = struct.pack(f"<2H{len(zip64_values)}Q", ZIP64_EXTRA_ID, 8 * len(zip64_values), *zip64_values) + extra
+            version = ZIP64_VERSION if zip64_values else DEFAULT_VERSION
+            self.out.write(struct.pack(
+                CENTRAL_FORMAT, CENTRAL_SIGNATURE, max(create_version, version), create_system, version, 0,
+                flags, method, dos_time, dos_date, crc,
+                min(compress_size, ZIP64_LIMIT), min(file_size, ZIP64_LIMIT),
+                len(name_bytes), len(extra), 0, 0, 0, external_attr, min(offset, ZIP64_LIMIT),
+            ))
+            self.out.write(name_bytes)
+            self.out.write(extra)
+        cd_size = self.out.tell() - cd_offset
+        entries = len(self.central)
+        if entries >= ZIP64_COUNT_LIMIT or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+            eocd64_offset = self.out.tell()
+            self.out.write(struct.pack(
+                ZIP64_EOCD_FORMAT, ZIP64_EOCD_SIGNATURE, ZIP64_EOCD_SIZE - 12, ZIP64_VERSION, ZIP64_VERSION,
+                0, 0, entries, entries, cd_size, cd_offset,
+            ))
+            self.out.write(struct.pack(ZIP64_LOCATOR_FORMAT, ZIP64_LOCATOR_SIGNATURE, 0, eocd64_offset, 1))
+        self.out.write(struct.pack(
+            EOCD_FORMAT, EOCD_SIGNATURE, 0, 0,
+            min(entries, ZIP64_COUNT_LIMIT), min(entries, ZIP64_COUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0,
+        ))
+
+
+def _raw_copier(src, info):
+    """ 原封不動複製來源成員的壓縮資料（不解壓也不重新壓縮） """
+    def copy(out):
+        src.seek(info.header_offset)
+        header = struct.unpack(LOCAL_FORMAT, src.read(LOCAL_SIZE))
+        if header[0] != LOCAL_SIGNATURE:
+            raise ValueError(f"成員 local header 格式錯誤: {info.filename}")
+        src.seek(info.header_offset + LOCAL_SIZE + header[9] + header[10])
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"成員資料不完整: {info.filename}")
+            out.write(chunk)
+            remaining -= len(chunk)
+    return copy
+
+def _scan_payload(unzip_dir):
+    """ 列出解壓目錄下 Payload 內的所有檔案與目錄（成員名稱 -> 路徑） """
+    found = {}
+    payload_dir = os.path.join(unzip_dir, "Payload")
+    for root, dirs, files in os.walk(payload_dir):
+        relative_root = os.path.relpath(root, unzip_dir).replace(os.sep, "/")
+        found[f"{relative_root}/"] = root
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            found[f"{relative_root}/{name}"] = os.path.join(root, name)
+    return found
+
+def _write_archive(plan, source_path, output_path, level, workers, stored_extensions):
+    """ 依 plan 的順序寫出 zip；plan 內每一項為 (成員名稱, 來源 ZipInfo 或 None, 磁碟路徑或 None)
+
+    有來源 ZipInfo 而沒有磁碟路徑的成員直接複製壓縮資料；其他成員在執行緒池中讀取、比對與壓縮，
+    最多預先處理 workers * PREFETCH_FACTOR 個，避免大型 App 整個讀進記憶體。
+    """
+    stats = {"copied": 0, "compressed": 0, "added": 0, "read_bytes": 0, "written_bytes": 0}
+    workers = workers or os.cpu_count() or 1
+    window = workers * PREFETCH_FACTOR
+    stored_extensions = {extension.lower() for extension in stored_extensions}
+    tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as member_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as chunk_executor, \
+            open(source_path, "rb") if source_path else contextlib.nullcontext() as src, \
+            open(tmp_path, "wb") as out:
+        writer = _Writer(out)
+        futures = {}
+        next_submit = 0
+        try:
+            for index, (name, info, path) in enumerate(plan):
+                while next_submit < len(plan) and (len(futures) < window or next_submit <= index):
+                    submit_name, submit_info, submit_path = plan[next_submit]
+                    if submit_path is not None and not submit_name.endswith("/"):
+                        futures[next_submit] = member_executor.submit(
+                            _prepare_member, submit_name, submit_path, submit_info,
+                            level, chunk_executor, stored_extensions,
+                        )
+                    next_submit += 1
+                prepared = futures.pop(index).result() if index in futures else None
+                if info is not None and prepared is None:
+                    writer.add(name, info.compress_type, info.flag_bits, info.date_time, info.CRC,
+                               info.compress_size, info.file_size, info.external_attr,
+                               info.create_system, info.create_version, _strip_zip64(info.extra),
+                               _raw_copier(src, info))
+                    stats["copied"] += 1
+                    stats["read_bytes"] += info.compress_size
+                    continue
+                file_stat = os.lstat(path)
+                date_time = time.localtime(file_stat.st_mtime)[:6]
+                external_attr = (file_stat.st_mode & 0xFFFF) << 16
+                if prepared is None:  # 目錄
+                    external_attr |= 0x10
+                    prepared = (zipfile.ZIP_STORED, 0, 0, b"")
+                method, crc, file_size, data = prepared
+                writer.add(name, method, 0, date_time, crc, len(data), file_size, external_attr,
+                           UNIX_SYSTEM, DEFAULT_VERSION, b"", lambda out, data=data: out.write(data))
+                stats["compressed" if info is not None else "added"] += 1
+                stats["read_bytes"] += file_size
+            writer.close()
+            stats["written_bytes"] = out.tell()
+        except BaseException:
+            for future in futures.values():
+                future.cancel()
+            out.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, output_path)
+    return stats
+
+def pack_directory(unzip_dir, output_path, compress_level=6, workers=None, stored_extensions=()):
+    """ 📦 把解壓目錄中的 Payload 打包成 IPA（取代 `zip -qr`，成員在執行緒池中平行壓縮） """
+    on_disk = _scan_payload(unzip_dir)
+    plan = [(name, None, on_disk[name]) for name in sorted(on_disk)]
+    stats = _write_archive(plan, None, output_path, compress_level, workers, stored_extensions)
+    logging.info(f"📦 打包完成: {stats['added']} 個成員，{stats['written_bytes']} bytes")
+    return stats
+
+def delta_repackage(source_ipa_path, unzip_dir, output_path, since, compress_level=6, workers=None,
+                    stored_extensions=()):
+    """ 📦 以原始 IPA 為基礎重新打包：只重新壓縮內容有變的成員，其餘直接複製壓縮資料
+
+    since 為解壓的時間點：大小相同且修改時間早於 since 的檔案視為未變更；
+    其他檔案會比對 CRC，真的不同才重新壓縮（在多個執行緒中進行）。
+
+    Returns:
+        dict: 沿用、重新壓縮、新增、刪除的成員數，以及讀取與寫入的位元組數。
+    """
+    on_disk = _scan_payload(unzip_dir)
+    with zipfile.ZipFile(source_ipa_path) as source_zip:
+        source_infos = [info for info in source_zip.infolist() if info.filename.startswith("Payload/")]
+    source_names = {info.filename for info in source_infos}
+
+    # 📌 決定每個成員的處理方式：沿用原本的壓縮資料，或讀取磁碟上的檔案比對後重新壓縮
+    plan = []
+    removed = 0
+    for info in source_infos:
+        path = on_disk.get(info.filename)
+        if path is None:
+            removed += 1
+            continue
+        if info.flag_bits & FLAG_ENCRYPTED:
+            raise ValueError(f"不支援加密的成員: {info.filename}")
+        if info.is_dir():
+            plan.append((info.filename, info, None))
+            continue
+        file_stat = os.lstat(path)
+        if stat.S_ISLNK(file_stat.st_mode) or file_stat.st_size != info.file_size or file_stat.st_mtime >= since - MTIME_SLACK:
+            plan.append((info.filename, info, path))
+        else:
+            plan.append((info.filename, info, None))
+    for name in sorted(set(on_disk) - source_names):
+        plan.append((name, None, on_disk[name]))
+
+    stats = _write_archive(plan, source_ipa_path, output_path, compress_level, workers, stored_extensions)
+    stats["removed"] = removed
+    logging.info(f"📦 增量打包完成: 沿用 {stats['copied']} 個，重新壓縮 {stats['compressed']} 個，"
+                 f"新增 {stats['added']} 個，移除 {stats['removed']} 個")
+    return stats
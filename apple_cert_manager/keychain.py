@@ -2,24 +2,35 @@ import subprocess
 from apple_cert_manager.config import config 
 import os
 import tempfile
-import requests
+import secrets
+import threading
 import logging
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.serialization import pkcs12
+from . import runner
 
 logging = logging.getLogger(__name__)
 
+# 一次性 PKCS#12 的金鑰衍生次數（密碼是隨機產生且只用一次，不需要很高）
+PKCS12_KDF_ROUNDS = 2048
 # ✅ Apple WWDR CA 憑證官方下載 URL
 APPLE_WWDR_CA_URL = "https://www.apple.com/certificateauthority/AppleWWDRCAG3.cer"
 
-def unlock_keychain():
-    """🚀 確保 Keychain 存在，然後解鎖"""
-    keychain_path = os.path.expanduser(config.keychain_path)
+# 搜尋列表是整個使用者共用的狀態：讀取後再寫回的過程不能被其他執行緒打斷
+_search_list_lock = threading.Lock()
+
+def unlock_keychain(keychain_path=None):
+    """🚀 確保 Keychain 存在，然後解鎖（預設為 KEYCHAIN_PATH，分片時傳入各分片的路徑）"""
+    keychain_path = os.path.expanduser(keychain_path or config.keychain_path)
     keychain_password = config.keychain_password
 
     try:
         # **🔍 檢查 Keychain 是否存在**
         if not os.path.exists(keychain_path):
             logging.info(f"⚠️ 找不到 Keychain: {keychain_path}，正在建立...")
-            create_keychain(keychain_path, keychain_password)
+            with _search_list_lock:
+                create_keychain(keychain_path, keychain_password)
 
         # **🔓 執行 `security unlock-keychain` 解鎖**
         run_subprocess([
@@ -32,55 +43,115 @@ def unlock_keychain():
         raise Exception(f"❌ 解鎖 Keychain 失敗: {e}")
         
 def create_keychain(keychain_path, keychain_password):
-    """🛠 創建新的 Keychain 並設定為預設"""
+    """🛠 創建新的 Keychain 並加入搜尋列表"""
     try:
         run_subprocess([
             "security", "create-keychain", "-p", keychain_password, keychain_path
         ], "建立新的 Keychain")
-        # 🔍 取得當前系統的 Keychain 列表
-        result = subprocess.run(
-            ["security", "list-keychains"],
-            stdout=subprocess.PIPE, text=True, check=True
-        )
-        existing_keychains = [
-            keychain.strip().strip('"') for keychain in result.stdout.splitlines()
-        ]
-        # 如果 keychain 已經在列表中，則無需添加
-        if keychain_path in existing_keychains:
-            logging.info(f"✅ `{keychain_path}` 已經在 Keychain 搜尋列表內")
-            return
-        # 🚀 保留原始 keychains，並新增我們的 keychain（避免覆蓋）
-        new_keychains = existing_keychains + [keychain_path]
-        # 設定新的 Keychain 列表（確保不覆蓋）
-        run_subprocess(["security", "list-keychains", "-s"] + new_keychains, "更新 Keychain 搜尋列表")
+        add_to_search_list(keychain_path)
         logging.info(f"✅ 已成功建立並設置 Keychain: {keychain_path}")
 
     except subprocess.CalledProcessError as e:
         raise Exception(f"❌ 建立 Keychain 失敗: {e}")
+
+def add_to_search_list(keychain_path):
+    """🔍 把 Keychain 附加到使用者的搜尋列表（保留原有的 Keychain，已在列表內則不變更）
+
+    呼叫端需持有 _search_list_lock。
+    """
+    # 🔍 取得當前系統的 Keychain 列表
+    result = runner.run(["security", "list-keychains"])
+    existing_keychains = [
+        keychain.strip().strip('"') for keychain in result.stdout.splitlines()
+    ]
+    # 如果 keychain 已經在列表中，則無需添加
+    if keychain_path in existing_keychains:
+        logging.info(f"✅ `{keychain_path}` 已經在 Keychain 搜尋列表內")
+        return
+    # 🚀 保留原始 keychains，並新增我們的 keychain（避免覆蓋）
+    new_keychains = existing_keychains + [keychain_path]
+    # 設定新的 Keychain 列表（確保不覆蓋）
+    run_subprocess(["security", "list-keychains", "-s"] + new_keychains, "更新 Keychain 搜尋列表")
+
+def ensure_in_search_list(keychain_path):
+    with _search_list_lock:
+        add_to_search_list(os.path.expanduser(keychain_path))
         
-def import_cert_to_keychain(private_key_path, cert_path):
-    """將私鑰和憑證導入 macOS Keychain"""
-    logging.info("🔐 將憑證和私鑰導入 Keychain...")
+def build_pkcs12(private_key, cert_path):
+    """🔐 在記憶體中把私鑰與憑證組成 PKCS#12，以一次性的隨機密碼加密
+
+    Returns:
+        tuple: (PKCS#12 內容, 密碼)
+    """
+    with open(cert_path, "rb") as f:
+        cert_data = f.read()
     try:
-        unlock_keychain()
-        keychain_path = os.path.expanduser(config.keychain_path)
-        # 導入私鑰
-        subprocess.run([
-            "security", "import", private_key_path,
-            "-k", keychain_path,
-            "-T", "/usr/bin/codesign"  # 允許 codesign 訪問
-        ], check=True)
-        logging.info(f"✅ 私鑰已導入 Keychain: {private_key_path}")
-        # 導入憑證
-        subprocess.run([
-            "security", "import", cert_path,
-            "-k", keychain_path,
-            "-T", "/usr/bin/codesign"
-        ], check=True)
-        logging.info(f"✅ 憑證已導入 Keychain: {cert_path}")
+        cert = x509.load_der_x509_certificate(cert_data)
+    except ValueError:
+        cert = x509.load_pem_x509_certificate(cert_data)
+    passphrase = secrets.token_urlsafe(24)
+    # macOS Sequoia 以前的 `security import` 不支援 PBES2 / AES（BestAvailableEncryption），改用 3DES 與 SHA-1 MAC
+    encryption = (
+        serialization.PrivateFormat.PKCS12.encryption_builder()
+        .kdf_rounds(PKCS12_KDF_ROUNDS)
+        .key_cert_algorithm(pkcs12.PBES.PBESv1SHA1And3KeyTripleDESCBC)
+        .hmac_hash(hashes.SHA1())
+        .build(passphrase.encode("utf-8"))
+    )
+    bundle = pkcs12.serialize_key_and_certificates(
+        os.path.splitext(os.path.basename(cert_path))[0].encode("utf-8"), private_key, cert, None, encryption,
+    )
+    return bundle, passphrase
 
-    except subprocess.CalledProcessError as e:
+def import_cert_to_keychain(private_key, cert_path, keychain_path=None):
+    """將私鑰和憑證導入 macOS Keychain"""
+    errors = import_identities([(private_key, cert_path)], keychain_path)
+    if errors[0]:
+        raise errors[0]
+
+def import_identities(identities, keychain_path=None):
+    """🔐 批量導入身分（私鑰 + 憑證）：整批只解鎖一次，每個身分以一個加密的 PKCS#12 一次導入
+
+    PKCS#12 只在導入的瞬間以 0600 權限寫入暫存檔，明文私鑰不會落地。
+
+    Args:
+        identities (list): [(私鑰物件, 憑證路徑)]
+        keychain_path (str): 導入的 Keychain（預設為 KEYCHAIN_PATH）
+
+    Returns:
+        list: 與 identities 對應的錯誤（成功為 None）；解鎖失敗時直接拋出例外
+    """
+    logging.info(f"🔐 將 {len(identities)} 個憑證和私鑰導入 Keychain...")
+    try:
+        unlock_keychain(keychain_path)
+    except Exception as e:
         raise Exception(f"❌ 導入 Keychain 失敗: {e}")
+    keychain_path = os.path.expanduser(keychain_path or config.keychain_path)
+    errors = []
+    with tempfile.TemporaryDirectory(prefix="acm-identity-") as tmp_dir:
+        for index, (private_key, cert_path) in enumerate(identities):
+            bundle_path = os.path.join(tmp_dir, f"{index}.p12")
+            try:
+                bundle, passphrase = build_pkcs12(private_key, cert_path)
+                fd = os.open(bundle_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(bundle)
+                run_subprocess([
+                    "security", "import", bundle_path,
+                    "-k", keychain_path,
+                    "-f", "pkcs12",
+                    "-P", passphrase,
+                    "-T", "/usr/bin/codesign"  # 允許 codesign 訪問
+                ], "導入 Keychain", redact=(passphrase,))
+                logging.info(f"✅ 憑證與私鑰已導入 Keychain: {cert_path}")
+                errors.append(None)
+            except Exception as e:
+                logging.error(f"❌ 導入 Keychain 失敗: {cert_path}: {e}")
+                errors.append(Exception(f"❌ 導入 Keychain 失敗: {e}"))
+            finally:
+                if os.path.exists(bundle_path):
+                    os.remove(bundle_path)
+    return errors
         
 def configure_keychain_search():
     """設定自訂 Keychain 為預設搜索範圍"""
@@ -94,10 +165,10 @@ def configure_keychain_search():
     except Exception as e:
         raise Exception(f"設置 Keychain 搜索範圍失敗：{e}")
 
-def set_key_partition_list():
+def set_key_partition_list(keychain_path=None):
     """設定 Keychain 分區列表權限"""
     try:
-        keychain_path = os.path.expanduser(config.keychain_path)
+        keychain_path = os.path.expanduser(keychain_path or config.keychain_path)
         keychain_password = config.keychain_password
         run_subprocess(
             ["security", "set-key-partition-list", "-S", "apple-tool:,apple:", "-k", keychain_password, keychain_path],
@@ -111,10 +182,7 @@ def restore_default_keychain(original_keychains):
     """恢復預設鑰匙圈"""
     if original_keychains:
         try:
-            subprocess.run(
-                ["security", "list-keychains", "-s"] + original_keychains,
-                check=True
-            )
+            runner.run(["security", "list-keychains", "-s"] + original_keychains)
             #logging.info(f"已恢復預設鑰匙圈：{original_keychains}")
         except Exception as e:
             raise Exception(f"恢復預設鑰匙圈失敗：{e}")
@@ -126,7 +194,6 @@ def debug_keychain_identities():
         result = run_subprocess(
             ["security", "find-identity", "-p", "codesigning", keychain_path],
             "列出 Keychain 簽名身份",
-            stdout=subprocess.PIPE,
         )
         logging.info("Keychain 中的簽名身份：")
         logging.info(result.stdout)
@@ -135,15 +202,15 @@ def debug_keychain_identities():
         
 def is_apple_wwdr_installed(keychain_path):
     """🔍 檢查 `AppleWWDRCA` 憑證是否已安裝"""
-    result = subprocess.run(["security", "find-certificate", "-c", "Apple Worldwide Developer Relations", "-a", keychain_path],
-        capture_output=True, text=True)
+    result = runner.run(["security", "find-certificate", "-c", "Apple Worldwide Developer Relations", "-a", keychain_path],
+        check=False)
     return "Apple Worldwide Developer Relations" in result.stdout
 
 
-def install_apple_wwdr_certificate():
+def install_apple_wwdr_certificate(keychain_path=None):
     """🚀 免 `sudo` 安裝 `Apple WWDR CA` 到指定 Keychain"""
     # 1️⃣ 取得 Keychain 路徑
-    keychain_path = os.path.expanduser(config.keychain_path)
+    keychain_path = os.path.expanduser(keychain_path or config.keychain_path)
     # 2️⃣ 檢查是否已安裝
     if is_apple_wwdr_installed(keychain_path):
         logging.info(f"✅ `Apple WWDR CA` 憑證已安裝於 {keychain_path}，無需重新安裝")
@@ -151,7 +218,8 @@ def install_apple_wwdr_certificate():
     logging.info(f"🔍 `Apple WWDR CA` 憑證未安裝於 {keychain_path}，正在下載...")
     try:
         # 3️⃣ 下載 `AppleWWDRCA` 憑證
-        response = requests.get(APPLE_WWDR_CA_URL)
+        from apple_cert_manager.http_client import http_client
+        response = http_client.get(APPLE_WWDR_CA_URL)
         if response.status_code != 200:
             raise Exception("❌ 無法下載 `Apple WWDR CA` 憑證")
         # 4️⃣ 保存到臨時檔案
@@ -169,10 +237,14 @@ def install_apple_wwdr_certificate():
     except Exception as e:
         raise Exception(f"❌ 安裝 `Apple WWDR CA` 失敗: {e}")
         
-def run_subprocess(command, description):
-    """🚀 執行 Shell 命令，並在失敗時拋出異常"""
+def run_subprocess(command, description, redact=()):
+    """🚀 執行 Shell 命令，並在失敗時拋出異常（redact 中的字串，例如密碼，不會出現在錯誤訊息）"""
     try:
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
-        return result
+        return runner.run(command)
     except subprocess.CalledProcessError as e:
-        raise Exception(f"❌ {description} 失敗: {e.stderr.strip() or str(e)}")
\ No newline at end of file
+        message = e.stderr.strip() or str(e)
+        for value in redact:
+            message = message.replace(value, "******")
+        raise Exception(f"❌ {description} 失敗: {message}")
+    except subprocess.TimeoutExpired as e:
+        raise Exception(f"❌ {description} 逾時（{e.timeout} 秒）")
\ No newline at end of file
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import logging
+import threading
+from apple_cert_manager.config import config
+from . import keychain
+
+logging = logging.getLogger(__name__)
+
+# ✅ 資料表只需確認一次（舊的資料庫在第一次使用時補建）
+_table_ready = False
+# 分配分片時要先讀取各分片數量再寫入，整個過程需互斥
+_assign_lock = threading.Lock()
+# 每個分片各自的鎖與狀態：不同分片的準備工作互不等待
+_shard_locks = {}
+_shard_locks_lock = threading.Lock()
+_prepared = set()
+_partition_dirty = set()
+
+
+def shard_path(index):
+    """ 第 0 個分片就是 KEYCHAIN_PATH（沿用既有的 Keychain），其他分片在檔名後加上編號 """
+    base_path = os.path.expanduser(config.keychain_path)
+    if index == 0:
+        return base_path
+    root, extension = os.path.splitext(base_path)
+    return f"{root}-{index}{extension}"
+
+def shard_paths():
+    return [shard_path(index) for index in range(max(config.keychain_shards, 1))]
+
+def _connect():
+    global _table_ready
+    conn = sqlite3.connect(config.db_path)
+    if not _table_ready:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS keychain_shards (
+            cert_id TEXT PRIMARY KEY,
+            shard INTEGER NOT NULL
+        )
+        """)
+        conn.commit()
+        _table_ready = True
+    return conn
+
+def shard_of(cert_id):
+    """ 憑證所在的分片編號；沒有紀錄的憑證（分片功能之前建立的）都在第 0 個分片 """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT shard FROM keychain_shards WHERE cert_id = ?", (cert_id,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+def keychain_for(cert_id):
+    """ 🔑 憑證所在的 Keychain 路徑 """
+    return shard_path(shard_of(cert_id))
+
+def _legacy_count(conn):
+    """ 帳號使用中、但沒有分片紀錄的憑證數（分片功能之前建立的，都在第 0 個分片） """
+    try:
+        return conn.execute("""
+        SELECT COUNT(*) FROM accounts
+        WHERE cert_id IS NOT NULL AND cert_id != ''
+          AND cert_id NOT IN (SELECT cert_id FROM keychain_shards)
+        """).fetchone()[0]
+    except sqlite3.OperationalError:  # 帳號資料表尚未建立
+        return 0
+
+def assign(cert_id):
+    """ 為新憑證選擇憑證數最少的分片並記錄，回傳分片編號（第 0 個分片也計入沒有紀錄的舊憑證） """
+    with _assign_lock:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT shard FROM keychain_shards WHERE cert_id = ?", (cert_id,)).fetchone()
+            if row:
+                return row[0]
+            counts = dict(conn.execute("SELECT shard, COUNT(*) FROM keychain_shards GROUP BY shard").fetchall())
+            counts[0] = counts.get(0, 0) + _legacy_count(conn)
+            shard = min(range(max(config.keychain_shards, 1)), key=lambda index: (counts.get(index, 0), index))
+            conn.execute("INSERT INTO keychain_shards (cert_id, shard) VALUES (?, ?)", (cert_id, shard))
+            conn.commit()
+        finally:
+            conn.close()
+    logging.info(f"🔑 憑證 {cert_id} 分配到 Keychain 分片 {shard}")
+    return shard
+
+def forget(cert_id):
+    """ 憑證刪除後移除分片紀錄 """
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM keychain_shards WHERE cert_id = ?", (cert_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _shard_lock(keychain_path):
+    with _shard_locks_lock:
+        return _shard_locks.setdefault(keychain_path, threading.Lock())
+
+def prepare(keychain_path):
+    """ 🔓 簽名前準備分片：解鎖，第一次使用時安裝 WWDR 並加入搜尋列表，有新身分導入時重設分區列表權限
+
+    只動到這個分片本身，不會改寫或還原整個搜尋列表，不同分片可以同時簽名。
+    """
+    with _shard_lock(keychain_path):
+        keychain.unlock_keychain(keychain_path)
+        if keychain_path not in _prepared:
+            keychain.install_apple_wwdr_certificate(keychain_path)
+            keychain.ensure_in_search_list(keychain_path)
+            _prepared.add(keychain_path)
+            _partition_dirty.add(keychain_path)
+        if keychain_path in _partition_dirty:
+            keychain.set_key_partition_list(keychain_path)
+            _partition_dirty.discard(keychain_path)
+
+def import_identities(identities):
+    """ 🔐 把身分導入各自分配到的分片：同一個分片的身分在一次解鎖內導入，不同分片同時導入
+
+    Args:
+        identities (list): [(私鑰物件, 憑證 ID)]
+
+    Returns:
+        list: 與 identities 對應的錯誤（成功為 None）
+    """
+    groups = {}
+    errors = [None] * len(identities)
+    for index, (private_key, cert_id) in enumerate(identities):
+        try:
+            path = shard_path(assign(cert_id))
+        except sqlite3.Error as e:
+            errors[index] = e
+            continue
+        groups.setdefault(path, []).append((index, private_key, cert_id))
+
+    def import_group(path, members):
+        from . import certificate  # 避免循環匯入：certificate 會使用本模組
+        with _shard_lock(path):
+            try:
+                results = keychain.import_identities(
+                    [(private_key, certificate.get_cert_path(cert_id)) for _, private_key, cert_id in members], path
+                )
+            except Exception as e:
+                results = [e] * len(members)
+            _partition_dirty.add(path)
+        for (index, _, _), error in zip(members, results):
+            errors[index] = error
+
+    threads = [threading.Thread(target=import_group, args=item) for item in groups.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+def unlock_all():
+    """ 🔓 解鎖所有分片（常駐服務定期執行） """
+    for path in shard_paths():
+        with _shard_lock(path):
+            keychain.unlock_keychain(path)
@@ -1,41 +1,169 @@
 # log_config.py
+import atexit
+import contextlib
+import contextvars
+import json
 import logging
-from rich.console import Console
-from rich.logging import RichHandler
-from rich.theme import Theme
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
 
-def configure_logging():
-    # 配置 root logger
-    root_logger = logging.getLogger()
-    root_logger.handlers.clear()
-    
-    custom_theme = Theme({
-        "debug": "cyan",
-        "info": "green",
-        "warning": "yellow",
-        "error": "red",
-        "critical": "bold red"
-    })
-    
-    console = Console(theme=custom_theme)
-    
-    class ColoredRichHandler(RichHandler):
-        def emit(self, record):
+# 📌 每一行日誌都會帶上目前處理中的 Apple ID 與工作 ID（各執行緒 / 協程獨立）
+apple_id_var = contextvars.ContextVar("apple_id", default=None)
+job_id_var = contextvars.ContextVar("job_id", default=None)
+
+LOG_FORMATS = ("rich", "json")
+
+_listener = None
+
+
+def new_job_id():
+    """產生簡短的工作 ID"""
+    return uuid.uuid4().hex[:12]
+
+
+@contextlib.contextmanager
+def log_context(apple_id=None, job_id=None):
+    """在區塊內的日誌加上 apple_id / job_id，未指定的欄位沿用外層設定"""
+    tokens = []
+    if apple_id is not None:
+        tokens.append((apple_id_var, apple_id_var.set(apple_id)))
+    if job_id is not None:
+        tokens.append((job_id_var, job_id_var.set(job_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """在呼叫端執行緒把 contextvars 的值寫入 record（佇列另一端已拿不到呼叫端的 context）"""
+
+    def filter(self, record):
+        record.apple_id = apple_id_var.get()
+        record.job_id = job_id_var.get()
+        return True
+
+
+class ColoredRichHandler(logging.Handler):
+    """依等級上色輸出，rich 的 Console 在第一次輸出時才建立"""
+
+    def __init__(self):
+        super().__init__()
+        self._console = None
+
+    @property
+    def console(self):
+        if self._console is None:
+            # rich 載入成本不低，沒有輸出日誌的指令就不用付這個成本
+            from rich.console import Console
+            from rich.theme import Theme
+            custom_theme = Theme({
+                "debug": "cyan",
+                "info": "green",
+                "warning": "yellow",
+                "error": "red",
+                "critical": "bold red"
+            })
+            self._console = Console(theme=custom_theme)
+        return self._console
+
+    def emit(self, record):
+        try:
             level_name = record.levelname.lower()
             message = self.format(record)
             self.console.print(f"[{level_name}]{message}[/{level_name}]")
-    
-    class CustomFormatter(logging.Formatter):
-        def format(self, record):
-            levelname = record.levelname
-            name = record.name
-            message = record.getMessage()
-            return f"{message}"
-    
-    handler = ColoredRichHandler(console=console, show_time=False, show_path=False, show_level=False)
-    handler.setFormatter(CustomFormatter())
-    
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(handler)
-    
-    return root_logger
\ No newline at end of file
+        except Exception:
+            self.handleError(record)
+
+class CustomFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_text:
+            message = f"{message}\n{record.exc_text}"
+        return f"{message}"
+
+class JsonFormatter(logging.Formatter):
+    """一行一筆 JSON，方便機器解析"""
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "apple_id": getattr(record, "apple_id", None),
+            "job_id": getattr(record, "job_id", None),
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """只在呼叫端凍結訊息內容，格式化與輸出交給背景執行緒"""
+
+    def prepare(self, record):
+        # 參數可能是之後會被修改的物件，這裡先合併成字串；其餘（rich markup / JSON 序列化）留給背景執行緒
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # 會先把佇列內剩餘的日誌輸出完
+        _listener = None
+
+
+def configure_logging(log_format="rich", level=logging.INFO):
+    """配置 root logger：呼叫端只負責把 record 放進佇列，由背景執行緒格式化並輸出
+
+    Args:
+        log_format (str): `rich`（彩色輸出）或 `json`（一行一筆 JSON，輸出到 stderr）。
+        level (int | str): 日誌等級，低於此等級的日誌在呼叫端就會被略過。
+    """
+    global _listener
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"不支援的日誌格式: {log_format}")
+
+    # 配置 root logger
+    root_logger = logging.getLogger()
+    _stop_listener()
+    root_logger.handlers.clear()
+
+    if log_format == "json":
+        output_handler = logging.StreamHandler(sys.stderr)  # stdout 保留給指令本身的輸出
+        output_handler.setFormatter(JsonFormatter())
+    else:
+        output_handler = ColoredRichHandler()
+        output_handler.setFormatter(CustomFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    _listener = logging.handlers.QueueListener(log_queue, output_handler)
+    _listener.start()
+
+    root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+
+    return root_logger
+
+
+def flush_logging():
+    """確保佇列內的日誌都已輸出（例如要直接 print 結果之前）"""
+    if _listener is not None:
+        listener = _listener
+        listener.stop()
+        listener.start()
+
+
+atexit.register(_stop_listener)
@@ -0,0 +1,972 @@
+import os
+import re
+import struct
+import hashlib
+import logging
+import plistlib
+import threading
+from datetime import datetime, timezone
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.x509.oid import NameOID, AuthorityInformationAccessOID, ExtensionOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from apple_cert_manager.config import config
+from . import mobileprovision
+
+logging = logging.getLogger(__name__)
+
+# 📌 Mach-O 常數
+MH_MAGIC = 0xFEEDFACE
+MH_MAGIC_64 = 0xFEEDFACF
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+MH_EXECUTE = 0x2
+LC_SEGMENT = 0x1
+LC_SEGMENT_64 = 0x19
+LC_CODE_SIGNATURE = 0x1D
+CPU_TYPE_ARM64 = 0x0100000C
+
+# 📌 Code Signing blob 常數（皆為 big-endian）
+CSMAGIC_REQUIREMENT = 0xFADE0C00
+CSMAGIC_REQUIREMENTS = 0xFADE0C01
+CSMAGIC_CODEDIRECTORY = 0xFADE0C02
+CSMAGIC_EMBEDDED_SIGNATURE = 0xFADE0CC0
+CSMAGIC_DETACHED_SIGNATURE = 0xFADE0CC1
+CSMAGIC_BLOBWRAPPER = 0xFADE0B01
+CSMAGIC_EMBEDDED_ENTITLEMENTS = 0xFADE7171
+CSMAGIC_EMBEDDED_DER_ENTITLEMENTS = 0xFADE7172
+CSSLOT_CODEDIRECTORY = 0
+CSSLOT_INFOSLOT = 1
+CSSLOT_REQUIREMENTS = 2
+CSSLOT_RESOURCEDIR = 3
+CSSLOT_ENTITLEMENTS = 5
+CSSLOT_DER_ENTITLEMENTS = 7
+CSSLOT_SIGNATURESLOT = 0x10000
+CS_RUNTIME = 0x10000
+CS_EXECSEG_MAIN_BINARY = 0x1
+CS_EXECSEG_ALLOW_UNSIGNED = 0x10
+CD_VERSION = 0x20400
+CD_HEADER_SIZE = 88
+CS_HASHTYPE_SHA256 = 2
+HASH_SIZE = 32
+PAGE_SIZE_LOG2 = 12
+PAGE_SIZE = 1 << PAGE_SIZE_LOG2
+CDHASH_SIZE = 20
+
+# 📌 Designated requirement 運算元
+OP_IDENT = 2
+OP_AND = 6
+OP_CERT_FIELD = 11
+OP_CERT_GENERIC = 14
+OP_APPLE_GENERIC_ANCHOR = 15
+MATCH_EXISTS = 0
+MATCH_EQUAL = 1
+OID_APPLE_WWDR_MARKER = "1.2.840.113635.100.6.2.1"
+
+# 📌 CMS 用到的 OID
+OID_DATA = "1.2.840.113549.1.7.1"
+OID_SIGNED_DATA = "1.2.840.113549.1.7.2"
+OID_CONTENT_TYPE = "1.2.840.113549.1.9.3"
+OID_MESSAGE_DIGEST = "1.2.840.113549.1.9.4"
+OID_SIGNING_TIME = "1.2.840.113549.1.9.5"
+OID_APPLE_CDHASHES = "1.2.840.113635.100.9.1"
+OID_APPLE_CDHASHES2 = "1.2.840.113635.100.9.2"
+OID_SHA256 = "2.16.840.1.101.3.4.2.1"
+OID_RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+OID_ECDSA_SHA256 = "1.2.840.10045.4.3.2"
+# 簽章屬性、演算法參數與 RSA/ECDSA 簽章預留的空間（再加上憑證鏈的大小）
+CMS_RESERVE = 4096
+
+# 📌 iOS bundle 的資源規則（與 codesign 產生的 CodeResources 相同）
+RESOURCE_RULES = {
+    "^.*": True,
+    "^.*\\.lproj/": {"optional": True, "weight": 1000.0},
+    "^.*\\.lproj/locversion.plist$": {"omit": True, "weight": 1100.0},
+    "^Base\\.lproj/": {"weight": 1010.0},
+    "^version.plist$": True,
+}
+RESOURCE_RULES2 = {
+    "^.*": True,
+    "^.*\\.dSYM($|/)": {"weight": 11.0},
+    "^(.*/)?\\.DS_Store$": {"omit": True, "weight": 2000.0},
+    "^.*\\.lproj/": {"optional": True, "weight": 1000.0},
+    "^.*\\.lproj/locversion.plist$": {"omit": True, "weight": 1100.0},
+    "^Base\\.lproj/": {"weight": 1010.0},
+    "^Info\\.plist$": {"omit": True, "weight": 20.0},
+    "^PkgInfo$": {"omit": True, "weight": 20.0},
+    "^embedded\\.provisionprofile$": {"weight": 20.0},
+    "^version\\.plist$": {"weight": 20.0},
+}
+NESTED_BUNDLE_SUFFIXES = (".app", ".appex", ".framework", ".xpc")
+
+# ✅ 依 AIA 下載的中繼憑證快取：憑證 SHA-1 -> 上一層憑證（None 代表沒有或無法取得）
+_issuer_cache = {}
+_issuer_lock = threading.Lock()
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+# 🔐 簽名身分
+class Identity:
+    """ 🔐 簽名身分：私鑰、憑證與 CMS 要附上的憑證鏈（不含根憑證以外的重複項） """
+
+    def __init__(self, private_key, certificate, chain=()):
+        self.private_key = private_key
+        self.certificate = certificate
+        self.chain = [cert for cert in chain if cert.fingerprint(hashes.SHA1()) != self.sha1_bytes]
+
+    @property
+    def sha1_bytes(self):
+        return self.certificate.fingerprint(hashes.SHA1())
+
+    @property
+    def sha1(self):
+        """ 與 `security find-identity` 顯示的 SHA-1 相同（大寫十六進位） """
+        return self.sha1_bytes.hex().upper()
+
+    @property
+    def common_name(self):
+        names = self.certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+        return names[0].value if names else ""
+
+    @property
+    def team_id(self):
+        names = self.certificate.subject.get_attributes_for_oid(NameOID.ORGANIZATIONAL_UNIT_NAME)
+        return names[0].value if names else ""
+
+    def certificates(self):
+        return [self.certificate] + self.chain
+
+
+def load_identity(p12_path, password=None, fetch_chain=True):
+    """ 📂 從 PKCS#12 讀取簽名身分；fetch_chain 時依憑證的 AIA 補齊中繼憑證（WWDR、Apple Root CA） """
+    with open(p12_path, "rb") as f:
+        data = f.read()
+    password = password.encode("utf-8") if isinstance(password, str) else password
+    private_key, certificate, additional = pkcs12.load_key_and_certificates(data, password)
+    if private_key is None or certificate is None:
+        raise ValueError(f"❌ PKCS#12 缺少私鑰或憑證: {p12_path}")
+    chain = list(additional or [])
+    if fetch_chain:
+        chain.extend(cert for cert in _issuer_chain(certificate) if cert not in chain)
+    return Identity(private_key, certificate, chain)
+
+def _issuer_chain(certificate, max_depth=3):
+    """ 沿著 AIA caIssuers 往上取得憑證鏈（結果快取在記憶體與 CERT_DIR_PATH，失敗時只記錄警告） """
+    chain = []
+    current = certificate
+    for _ in range(max_depth):
+        if current.issuer == current.subject:
+            break
+        issuer = _fetch_issuer(current)
+        if issuer is None:
+            break
+        chain.append(issuer)
+        current = issuer
+    return chain
+
+def _fetch_issuer(certificate):
+    key = certificate.fingerprint(hashes.SHA1())
+    with _issuer_lock:
+        if key in _issuer_cache:
+            return _issuer_cache[key]
+    try:
+        access = certificate.extensions.get_extension_for_oid(ExtensionOID.AUTHORITY_INFORMATION_ACCESS).value
+        urls = [item.access_location.value for item in access
+                if item.access_method == AuthorityInformationAccessOID.CA_ISSUERS]
+    except x509.ExtensionNotFound:
+        urls = []
+    issuer = None
+    for url in urls:
+        cache_path = os.path.join(config.cert_dir_path or ".", f"issuer-{hashlib.sha1(url.encode()).hexdigest()}.cer")
+        try:
+            if os.path.exists(cache_path):
+                with open(cache_path, "rb") as f:
+                    content = f.read()
+            else:
+                from apple_cert_manager.http_client import http_client
+                response = http_client.get(url)
+                if response.status_code != 200:
+                    raise ValueError(f"HTTP {response.status_code}")
+                content = response.content
+                with open(cache_path, "wb") as f:
+                    f.write(content)
+            issuer = _load_certificate(content)
+            break
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ 無法取得中繼憑證 {url}: {e}")
+    with _issuer_lock:
+        _issuer_cache[key] = issuer
+    return issuer
+
+def _load_certificate(content):
+    if content.lstrip().startswith(b"-----BEGIN"):
+        return x509.load_pem_x509_certificate(content)
+    return x509.load_der_x509_certificate(content)
+
+
+# 📦 DER 編碼（CMS、DER Entitlements）
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+def _der_int(value):
+    size = max(1, (value.bit_length() + 8) // 8)
+    return _der(0x02, value.to_bytes(size, "big", signed=True))
+
+def _oid_bytes(oid):
+    parts = [int(part) for part in oid.split(".")]
+    encoded = bytes([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.append(0x80 | (part & 0x7F))
+            part >>= 7
+        encoded += bytes(reversed(chunk))
+    return encoded
+
+def _der_oid(oid):
+    return _der(0x06, _oid_bytes(oid))
+
+def _der_seq(*items):
+    return _der(0x30, b"".join(items))
+
+def _der_set(*items):
+    """ DER 的 SET OF 依編碼後的位元組排序 """
+    return _der(0x31, b"".join(sorted(items)))
+
+def _algorithm(oid, null_params=True):
+    return _der_seq(_der_oid(oid), b"\x05\x00") if null_params else _der_seq(_der_oid(oid))
+
+def _der_entitlement_value(value):
+    if isinstance(value, bool):
+        return _der(0x01, b"\xff" if value else b"\x00")
+    if isinstance(value, int):
+        return _der_int(value)
+    if isinstance(value, str):
+        return _der(0x0C, value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return _der(0x30, b"".join(_der_entitlement_value(item) for item in value))
+    if isinstance(value, dict):
+        return _der(0xB0, b"".join(
+            _der_seq(_der(0x0C, key.encode("utf-8")), _der_entitlement_value(value[key]))
+            for key in sorted(value, key=lambda key: key.encode("utf-8"))
+        ))
+    raise ValueError(f"❌ Entitlements 含有無法轉成 DER 的值: {value!r}")
+
+def der_entitlements(entitlements):
+    """ `codesign --generate-entitlement-der` 的格式：[APPLICATION 16] { INTEGER 1, [CONTEXT 16] dict } """
+    return _der(0x70, _der_int(1) + _der_entitlement_value(entitlements))
+
+
+# 🧱 Code Signing blob
+def _blob(magic, payload):
+    return struct.pack(">II", magic, len(payload) + 8) + payload
+
+def _super_blob(magic, slots):
+    """ slots: [(slot 類型, blob)]，依類型排序後寫入索引 """
+    slots = sorted(slots)
+    offset = 12 + 8 * len(slots)
+    index, body = b"", b""
+    for slot_type, blob in slots:
+        index += struct.pack(">II", slot_type, offset + len(body))
+        body += blob
+    return struct.pack(">III", magic, offset + len(body), len(slots)) + index + body
+
+def _parse_super_blob(data):
+    magic, length, count = struct.unpack_from(">III", data, 0)
+    slots = {}
+    for i in range(count):
+        slot_type, offset = struct.unpack_from(">II", data, 12 + 8 * i)
+        blob_length = struct.unpack_from(">I", data, offset + 4)[0]
+        slots[slot_type] = data[offset:offset + blob_length]
+    return magic, slots
+
+def _req_data(value):
+    value = value if isinstance(value, bytes) else value.encode("utf-8")
+    return struct.pack(">I", len(value)) + value + b"\x00" * (_align(len(value), 4) - len(value))
+
+def designated_requirement_text(identifier, common_name):
+    return (f'identifier "{identifier}" and anchor apple generic and '
+            f'certificate leaf[subject.CN] = "{common_name}" and '
+            f'certificate 1[field.{OID_APPLE_WWDR_MARKER}] exists')
+
+def requirements_blob(identifier, common_name):
+    """ 只含 designated requirement 的 Requirements 集合（與 codesign 預設產生的相同） """
+    expression = struct.pack(">III", OP_AND, OP_AND, OP_AND)
+    expression += struct.pack(">I", OP_IDENT) + _req_data(identifier)
+    expression += struct.pack(">I", OP_APPLE_GENERIC_ANCHOR)
+    expression += struct.pack(">Ii", OP_CERT_FIELD, 0) + _req_data("subject.CN") \
+        + struct.pack(">I", MATCH_EQUAL) + _req_data(common_name)
+    expression += struct.pack(">Ii", OP_CERT_GENERIC, 1) + _req_data(_oid_bytes(OID_APPLE_WWDR_MARKER)) \
+        + struct.pack(">I", MATCH_EXISTS)
+    requirement = _blob(CSMAGIC_REQUIREMENT, struct.pack(">I", 1) + expression)  # kind 1：expression
+    return _super_blob(CSMAGIC_REQUIREMENTS, [(3, requirement)])  # 3：designated requirement
+
+def code_directory(code, code_limit, identifier, team_id, special_hashes, flags=0,
+                   exec_seg=(0, 0, 0)):
+    """ 🧾 建立 SHA-256 CodeDirectory
+
+    Args:
+        code (bytes-like): 要雜湊的內容（只取前 code_limit 位元組）
+        special_hashes (dict): 特殊 slot 編號 -> 雜湊（沒有的 slot 以 0 填滿）
+        exec_seg (tuple): (execSegBase, execSegLimit, execSegFlags)
+    """
+    view = memoryview(code)
+    code_hashes = b"".join(
+        hashlib.sha256(view[offset:min(offset + PAGE_SIZE, code_limit)]).digest()
+        for offset in range(0, code_limit, PAGE_SIZE)
+    )
+    n_special = max(special_hashes, default=0)
+    special = b"".join(special_hashes.get(slot, b"\x00" * HASH_SIZE) for slot in range(n_special, 0, -1))
+    ident = identifier.encode("utf-8") + b"\x00"
+    team = team_id.encode("utf-8") + b"\x00" if team_id else b""
+    ident_offset = CD_HEADER_SIZE
+    team_offset = ident_offset + len(ident) if team else 0
+    hash_offset = ident_offset + len(ident) + len(team) + len(special)
+    length = hash_offset + len(code_hashes)
+    header = struct.pack(
+        ">IIIIIIIIIBBBBIIIIQQQQ",
+        CSMAGIC_CODEDIRECTORY, length, CD_VERSION, flags, hash_offset, ident_offset,
+        n_special, len(code_hashes) // HASH_SIZE, min(code_limit, 0xFFFFFFFF),
+        HASH_SIZE, CS_HASHTYPE_SHA256, 0, PAGE_SIZE_LOG2, 0, 0, team_offset, 0,
+        code_limit if code_limit > 0xFFFFFFFF else 0, *exec_seg,
+    )
+    return header + ident + team + special + code_hashes
+
+def code_directory_size(code_limit, identifier, team_id, n_special):
+    return (CD_HEADER_SIZE + len(identifier.encode("utf-8")) + 1 + (len(team_id.encode("utf-8")) + 1 if team_id else 0)
+            + n_special * HASH_SIZE + _align(code_limit, PAGE_SIZE) // PAGE_SIZE * HASH_SIZE)
+
+def cdhash(cd):
+    return hashlib.sha256(cd).digest()[:CDHASH_SIZE]
+
+def cms_signature(cd, identity, signing_time=None):
+    """ ✍️ 對 CodeDirectory 產生 detached CMS SignedData（含 Apple 的 CDHashes 屬性，不含時間戳記） """
+    digest = hashlib.sha256(cd).digest()
+    signing_time = (signing_time or datetime.now(timezone.utc)).strftime("%y%m%d%H%M%SZ").encode()
+    cdhashes_plist = plistlib.dumps({"cdhashes": [cdhash(cd)]}, fmt=plistlib.FMT_XML)
+    attributes = [
+        _der_seq(_der_oid(OID_CONTENT_TYPE), _der_set(_der_oid(OID_DATA))),
+        _der_seq(_der_oid(OID_SIGNING_TIME), _der_set(_der(0x17, signing_time))),
+        _der_seq(_der_oid(OID_MESSAGE_DIGEST), _der_set(_der(0x04, digest))),
+        _der_seq(_der_oid(OID_APPLE_CDHASHES), _der_set(_der(0x04, cdhashes_plist))),
+        _der_seq(_der_oid(OID_APPLE_CDHASHES2), _der_set(_der_seq(_der_oid(OID_SHA256), _der(0x04, digest)))),
+    ]
+    signed_attributes = _der_set(*attributes)
+    key = identity.private_key
+    if isinstance(key, rsa.RSAPrivateKey):
+        signature = key.sign(signed_attributes, padding.PKCS1v15(), hashes.SHA256())
+        signature_algorithm = _algorithm(OID_RSA_ENCRYPTION)
+    elif isinstance(key, ec.EllipticCurvePrivateKey):
+        signature = key.sign(signed_attributes, ec.ECDSA(hashes.SHA256()))
+        signature_algorithm = _algorithm(OID_ECDSA_SHA256, null_params=False)
+    else:
+        raise ValueError(f"❌ 不支援的私鑰類型: {type(key).__name__}")
+
+    certificate = identity.certificate
+    signer_info = _der_seq(
+        _der_int(1),
+        _der_seq(certificate.issuer.public_bytes(), _der_int(certificate.serial_number)),
+        _algorithm(OID_SHA256),
+        b"\xa0" + signed_attributes[1:],  # [0] IMPLICIT：只換掉 SET 的 tag
+        signature_algorithm,
+        _der(0x04, signature),
+    )
+    certificates = b"".join(cert.public_bytes(serialization.Encoding.DER) for cert in identity.certificates())
+    signed_data = _der_seq(
+        _der_int(1),
+        _der_set(_algorithm(OID_SHA256)),
+        _der_seq(_der_oid(OID_DATA)),
+        _der(0xA0, certificates),
+        _der_set(signer_info),
+    )
+    return _der_seq(_der_oid(OID_SIGNED_DATA), _der(0xA0, signed_data))
+
+def cms_reserve(identity):
+    return sum(len(cert.public_bytes(serialization.Encoding.DER)) for cert in identity.certificates()) + CMS_RESERVE
+
+
+# 🧩 Mach-O 解析與簽名
+def _slices(data):
+    """ 回傳 [(偏移, 大小, cputype, cpusubtype, align)]；thin Mach-O 只有一個 slice """
+    magic = struct.unpack_from(">I", data, 0)[0]
+    if magic in (FAT_MAGIC, FAT_MAGIC_64):
+        count = struct.unpack_from(">I", data, 4)[0]
+        slices = []
+        for i in range(count):
+            if magic == FAT_MAGIC:
+                cputype, cpusubtype, offset, size, align = struct.unpack_from(">iiIII", data, 8 + 20 * i)
+            else:
+                cputype, cpusubtype, offset, size, align, _ = struct.unpack_from(">iiQQII", data, 8 + 32 * i)
+            slices.append((offset, size, cputype, cpusubtype, align))
+        return magic, slices
+    header = _parse_header(data)
+    return None, [(0, len(data), header["cputype"], header["cpusubtype"], 14)]
+
+def is_macho(path):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(8)
+    except OSError:
+        return False
+    if len(head) < 8:
+        return False
+    if struct.unpack_from("<I", head)[0] in (MH_MAGIC, MH_MAGIC_64):
+        return True
+    # Java class 也使用 0xcafebabe，以 slice 數量區分
+    magic, count = struct.unpack_from(">II", head)
+    return magic in (FAT_MAGIC, FAT_MAGIC_64) and 0 < count < 20
+
+def _parse_header(data):
+    magic = struct.unpack_from("<I", data, 0)[0]
+    if magic not in (MH_MAGIC, MH_MAGIC_64):
+        raise ValueError("❌ 不是 little-endian 的 Mach-O 檔案")
+    is_64 = magic == MH_MAGIC_64
+    _, cputype, cpusubtype, filetype, ncmds, sizeofcmds, flags = struct.unpack_from("<Iiiiiii", data, 0)
+    header = {
+        "is_64": is_64,
+        "header_size": 32 if is_64 else 28,
+        "cputype": cputype,
+        "cpusubtype": cpusubtype,
+        "filetype": filetype,
+        "ncmds": ncmds,
+        "sizeofcmds": sizeofcmds,
+        "segments": {},
+        "first_section_offset": None,
+        "code_signature": None,
+    }
+    offset = header["header_size"]
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from("<II", data, offset)
+        if cmd in (LC_SEGMENT, LC_SEGMENT_64):
+            if cmd == LC_SEGMENT_64:
+                name, vmaddr, vmsize, fileoff, filesize, _, _, nsects, _ = struct.unpack_from("<16sQQQQiiII", data, offset + 8)
+                section_start, section_size, offset_field = offset + 72, 80, 48
+            else:
+                name, vmaddr, vmsize, fileoff, filesize, _, _, nsects, _ = struct.unpack_from("<16sIIIIiiII", data, offset + 8)
+                section_start, section_size, offset_field = offset + 56, 68, 40
+            name = name.rstrip(b"\x00").decode("ascii", errors="replace")
+            header["segments"][name] = {
+                "command_offset": offset, "is_64": cmd == LC_SEGMENT_64,
+                "vmaddr": vmaddr, "vmsize": vmsize, "fileoff": fileoff, "filesize": filesize,
+            }
+            for i in range(nsects):
+                section_offset = struct.unpack_from("<I", data, section_start + i * section_size + offset_field)[0]
+                if section_offset and (header["first_section_offset"] is None
+                                       or section_offset < header["first_section_offset"]):
+                    header["first_section_offset"] = section_offset
+        elif cmd == LC_CODE_SIGNATURE:
+            dataoff, datasize = struct.unpack_from("<II", data, offset + 8)
+            header["code_signature"] = {"command_offset": offset, "dataoff": dataoff, "datasize": datasize}
+        offset += cmdsize
+    return header
+
+def _set_linkedit_size(data, segment, filesize, page_size):
+    offset = segment["command_offset"]
+    vmsize = _align(filesize, page_size)
+    if segment["is_64"]:
+        struct.pack_into("<QQ", data, offset + 32, vmsize, segment["fileoff"])
+        struct.pack_into("<Q", data, offset + 48, filesize)
+    else:
+        struct.pack_into("<II", data, offset + 28, vmsize, segment["fileoff"])
+        struct.pack_into("<I", data, offset + 36, filesize)
+
+def sign_slice(data, identity, identifier, special_hashes, requirements, entitlements=None, flags=0):
+    """ ✍️ 簽名一個 thin Mach-O，回傳 (簽名後的內容, CodeDirectory)
+
+    已有簽名時從原簽名的位置截斷並覆寫；沒有時新增 LC_CODE_SIGNATURE（header 後需有 16 位元組空間）。
+    簽名大小先依憑證鏈預留，寫好 header 後才計算每頁雜湊。
+    """
+    header = _parse_header(data)
+    linkedit = header["segments"].get("__LINKEDIT")
+    if linkedit is None:
+        raise ValueError("❌ Mach-O 沒有 __LINKEDIT segment，無法加入簽名")
+    data = bytearray(data)
+    signature = header["code_signature"]
+    if signature:
+        code_limit = signature["dataoff"]
+        command_offset = signature["command_offset"]
+    else:
+        linkedit_end = linkedit["fileoff"] + linkedit["filesize"]
+        if linkedit_end != len(data):
+            raise ValueError("❌ __LINKEDIT 不在檔案結尾，無法加入簽名")
+        commands_end = header["header_size"] + header["sizeofcmds"]
+        if header["first_section_offset"] is not None and commands_end + 16 > header["first_section_offset"]:
+            raise ValueError("❌ Mach-O header 後沒有空間加入 LC_CODE_SIGNATURE")
+        command_offset = commands_end
+        struct.pack_into("<II", data, 16, header["ncmds"] + 1, header["sizeofcmds"] + 16)
+        code_limit = _align(len(data), 16)
+
+    team_id = identity.team_id
+    blobs = [(CSSLOT_REQUIREMENTS, requirements)]
+    special_hashes = dict(special_hashes)
+    special_hashes[CSSLOT_REQUIREMENTS] = hashlib.sha256(requirements).digest()
+    exec_flags = 0
+    if entitlements is not None:
+        xml_blob = _blob(CSMAGIC_EMBEDDED_ENTITLEMENTS, plistlib.dumps(entitlements, fmt=plistlib.FMT_XML))
+        der_blob = _blob(CSMAGIC_EMBEDDED_DER_ENTITLEMENTS, der_entitlements(entitlements))
+        blobs += [(CSSLOT_ENTITLEMENTS, xml_blob), (CSSLOT_DER_ENTITLEMENTS, der_blob)]
+        special_hashes[CSSLOT_ENTITLEMENTS] = hashlib.sha256(xml_blob).digest()
+        special_hashes[CSSLOT_DER_ENTITLEMENTS] = hashlib.sha256(der_blob).digest()
+        if entitlements.get("get-task-allow"):
+            exec_flags |= CS_EXECSEG_ALLOW_UNSIGNED
+    if header["filetype"] == MH_EXECUTE:
+        exec_flags |= CS_EXECSEG_MAIN_BINARY
+
+    n_special = max(special_hashes)
+    reserve = 12 + 8 * (len(blobs) + 2) + code_directory_size(code_limit, identifier, team_id, n_special) \
+        + sum(len(blob) for _, blob in blobs) + 8 + cms_reserve(identity)
+    reserve = _align(reserve, 16)
+
+    # 先寫好 header（LC_CODE_SIGNATURE 與 __LINKEDIT 大小），再計算雜湊
+    del data[code_limit:]
+    data.extend(b"\x00" * (code_limit - len(data)))
+    struct.pack_into("<IIII", data, command_offset, LC_CODE_SIGNATURE, 16, code_limit, reserve)
+    page_size = 0x4000 if header["cputype"] == CPU_TYPE_ARM64 else 0x1000
+    _set_linkedit_size(data, linkedit, code_limit + reserve - linkedit["fileoff"], page_size)
+
+    text = header["segments"].get("__TEXT", {"fileoff": 0, "filesize": 0})
+    cd = code_directory(data, code_limit, identifier, team_id, special_hashes, flags,
+                        (text["fileoff"], text["filesize"], exec_flags))
+    cms = _blob(CSMAGIC_BLOBWRAPPER, cms_signature(cd, identity))
+    blob = _super_blob(CSMAGIC_EMBEDDED_SIGNATURE, [(CSSLOT_CODEDIRECTORY, cd)] + blobs + [(CSSLOT_SIGNATURESLOT, cms)])
+    if len(blob) > reserve:
+        raise ValueError(f"❌ 簽名大小 {len(blob)} 超過預留的 {reserve} 位元組")
+    data.extend(blob + b"\x00" * (reserve - len(blob)))
+    return bytes(data), cd
+
+def sign_macho(path, identity, identifier, special_hashes=None, entitlements=None, flags=0):
+    """ ✍️ 就地簽名 Mach-O 或 fat binary（每個 slice 各自簽名），回傳第一個 slice 的 cdhash """
+    with open(path, "rb") as f:
+        data = f.read()
+    requirements = requirements_blob(identifier, identity.common_name)
+    magic, slices = _slices(data)
+    signed, cds = [], []
+    for offset, size, cputype, cpusubtype, align in slices:
+        content, cd = sign_slice(data[offset:offset + size], identity, identifier, special_hashes or {},
+                                 requirements, entitlements, flags)
+        signed.append((content, cputype, cpusubtype, align))
+        cds.append(cd)
+    if magic is None:
+        output = signed[0][0]
+    else:
+        output = _build_fat(magic, signed)
+    temp_path = f"{path}.signing"
+    with open(temp_path, "wb") as f:
+        f.write(output)
+    os.chmod(temp_path, os.stat(path).st_mode)
+    os.replace(temp_path, path)
+    return cdhash(cds[0])
+
+def _build_fat(magic, slices):
+    """ 依原本的 align 重新排列各 slice，組回 fat binary """
+    entry_size = 20 if magic == FAT_MAGIC else 32
+    header = struct.pack(">II", magic, len(slices))
+    body = bytearray()
+    offset = 8 + entry_size * len(slices)
+    for content, cputype, cpusubtype, align in slices:
+        start = _align(offset, 1 << align)
+        body.extend(b"\x00" * (start - offset))
+        body.extend(content)
+        if magic == FAT_MAGIC:
+            header += struct.pack(">iiIII", cputype, cpusubtype, start, len(content), align)
+        else:
+            header += struct.pack(">iiQQII", cputype, cpusubtype, start, len(content), align, 0)
+        offset = start + len(content)
+    return header + bytes(body)
+
+
+# 📂 Bundle 與 CodeResources
+def _rule_for(path, rules):
+    """ 權重最高的符合規則（與 codesign 相同），沒有符合時回傳 None """
+    best = None
+    for pattern, rule in rules.items():
+        if re.search(pattern, path):
+            weight = rule.get("weight", 1.0) if isinstance(rule, dict) else 1.0
+            if best is None or weight > best[0]:
+                best = (weight, rule)
+    return best[1] if best else None
+
+def _resource_entry(rule, value):
+    if rule is None or (isinstance(rule, dict) and rule.get("omit")):
+        return None
+    if isinstance(rule, dict) and rule.get("optional"):
+        value = dict(value) if isinstance(value, dict) else {"hash": value}
+        value["optional"] = True
+    return value
+
+def _file_hashes(path):
+    sha1, sha256 = hashlib.sha1(), hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+            sha256.update(chunk)
+    return sha1.digest(), sha256.digest()
+
+def read_info_plist(bundle_dir):
+    info_path = os.path.join(bundle_dir, "Info.plist")
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path, "rb") as f:
+        return plistlib.load(f)
+
+def bundle_executable(bundle_dir):
+    """ 回傳 (Info.plist 內容, 主執行檔路徑或 None)；assetpack 等沒有執行檔的 bundle 回傳 None """
+    info = read_info_plist(bundle_dir)
+    name = info.get("CFBundleExecutable")
+    path = os.path.join(bundle_dir, name) if name else None
+    return info, path if path and os.path.isfile(path) else None
+
+def code_identifier(path):
+    """ bundle 使用 CFBundleIdentifier，單獨的 dylib 使用去掉副檔名的檔名 """
+    if os.path.isdir(path):
+        identifier = read_info_plist(path).get("CFBundleIdentifier")
+        if identifier:
+            return identifier
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _nested_entry(path, common_name):
+    """ 嵌套程式碼在 CodeResources 中記錄 cdhash 與 designated requirement（需已先簽名） """
+    executable = bundle_executable(path)[1] if os.path.isdir(path) else path
+    if executable is None:
+        return None
+    slices = read_signature(executable)
+    if not slices:
+        raise ValueError(f"❌ 嵌套的程式碼尚未簽名: {path}")
+    return {
+        "cdhash": cdhash(slices[0]["cd"]),
+        "requirement": designated_requirement_text(code_identifier(path), common_name),
+    }
+
+def code_resources(bundle_dir, executable, common_name):
+    """ 🧾 建立 `_CodeSignature/CodeResources`（files 為 SHA-1，files2 為 SHA-1 + SHA-256） """
+    files, files2 = {}, {}
+    for root, dirs, names in os.walk(bundle_dir):
+        rel_root = os.path.relpath(root, bundle_dir)
+        for name in sorted(dirs):
+            full_path = os.path.join(root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, "/")
+            if rel_path == "_CodeSignature":
+                dirs.remove(name)
+            elif os.path.islink(full_path):
+                dirs.remove(name)
+                names.append(name)
+            elif name.endswith(NESTED_BUNDLE_SUFFIXES):
+                dirs.remove(name)
+                entry = _nested_entry(full_path, common_name)
+                if entry:
+                    files2[rel_path] = entry
+        for name in names:
+            full_path = os.path.join(root, name)
+            rel_path = os.path.normpath(os.path.join(rel_root, name)).replace(os.sep, "/")
+            if executable and os.path.abspath(full_path) == os.path.abspath(executable):
+                continue
+            if os.path.islink(full_path):
+                entry = _resource_entry(_rule_for(rel_path, RESOURCE_RULES2), {"symlink": os.readlink(full_path)})
+                if entry:
+                    files2[rel_path] = entry
+                continue
+            if name.endswith(".dylib") and is_macho(full_path):
+                files2[rel_path] = _nested_entry(full_path, common_name)
+                continue
+            sha1, sha256 = _file_hashes(full_path)
+            entry = _resource_entry(_rule_for(rel_path, RESOURCE_RULES), sha1)
+            if entry is not None:
+                files[rel_path] = entry
+            entry = _resource_entry(_rule_for(rel_path, RESOURCE_RULES2), {"hash": sha1, "hash2": sha256})
+            if entry is not None:
+                files2[rel_path] = entry
+    return plistlib.dumps({"files": files, "files2": files2, "rules": RESOURCE_RULES, "rules2": RESOURCE_RULES2},
+                          fmt=plistlib.FMT_XML)
+
+def sign_bundle(path, identity, entitlements=None, runtime=False):
+    """ ✍️ 簽名 .app / .appex / .framework / assetpack 或單獨的 dylib，回傳 cdhash
+
+    嵌套的程式碼必須先簽名（CodeResources 會記錄它們的 cdhash）；沒有執行檔的 bundle
+    （例如 OnDemandResources 的 assetpack）把簽名寫在 `_CodeSignature` 內的獨立檔案。
+    """
+    flags = CS_RUNTIME if runtime else 0
+    if os.path.isfile(path):
+        return sign_macho(path, identity, code_identifier(path), entitlements=entitlements, flags=flags)
+
+    info, executable = bundle_executable(path)
+    identifier = code_identifier(path)
+    signature_dir = os.path.join(path, "_CodeSignature")
+    os.makedirs(signature_dir, exist_ok=True)
+    resources = code_resources(path, executable, identity.common_name)
+    with open(os.path.join(signature_dir, "CodeResources"), "wb") as f:
+        f.write(resources)
+    special_hashes = {CSSLOT_RESOURCEDIR: hashlib.sha256(resources).digest()}
+    info_path = os.path.join(path, "Info.plist")
+    if os.path.exists(info_path):
+        with open(info_path, "rb") as f:
+            special_hashes[CSSLOT_INFOSLOT] = hashlib.sha256(f.read()).digest()
+    if executable:
+        return sign_macho(executable, identity, identifier, special_hashes, entitlements, flags)
+
+    requirements = requirements_blob(identifier, identity.common_name)
+    special_hashes[CSSLOT_REQUIREMENTS] = hashlib.sha256(requirements).digest()
+    cd = code_directory(b"", 0, identifier, identity.team_id, special_hashes, flags)
+    detached = {
+        "CodeDirectory": cd,
+        "CodeRequirements": requirements,
+        "CodeSignature": _blob(CSMAGIC_BLOBWRAPPER, cms_signature(cd, identity)),
+    }
+    for name, content in detached.items():
+        with open(os.path.join(signature_dir, name), "wb") as f:
+            f.write(content)
+    return cdhash(cd)
+
+
+# 🔍 讀取與驗證簽名
+def read_signature(path):
+    """ 讀取 Mach-O 每個 slice 的簽名，回傳 [{cputype, code, code_limit, cd, blobs}]；未簽名的 slice 不列出 """
+    with open(path, "rb") as f:
+        data = f.read()
+    _, slices = _slices(data)
+    result = []
+    for offset, size, cputype, _, _ in slices:
+        content = data[offset:offset + size]
+        signature = _parse_header(content)["code_signature"]
+        if not signature:
+            continue
+        blob = content[signature["dataoff"]:signature["dataoff"] + signature["datasize"]]
+        _, blobs = _parse_super_blob(blob)
+        result.append({
+            "cputype": cputype,
+            "code": content,
+            "code_limit": signature["dataoff"],
+            "cd": blobs.get(CSSLOT_CODEDIRECTORY),
+            "blobs": blobs,
+        })
+    return result
+
+def parse_code_directory(cd):
+    (_, _, version, flags, hash_offset, ident_offset, n_special, n_code, code_limit,
+     hash_size, hash_type, _, page_size, _) = struct.unpack_from(">IIIIIIIIIBBBBI", cd, 0)
+    team_offset = struct.unpack_from(">I", cd, 48)[0] if version >= 0x20200 else 0
+    exec_seg = struct.unpack_from(">QQQ", cd, 64) if version >= 0x20400 else (0, 0, 0)
+    if version >= 0x20300:
+        code_limit = struct.unpack_from(">Q", cd, 56)[0] or code_limit
+
+    def string_at(offset):
+        return cd[offset:cd.index(b"\x00", offset)].decode("utf-8") if offset else None
+
+    return {
+        "version": version,
+        "flags": flags,
+        "identifier": string_at(ident_offset),
+        "team_id": string_at(team_offset),
+        "hash_type": hash_type,
+        "hash_size": hash_size,
+        "page_size": 1 << page_size if page_size else 0,
+        "code_limit": code_limit,
+        "exec_seg_flags": exec_seg[2],
+        "special_hashes": {
+            slot: cd[hash_offset - slot * hash_size:hash_offset - (slot - 1) * hash_size]
+            for slot in range(1, n_special + 1)
+        },
+        "code_hashes": [cd[hash_offset + i * hash_size:hash_offset + (i + 1) * hash_size] for i in range(n_code)],
+    }
+
+def _hash_function(hash_type):
+    return {1: hashlib.sha1, 2: hashlib.sha256}.get(hash_type)
+
+def _cms_problems(cms, cd):
+    """ 檢查 CMS 的 messageDigest 與簽章（不檢查憑證信任鏈）；codesign 產生的 BER 不定長度編碼也能解析 """
+    data = cms[8:]  # 去掉 BlobWrapper 的 header
+    element, children = mobileprovision._element, mobileprovision._children
+    try:
+        _, start, end, _ = element(data, 0)
+        content = children(data, start, end)
+        signed_data = children(data, content[1][1], content[1][2])[0]
+        # SignedData ::= SEQUENCE { version, digestAlgorithms, encapContentInfo, [0] certificates, ..., signerInfos }
+        fields = children(data, signed_data[1], signed_data[2])
+        certificates = []
+        for tag, field_start, field_end, _ in fields:
+            if tag != 0xA0:
+                continue
+            position = field_start
+            for child in children(data, field_start, field_end):
+                certificates.append(x509.load_der_x509_certificate(data[position:child[3]]))
+                position = child[3]
+        signer_info = children(data, fields[-1][1], fields[-1][2])[0]
+        signer_fields = children(data, signer_info[1], signer_info[2])
+        index = next(i for i, field in enumerate(signer_fields) if field[0] == 0xA0)
+        attributes = signer_fields[index]
+        # 簽章的對象是把 [0] IMPLICIT 換回 SET tag 的 signedAttrs
+        signed_attributes = b"\x31" + data[signer_fields[index - 1][3] + 1:attributes[3]]
+        signature = data[signer_fields[-1][1]:signer_fields[-1][2]]
+        digest = None
+        for attribute in children(data, attributes[1], attributes[2]):
+            oid, values = children(data, attribute[1], attribute[2])[:2]
+            if data[oid[1]:oid[2]] == _oid_bytes(OID_MESSAGE_DIGEST):
+                value = children(data, values[1], values[2])[0]
+                digest = data[value[1]:value[2]]
+    except (IndexError, ValueError, StopIteration) as e:
+        return [f"無法解析 CMS 簽章: {e}"]
+
+    problems = []
+    if digest not in (hashlib.sha256(cd).digest(), hashlib.sha1(cd).digest()):
+        problems.append("CMS 的 messageDigest 與 CodeDirectory 不符")
+    hash_algorithm = hashes.SHA256() if digest and len(digest) == 32 else hashes.SHA1()
+    for certificate in certificates:
+        public_key = certificate.public_key()
+        try:
+            if isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(signature, signed_attributes, padding.PKCS1v15(), hash_algorithm)
+            elif isinstance(public_key, ec.EllipticCurvePublicKey):
+                public_key.verify(signature, signed_attributes, ec.ECDSA(hash_algorithm))
+            else:
+                continue
+            return problems
+        except InvalidSignature:
+            continue
+    problems.append("CMS 簽章無法以附帶的任何憑證驗證")
+    return problems
+
+def _slice_problems(signature):
+    cd = signature["cd"]
+    if cd is None:
+        return ["缺少 CodeDirectory"]
+    directory = parse_code_directory(cd)
+    hash_function = _hash_function(directory["hash_type"])
+    if hash_function is None:
+        return [f"不支援的雜湊類型 {directory['hash_type']}"]
+    problems = []
+    code, code_limit, page_size = signature["code"], directory["code_limit"], directory["page_size"] or PAGE_SIZE
+    if code_limit != signature["code_limit"]:
+        problems.append("codeLimit 與簽名位置不符")
+    view = memoryview(code)
+    expected = [hash_function(view[offset:min(offset + page_size, code_limit)]).digest()
+                for offset in range(0, code_limit, page_size)]
+    bad_pages = sum(1 for a, b in zip(expected, directory["code_hashes"]) if a != b)
+    if bad_pages or len(expected) != len(directory["code_hashes"]):
+        problems.append(f"{bad_pages} 個頁面雜湊不符（共 {len(expected)} 頁）")
+    for slot in (CSSLOT_REQUIREMENTS, CSSLOT_ENTITLEMENTS, CSSLOT_DER_ENTITLEMENTS):
+        blob = signature["blobs"].get(slot)
+        recorded = directory["special_hashes"].get(slot)
+        if blob is not None and recorded != hash_function(blob).digest():
+            problems.append(f"特殊 slot -{slot} 的雜湊不符")
+    cms = signature["blobs"].get(CSSLOT_SIGNATURESLOT)
+    if cms is None or len(cms) <= 8:
+        problems.append("沒有 CMS 簽章（ad-hoc）")
+    else:
+        problems.extend(_cms_problems(cms, cd))
+    return problems
+
+def _bundle_problems(bundle_dir, directory, hash_function):
+    problems = []
+    info_path = os.path.join(bundle_dir, "Info.plist")
+    resources_path = os.path.join(bundle_dir, "_CodeSignature", "CodeResources")
+    for slot, path in ((CSSLOT_INFOSLOT, info_path), (CSSLOT_RESOURCEDIR, resources_path)):
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            if directory["special_hashes"].get(slot) != hash_function(f.read()).digest():
+                problems.append(f"{os.path.basename(path)} 與特殊 slot -{slot} 不符")
+    if not os.path.exists(resources_path):
+        return problems + ["缺少 _CodeSignature/CodeResources"]
+    with open(resources_path, "rb") as f:
+        files2 = plistlib.load(f).get("files2", {})
+    for rel_path, entry in files2.items():
+        full_path = os.path.join(bundle_dir, rel_path)
+        if "cdhash" in entry:
+            executable = bundle_executable(full_path)[1] if os.path.isdir(full_path) else full_path
+            slices = read_signature(executable) if executable and os.path.exists(executable) else []
+            if not slices or cdhash(slices[0]["cd"]) != entry["cdhash"]:
+                problems.append(f"嵌套程式碼的 cdhash 不符: {rel_path}")
+        elif "symlink" in entry:
+            if not os.path.islink(full_path) or os.readlink(full_path) != entry["symlink"]:
+                problems.append(f"符號連結不符: {rel_path}")
+        elif not os.path.exists(full_path):
+            if not entry.get("optional"):
+                problems.append(f"資源檔遺失: {rel_path}")
+        elif "hash2" in entry and _file_hashes(full_path)[1] != entry["hash2"]:
+            problems.append(f"資源檔已被修改: {rel_path}")
+    return problems
+
+def verify(path):
+    """ ✅ 驗證簽名：頁面雜湊、特殊 slot、CodeResources 與 CMS 簽章，回傳問題列表（空列表代表通過）
+
+    只檢查簽名本身是否一致，不檢查憑證信任鏈與描述檔；codesign 與本模組產生的簽名都能驗證。
+    """
+    executable = bundle_executable(path)[1] if os.path.isdir(path) else path
+    if executable is None:
+        return ["找不到主執行檔（沒有執行檔的 bundle 請直接檢查 _CodeSignature）"]
+    slices = read_signature(executable)
+    if not slices:
+        return ["沒有簽名"]
+    problems = []
+    for signature in slices:
+        problems.extend(f"[cpu 0x{signature['cputype']:x}] {problem}" for problem in _slice_problems(signature))
+    if os.path.isdir(path):
+        directory = parse_code_directory(slices[0]["cd"])
+        problems.extend(_bundle_problems(path, directory, _hash_function(directory["hash_type"]) or hashlib.sha256))
+    return problems
+
+def describe(path):
+    """ 🔍 簽名摘要（每個 slice 一筆），用於比對兩種簽名方式的產物 """
+    executable = bundle_executable(path)[1] if os.path.isdir(path) else path
+    slices = read_signature(executable) if executable else []
+    summary = []
+    for signature in slices:
+        directory = parse_code_directory(signature["cd"])
+        entitlements = signature["blobs"].get(CSSLOT_ENTITLEMENTS)
+        summary.append({
+            "cputype": signature["cputype"],
+            "identifier": directory["identifier"],
+            "team_id": directory["team_id"],
+            "flags": directory["flags"],
+            "hash_type": directory["hash_type"],
+            "code_limit": directory["code_limit"],
+            "pages": len(directory["code_hashes"]),
+            "special_slots": sorted(slot for slot, value in directory["special_hashes"].items() if any(value)),
+            "exec_seg_flags": directory["exec_seg_flags"],
+            "cdhash": cdhash(signature["cd"]).hex(),
+            "entitlements": plistlib.loads(entitlements[8:]) if entitlements else None,
+            "der_entitlements": CSSLOT_DER_ENTITLEMENTS in signature["blobs"],
+        })
+    return summary
+
+# 比對兩份簽名時，這些欄位應該一致（cdhash 與雜湊會因簽名時間、資源內容而不同）
+COMPARE_FIELDS = ("identifier", "team_id", "flags", "hash_type", "code_limit", "pages", "special_slots",
+                  "exec_seg_flags", "entitlements", "der_entitlements")
+
+def compare(path, other_path):
+    """ 🔍 比對兩份簽名（例如 codesign 與本模組的產物），回傳不一致的欄位 [(欄位, 值, 另一個值)] """
+    a, b = describe(path), describe(other_path)
+    if len(a) != len(b):
+        return [("slices", len(a), len(b))]
+    differences = []
+    for first, second in zip(a, b):
+        for field in COMPARE_FIELDS:
+            if first[field] != second[field]:
+                differences.append((field, first[field], second[field]))
+    return differences
+
+def inspect(path, compare_path=None):
+    """ 🔍 列印簽名摘要與驗證結果；指定 compare_path 時一併比對 """
+    for item in describe(path):
+        print(f"🔏 {item['identifier']} (Team: {item['team_id'] or 'N/A'}, cpu 0x{item['cputype']:x})")
+        print(f"   cdhash: {item['cdhash']}，flags: 0x{item['flags']:x}，頁數: {item['pages']}，"
+              f"特殊 slot: {item['special_slots']}")
+        print(f"   Entitlements: {', '.join(sorted(item['entitlements'] or {})) or 'N/A'}")
+    problems = verify(path)
+    print("✅ 簽名驗證通過" if not problems else "❌ 簽名驗證失敗:\n   " + "\n   ".join(problems))
+    if compare_path:
+        differences = compare(path, compare_path)
+        if not differences:
+            print(f"✅ 與 {compare_path} 的簽名結構一致")
+        for field, value, other in differences:
+            print(f"⚠️ {field} 不同: {value!r} != {other!r}")
+    return problems
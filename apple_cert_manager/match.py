@@ -3,6 +3,7 @@ from . import certificate
 from . import profile
 from . import local_file
 from apple_cert_manager.config import config
+from .logging_config import log_context
 import logging
 import os
 
@@ -10,6 +11,10 @@ logging = logging.getLogger(__name__)
 
 def match_apple_account(apple_id):
     """ 設定這個apple帳號的憑證與profile """
+    with log_context(apple_id=apple_id):
+        _match_apple_account(apple_id)
+
+def _match_apple_account(apple_id):
     account = apple_accounts.get_account_by_apple_id(apple_id)
     logging.info(f"🔍 開始設定 Apple ID: {apple_id} 憑證與profile")
     try:
@@ -0,0 +1,497 @@
+import json
+import math
+import re
+import time
+import threading
+import contextlib
+import contextvars
+from collections import deque
+from urllib.parse import urlsplit
+from .logging_config import apple_id_var, job_id_var
+
+# 最多保留的 span 數量（常駐模式下避免無限成長）
+MAX_SPANS = 50000
+
+# 📌 目前執行中的 span（各執行緒 / 協程獨立），讓底層的子程序與 I/O 可以把成本記到所屬階段
+_current_span = contextvars.ContextVar("current_span", default=None)
+# 📌 目前 context 所屬的執行範圍（collect），span 結束時除了全域 recorder 也會記到這些 recorder
+_scoped_recorders = contextvars.ContextVar("scoped_recorders", default=())
+
+
+class Span:
+    """ 一個階段的計時紀錄：耗時、子程序耗時、讀寫位元組 """
+
+    __slots__ = ("name", "labels", "start", "duration", "subprocess_seconds",
+                 "subprocess_calls", "bytes_read", "bytes_written", "error")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = time.time()
+        self.duration = None
+        self.subprocess_seconds = 0.0
+        self.subprocess_calls = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.error = None
+
+    def add_io(self, read=0, written=0):
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def add_subprocess(self, seconds):
+        self.subprocess_seconds += seconds
+        self.subprocess_calls += 1
+
+    def to_dict(self):
+        return {
+            "span": self.name,
+            "start": round(self.start, 6),
+            "duration": round(self.duration or 0, 6),
+            "subprocess_seconds": round(self.subprocess_seconds, 6),
+            "subprocess_calls": self.subprocess_calls,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "error": self.error,
+            **self.labels,
+        }
+
+
+class SpanRecorder:
+    """ 📊 收集所有已結束的 span，提供彙總與匯出（JSON lines / Prometheus 文字格式） """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=MAX_SPANS)
+        self._listeners = []
+
+    def record(self, span):
+        with self._lock:
+            self._spans.append(span)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(span)
+
+    def add_listener(self, listener):
+        """ 註冊 span 結束時的回呼（例如 benchmark 量測磁碟用量） """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def summary(self):
+        """ 依階段名稱彙總，保留第一次出現的順序 """
+        stages = {}
+        for span in self.spans():
+            stage = stages.setdefault(span.name, {
+                "count": 0, "total": 0.0, "max": 0.0, "subprocess_seconds": 0.0,
+                "subprocess_calls": 0, "bytes_read": 0, "bytes_written": 0, "errors": 0,
+            })
+            stage["count"] += 1
+            stage["total"] += span.duration
+            stage["max"] = max(stage["max"], span.duration)
+            stage["subprocess_seconds"] += span.subprocess_seconds
+            stage["subprocess_calls"] += span.subprocess_calls
+            stage["bytes_read"] += span.bytes_read
+            stage["bytes_written"] += span.bytes_written
+            stage["errors"] += 1 if span.error else 0
+        return stages
+
+    def format_summary(self, title="各階段耗時"):
+        """ 產生人類可讀的彙總表 """
+        stages = self.summary()
+        if not stages:
+            return f"{title}: 無資料"
+        grand_total = sum(stage["total"] for stage in stages.values()) or 1
+        lines = [
+            f"{title}:",
+            f"  {'階段':<22}{'次數':>6}{'總耗時(s)':>12}{'平均(s)':>10}{'最大(s)':>10}{'子程序(s)':>12}{'讀取':>11}{'寫入':>11}{'佔比':>7}",
+        ]
+        for name, stage in stages.items():
+            lines.append(
+                f"  {name:<22}{stage['count']:>6}{stage['total']:>12.3f}{stage['total'] / stage['count']:>10.3f}"
+                f"{stage['max']:>10.3f}{stage['subprocess_seconds']:>12.3f}{format_bytes(stage['bytes_read']):>11}"
+                f"{format_bytes(stage['bytes_written']):>11}{stage['total'] / grand_total:>7.1%}"
+            )
+        return "\n".join(lines)
+
+    def to_json_lines(self):
+        return "".join(json.dumps(span.to_dict(), ensure_ascii=False) + "\n" for span in self.spans())
+
+    def to_prometheus(self, prefix="acm_stage"):
+        stages = self.summary()
+        metric = f"{prefix}_duration_seconds"
+        lines = [f"# HELP {metric} 各階段耗時（秒）", f"# TYPE {metric} summary"]
+        for name, stage in stages.items():
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stage["total"]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {stage["count"]}')
+        metrics = [
+            ("duration_max_seconds", "max", "各階段單次最大耗時（秒）", "gauge"),
+            ("subprocess_seconds_total", "subprocess_seconds", "各階段子程序累計耗時（秒）", "counter"),
+            ("subprocess_calls_total", "subprocess_calls", "各階段子程序呼叫次數", "counter"),
+            ("read_bytes_total", "bytes_read", "各階段讀取位元組", "counter"),
+            ("written_bytes_total", "bytes_written", "各階段寫入位元組", "counter"),
+            ("errors_total", "errors", "各階段失敗次數", "counter"),
+        ]
+        for suffix, key, help_text, metric_type in metrics:
+            metric = f"{prefix}_{suffix}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for name, stage in stages.items():
+                lines.append(f'{metric}{{stage="{name}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """ 📈 固定記憶體的延遲直方圖：幾何級距（每格 ×1.1），百分位誤差約 5% 以內 """
+
+    GROWTH = 1.1
+    MIN_VALUE = 0.0005  # 0.5ms 以下都放在第一格
+    # Prometheus 匯出用的累積級距（秒）
+    EXPORT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        if value <= self.MIN_VALUE:
+            return 0
+        return int(math.log(value / self.MIN_VALUE, self.GROWTH)) + 1
+
+    def _upper_bound(self, index):
+        return self.MIN_VALUE * self.GROWTH ** index
+
+    def observe(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """ 回傳第 q 百分位（0~100）的近似值 """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def cumulative_buckets(self):
+        """ 以 EXPORT_BUCKETS 為上界的累積計數（近似） """
+        result = []
+        for bound in self.EXPORT_BUCKETS:
+            result.append((bound, sum(n for index, n in self.counts.items() if self._upper_bound(index) <= bound)))
+        return result
+
+
+_ID_SEGMENT = re.compile(r"^(?!v\d+$)(?=.*\d)[\w-]+$")
+
+def endpoint_template(method, url):
+    """ 把 URL 轉成端點樣板，例如 `DELETE /v1/profiles/{id}`（去掉 host 與 query，含數字的路徑段視為 ID） """
+    path = urlsplit(url).path
+    segments = ["{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return f"{method} {'/'.join(segments) or '/'}"
+
+
+class HttpMetrics:
+    """ 🌐 依端點樣板統計 HTTP 呼叫次數、狀態碼、重試次數、傳輸量與延遲 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, method, url, status, seconds, retries=0, bytes_sent=0, bytes_received=0):
+        template = endpoint_template(method, url)
+        with self._lock:
+            endpoint = self._endpoints.get(template)
+            if endpoint is None:
+                endpoint = self._endpoints[template] = {
+                    "calls": 0, "statuses": {}, "retries": 0,
+                    "bytes_sent": 0, "bytes_received": 0, "latency": Histogram(),
+                }
+            endpoint["calls"] += 1
+            endpoint["statuses"][str(status)] = endpoint["statuses"].get(str(status), 0) + 1
+            endpoint["retries"] += retries
+            endpoint["bytes_sent"] += bytes_sent
+            endpoint["bytes_received"] += bytes_received
+            endpoint["latency"].observe(seconds)
+
+    def increment(self, template, key, amount=1):
+        """ 累加端點的額外計數（例如合併掉的請求數） """
+        with self._lock:
+            endpoint = self._endpoints.get(template)
+            if endpoint is not None:
+                endpoint[key] = endpoint.get(key, 0) + amount
+
+    def total_calls(self):
+        with self._lock:
+            return sum(endpoint["calls"] for endpoint in self._endpoints.values())
+
+    def snapshot(self):
+        """ 取得可序列化的統計資料 """
+        with self._lock:
+            result = {}
+            for template, endpoint in self._endpoints.items():
+                latency = endpoint["latency"]
+                entry = {key: value for key, value in endpoint.items() if key != "latency"}
+                entry["statuses"] = dict(endpoint["statuses"])
+                entry["latency"] = {
+                    "avg": latency.sum / latency.count if latency.count else None,
+                    "p50": latency.percentile(50),
+                    "p95": latency.percentile(95),
+                    "p99": latency.percentile(99),
+                    "max": latency.max,
+                }
+                result[template] = entry
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def format_summary(self, title="API 呼叫統計"):
+        snapshot = self.snapshot()
+        if not snapshot:
+            return f"{title}: 無資料"
+        total = sum(entry["calls"] for entry in snapshot.values())
+        retries = sum(entry["retries"] for entry in snapshot.values())
+        coalesced = sum(entry.get("coalesced", 0) for entry in snapshot.values())
+        lines = [
+            f"{title}（共 {total} 次，重試 {retries} 次" + (f"，合併省下 {coalesced} 次" if coalesced else "") + "）:",
+            f"  {'端點':<42}{'次數':>6}{'重試':>6}{'p50(ms)':>9}{'p95(ms)':>9}{'p99(ms)':>9}{'下載':>10}  狀態碼",
+        ]
+        for template, entry in sorted(snapshot.items(), key=lambda kv: -kv[1]["calls"]):
+            latency = entry["latency"]
+            statuses = ", ".join(f"{status}×{count}" for status, count in sorted(entry["statuses"].items()))
+            lines.append(
+                f"  {template:<42}{entry['calls']:>6}{entry['retries']:>6}"
+                f"{latency['p50'] * 1000:>9.0f}{latency['p95'] * 1000:>9.0f}{latency['p99'] * 1000:>9.0f}"
+                f"{format_bytes(entry['bytes_received']):>10}  {statuses}"
+            )
+        return "\n".join(lines)
+
+    def to_json_lines(self):
+        return "".join(
+            json.dumps({"endpoint": template, **entry}, ensure_ascii=False) + "\n"
+            for template, entry in self.snapshot().items()
+        )
+
+    def to_prometheus(self, prefix="acm_http"):
+        with self._lock:
+            endpoints = {template: dict(endpoint) for template, endpoint in self._endpoints.items()}
+        lines = [f"# HELP {prefix}_requests_total HTTP 呼叫次數", f"# TYPE {prefix}_requests_total counter"]
+        for template, endpoint in endpoints.items():
+            for status, count in endpoint["statuses"].items():
+                lines.append(f'{prefix}_requests_total{{endpoint="{template}",status="{status}"}} {count}')
+        for key, help_text in (("retries", "urllib3 自動重試次數"), ("bytes_sent", "上傳位元組"), ("bytes_received", "下載位元組"),
+                               ("coalesced", "與同時進行的相同請求合併而省下的呼叫次數")):
+            metric = f"{prefix}_{key}_total"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for template, endpoint in endpoints.items():
+                lines.append(f'{metric}{{endpoint="{template}"}} {endpoint.get(key, 0)}')
+        metric = f"{prefix}_request_duration_seconds"
+        lines.append(f"# HELP {metric} HTTP 呼叫延遲（秒）")
+        lines.append(f"# TYPE {metric} histogram")
+        for template, endpoint in endpoints.items():
+            latency = endpoint["latency"]
+            for bound, count in latency.cumulative_buckets():
+                lines.append(f'{metric}_bucket{{endpoint="{template}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{endpoint="{template}",le="+Inf"}} {latency.count}')
+            lines.append(f'{metric}_sum{{endpoint="{template}"}} {latency.sum}')
+            lines.append(f'{metric}_count{{endpoint="{template}"}} {latency.count}')
+        return "\n".join(lines) + "\n"
+
+
+def command_template(command):
+    """ 把外部指令轉成統計用的名稱：工具名稱，`security` 再加上子指令（例如 `security import`） """
+    tool = command[0].rsplit("/", 1)[-1] if command else "?"
+    if tool == "security" and len(command) > 1:
+        return f"{tool} {command[1]}"
+    return tool
+
+
+class ToolMetrics:
+    """ 🛠 依指令統計外部工具的呼叫次數、結束狀態（含逾時）與延遲 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def record(self, command, status, seconds):
+        template = command_template(command)
+        with self._lock:
+            entry = self._commands.get(template)
+            if entry is None:
+                entry = self._commands[template] = {"calls": 0, "statuses": {}, "latency": Histogram()}
+            entry["calls"] += 1
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+            entry["latency"].observe(seconds)
+
+    def total_calls(self):
+        with self._lock:
+            return sum(entry["calls"] for entry in self._commands.values())
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for template, entry in self._commands.items():
+                latency = entry["latency"]
+                result[template] = {
+                    "calls": entry["calls"],
+                    "statuses": dict(entry["statuses"]),
+                    "latency": {
+                        "avg": latency.sum / latency.count if latency.count else None,
+                        "p50": latency.percentile(50),
+                        "p95": latency.percentile(95),
+                        "p99": latency.percentile(99),
+                        "max": latency.max,
+                    },
+                }
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._commands.clear()
+
+    def format_summary(self, title="外部工具呼叫統計"):
+        snapshot = self.snapshot()
+        if not snapshot:
+            return f"{title}: 無資料"
+        lines = [
+            f"{title}（共 {sum(entry['calls'] for entry in snapshot.values())} 次）:",
+            f"  {'指令':<28}{'次數':>6}{'p50(ms)':>9}{'p95(ms)':>9}{'max(ms)':>9}  結束狀態",
+        ]
+        for template, entry in sorted(snapshot.items(), key=lambda kv: -kv[1]["calls"]):
+            latency = entry["latency"]
+            statuses = ", ".join(f"{status}×{count}" for status, count in sorted(entry["statuses"].items()))
+            lines.append(
+                f"  {template:<28}{entry['calls']:>6}{latency['p50'] * 1000:>9.0f}"
+                f"{latency['p95'] * 1000:>9.0f}{latency['max'] * 1000:>9.0f}  {statuses}"
+            )
+        return "\n".join(lines)
+
+    def to_json_lines(self):
+        return "".join(
+            json.dumps({"command": template, **entry}, ensure_ascii=False) + "\n"
+            for template, entry in self.snapshot().items()
+        )
+
+    def to_prometheus(self, prefix="acm_tool"):
+        with self._lock:
+            commands = {template: dict(entry) for template, entry in self._commands.items()}
+        lines = [f"# HELP {prefix}_calls_total 外部工具呼叫次數", f"# TYPE {prefix}_calls_total counter"]
+        for template, entry in commands.items():
+            for status, count in entry["statuses"].items():
+                lines.append(f'{prefix}_calls_total{{command="{template}",status="{status}"}} {count}')
+        metric = f"{prefix}_duration_seconds"
+        lines.append(f"# HELP {metric} 外部工具執行時間（秒）")
+        lines.append(f"# TYPE {metric} histogram")
+        for template, entry in commands.items():
+            latency = entry["latency"]
+            for bound, count in latency.cumulative_buckets():
+                lines.append(f'{metric}_bucket{{command="{template}",le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{command="{template}",le="+Inf"}} {latency.count}')
+            lines.append(f'{metric}_sum{{command="{template}"}} {latency.sum}')
+            lines.append(f'{metric}_count{{command="{template}"}} {latency.count}')
+        return "\n".join(lines) + "\n"
+
+
+# 🚀 全域 recorder
+recorder = SpanRecorder()
+http_metrics = HttpMetrics()
+tool_metrics = ToolMetrics()
+
+
+def export(path):
+    """ 匯出各階段耗時、API 與外部工具呼叫統計：`.prom` 為 Prometheus 文字格式，其餘為 JSON lines """
+    if path.endswith(".prom"):
+        content = recorder.to_prometheus() + http_metrics.to_prometheus() + tool_metrics.to_prometheus()
+    else:
+        content = recorder.to_json_lines() + http_metrics.to_json_lines() + tool_metrics.to_json_lines()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """ ⏱ 計時一個階段；自動帶上目前日誌 context 的 apple_id / job_id """
+    apple_id = apple_id_var.get()
+    job_id = job_id_var.get()
+    if apple_id is not None:
+        labels.setdefault("apple_id", apple_id)
+    if job_id is not None:
+        labels.setdefault("job_id", job_id)
+    current = Span(name, labels)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        recorder.record(current)
+        for scoped in _scoped_recorders.get():
+            scoped.record(current)
+
+
+@contextlib.contextmanager
+def collect():
+    """ 📥 只收集這次執行的 span（例如一次批量重簽名），常駐模式下不會混入之前或同時進行的其他工作
+
+    範圍內建立的 span 與以 contextvars.copy_context() 交給其他執行緒的工作都會記到回傳的 recorder。
+    """
+    scoped = SpanRecorder()
+    token = _scoped_recorders.set(_scoped_recorders.get() + (scoped,))
+    try:
+        yield scoped
+    finally:
+        _scoped_recorders.reset(token)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def record_subprocess(seconds):
+    """ 把子程序耗時記到目前的 span（若有） """
+    current = _current_span.get()
+    if current is not None:
+        current.add_subprocess(seconds)
+
+
+def record_io(read=0, written=0):
+    """ 把讀寫位元組記到目前的 span（若有） """
+    current = _current_span.get()
+    if current is not None:
+        current.add_io(read, written)
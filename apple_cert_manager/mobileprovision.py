@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import plistlib
+import threading
+from datetime import datetime, timezone
+from xml.parsers.expat import ExpatError
+from . import artifact_store
+
+logging = logging.getLogger(__name__)
+
+# 📌 CMS (PKCS#7) 常數
+OID_SIGNED_DATA = bytes.fromhex("2a864886f70d010702")  # 1.2.840.113549.1.7.2
+OID_DATA = bytes.fromhex("2a864886f70d010701")  # 1.2.840.113549.1.7.1
+TAG_SEQUENCE = 0x30
+TAG_OID = 0x06
+TAG_OCTET_STRING = 0x04
+TAG_OCTET_STRING_CONSTRUCTED = 0x24
+TAG_CONTEXT_0 = 0xA0
+
+# ✅ 解析結果快取：檔案 SHA-256 -> 描述檔資訊（同一個描述檔不必重複解析）
+_profile_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _header(data, offset):
+    """ 讀取 BER 的 tag 與長度，回傳 (tag, 長度或 None（不定長度）, 內容起點) """
+    if offset + 2 > len(data):
+        raise ValueError("描述檔的 CMS 結構不完整")
+    tag = data[offset]
+    offset += 1
+    if tag & 0x1F == 0x1F:  # 多位元組 tag（描述檔用不到，只需正確跳過）
+        while data[offset] & 0x80:
+            offset += 1
+        offset += 1
+    length = data[offset]
+    offset += 1
+    if length == 0x80:
+        return tag, None, offset
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    return tag, length, offset
+
+def _element(data, offset):
+    """ 回傳 (tag, 內容起點, 內容終點, 下一個元素的位置)，支援不定長度編碼 """
+    tag, length, start = _header(data, offset)
+    if length is None:
+        position = start
+        while data[position:position + 2] != b"\x00\x00":
+            position = _element(data, position)[3]
+        return tag, start, position, position + 2
+    end = start + length
+    if end > len(data):
+        raise ValueError("描述檔的 CMS 結構長度超出檔案範圍")
+    return tag, start, end, end
+
+def _children(data, start, end):
+    children = []
+    position = start
+    while position < end and data[position:position + 2] != b"\x00\x00":
+        child = _element(data, position)
+        children.append(child)
+        position = child[3]
+    return children
+
+def _octets(data, element):
+    """ OCTET STRING 可能被切成多段（constructed），依序串接 """
+    tag, start, end, _ = element
+    if tag == TAG_OCTET_STRING:
+        return data[start:end]
+    if tag == TAG_OCTET_STRING_CONSTRUCTED:
+        return b"".join(_octets(data, child) for child in _children(data, start, end))
+    raise ValueError(f"描述檔內容不是 OCTET STRING（tag 0x{tag:02x}）")
+
+def extract_plist(data):
+    """ 🔓 從 CMS SignedData 取出內嵌的 plist（不驗證簽章，只用於讀取內容） """
+    tag, start, end, _ = _element(data, 0)
+    if tag != TAG_SEQUENCE:
+        raise ValueError("描述檔不是 CMS 格式")
+    content_info = _children(data, start, end)
+    if len(content_info) < 2 or content_info[0][0] != TAG_OID \
+            or data[content_info[0][1]:content_info[0][2]] != OID_SIGNED_DATA:
+        raise ValueError("描述檔不是 CMS SignedData")
+    signed_data = _children(data, content_info[1][1], content_info[1][2])
+    if not signed_data or signed_data[0][0] != TAG_SEQUENCE:
+        raise ValueError("描述檔的 SignedData 格式錯誤")
+    # SignedData ::= SEQUENCE { version, digestAlgorithms, encapContentInfo, ... }
+    fields = _children(data, signed_data[0][1], signed_data[0][2])
+    if len(fields) < 3:
+        raise ValueError("描述檔的 SignedData 缺少內容")
+    encap = _children(data, fields[2][1], fields[2][2])
+    if len(encap) < 2 or data[encap[0][1]:encap[0][2]] != OID_DATA or encap[1][0] != TAG_CONTEXT_0:
+        raise ValueError("描述檔沒有內嵌的 plist 內容")
+    content = _children(data, encap[1][1], encap[1][2])
+    if not content:
+        raise ValueError("描述檔沒有內嵌的 plist 內容")
+    return _octets(data, content[0])
+
+def _as_utc(value):
+    """ plist 的日期是不帶時區的 UTC 時間，統一轉成帶時區的 datetime """
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _summarize(plist, digest):
+    team_ids = plist.get("TeamIdentifier") or [None]
+    return {
+        "digest": digest,
+        "name": plist.get("Name"),
+        "uuid": plist.get("UUID"),
+        "team_id": team_ids[0],
+        "team_name": plist.get("TeamName"),
+        "app_id_name": plist.get("AppIDName"),
+        "entitlements": plist.get("Entitlements", {}),
+        "devices": plist.get("ProvisionedDevices", []),
+        "creation_date": _as_utc(plist.get("CreationDate")),
+        "expiration_date": _as_utc(plist.get("ExpirationDate")),
+        "certificate_sha1s": [hashlib.sha1(cert).hexdigest().upper() for cert in plist.get("DeveloperCertificates", [])],
+    }
+
+def load(path):
+    """ 📄 解析 .mobileprovision，回傳 Entitlements、裝置、到期日、Team 等資訊
+
+    結果以檔案 SHA-256 快取；回傳的 dict 由所有呼叫端共用，請勿修改。
+    """
+    digest = artifact_store.file_digest(path)
+    with _cache_lock:
+        if digest in _profile_cache:
+            return _profile_cache[digest]
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        plist = plistlib.loads(extract_plist(data))
+    except (IndexError, plistlib.InvalidFileException, ExpatError) as e:
+        raise ValueError(f"無法解析描述檔 {path}: {e}") from e
+    profile = _summarize(plist, digest)
+    with _cache_lock:
+        _profile_cache[digest] = profile
+    return profile
+
+def is_expired(profile, now=None):
+    expiration_date = profile.get("expiration_date")
+    return expiration_date is not None and expiration_date <= _as_utc(now or datetime.now(timezone.utc))
+
+def describe(path):
+    """ 🔍 列印描述檔摘要 """
+    profile = load(path)
+    expiration_date = profile["expiration_date"]
+    status = "❌ 已過期" if is_expired(profile) else "✅ 有效"
+    print(f"📄 {profile['name']} ({profile['uuid']})")
+    print(f"   Team: {profile['team_name']} ({profile['team_id']})，App ID: {profile['app_id_name']}")
+    print(f"   到期日: {expiration_date or 'N/A'} {status}")
+    print(f"   裝置: {len(profile['devices'])} 台，憑證: {', '.join(profile['certificate_sha1s']) or 'N/A'}")
+    print(f"   Entitlements: {', '.join(sorted(profile['entitlements'])) or 'N/A'}")
+    return profile
@@ -1,20 +1,21 @@
+import time
 import base64
 import logging
-import requests
+import contextvars
+import concurrent.futures
+from logging import DEBUG
 from datetime import datetime
 from . import apple_accounts
 from apple_cert_manager.http_client import http_client
 from apple_cert_manager.config import config
 from . import auth
+from .logging_config import log_context, new_job_id
 
 logging = logging.getLogger(__name__)
 
-# 集中 API URL
-API_BASE_URL = "https://api.appstoreconnect.apple.com/v1"
-
 def get_api_token(apple_id):
     """生成並驗證 API token"""
-    token = auth.generate_token(apple_id)
+    token = auth.get_token(apple_id)
     if not token:
         raise ValueError(f"無法生成 token，Apple ID: {apple_id}")
     return token
@@ -23,6 +24,12 @@ def get_headers(token):
     """生成標準 HTTP headers"""
     return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
+def profile_filename(cert_id, bundle_id=None):
+    """描述檔名稱：.env 的 BUNDLE_ID 沿用原本的名稱，其他 Bundle ID 各自一份"""
+    if not bundle_id or bundle_id == config.bundle_id:
+        return f"adhoc_{cert_id}.mobileprovision"
+    return f"adhoc_{cert_id}_{bundle_id}.mobileprovision"
+
 def get_profile_path(filename):
     """生成 Provisioning Profile 檔案路徑"""
     return f"{config.profile_dir_path}/{filename}"
@@ -36,10 +43,9 @@ def validate_api_response(data, func_name):
 def get_all_devices(token, return_ids_only=False):
     """獲取 Apple Developer 帳號下的所有裝置資料或 ID"""
     logging.info("正在獲取所有裝置列表...")
-    url = f"{API_BASE_URL}/devices"
+    url = f"{config.api_base_url}/devices"
     headers = get_headers(token)
-    response = http_client.get(url, headers=headers)
-    devices = validate_api_response(response.json(), "get_all_devices")
+    devices = validate_api_response(http_client.get_json(url, headers=headers), "get_all_devices")
     
     if not devices:
         raise ValueError("無可用裝置，請先在 Apple Developer 帳號中新增至少一台裝置")
@@ -53,10 +59,9 @@ def get_all_devices(token, return_ids_only=False):
 def find_existing_profile(token, file_name):
     """查找現有的 Provisioning Profile"""
     logging.info(f"正在查找描述檔：{file_name}...")
-    url = f"{API_BASE_URL}/profiles?filter[name]={file_name}"
+    url = f"{config.api_base_url}/profiles?filter[name]={file_name}"
     headers = get_headers(token)
-    response = http_client.get(url, headers=headers)
-    profiles = validate_api_response(response.json(), "find_existing_profile")
+    profiles = validate_api_response(http_client.get_json(url, headers=headers), "find_existing_profile")
     
     if profiles:
         profile_id = profiles[0]["id"]
@@ -69,19 +74,15 @@ def delete_existing_profile(token, profile_id):
     """刪除舊的 Provisioning Profile"""
     if profile_id:
         logging.info(f"正在刪除描述檔（ID: {profile_id}）...")
-        url = f"{API_BASE_URL}/profiles/{profile_id}"
+        url = f"{config.api_base_url}/profiles/{profile_id}"
         headers = get_headers(token)
         http_client.delete(url, headers=headers)
         logging.info(f"成功刪除描述檔（ID: {profile_id}）")
 
-def create_new_profile(token, cert_id, file_name, bundle_id, device_ids):
-    """創建新的 Ad Hoc Provisioning Profile"""
-    logging.info("正在建立新的 Ad Hoc 描述檔...")
-    logging.info(cert_id)
-    logging.info(file_name)
-    logging.info(bundle_id)
-    url = f"{API_BASE_URL}/profiles"
-    payload = {
+def build_profile_payload(cert_id, file_name, bundle_id, device_ids):
+    """組出建立 Ad Hoc Provisioning Profile 的請求內容"""
+    logging.debug("cert_id: %s, file_name: %s, bundle_id: %s, 裝置數: %d", cert_id, file_name, bundle_id, len(device_ids))
+    return {
         "data": {
             "type": "profiles",
             "attributes": {
@@ -95,6 +96,12 @@ def create_new_profile(token, cert_id, file_name, bundle_id, device_ids):
             }
         }
     }
+
+def submit_profile(token, payload):
+    """送出建立描述檔的請求，回傳 Base64 編碼的描述檔內容"""
+    logging.info("正在建立新的 Ad Hoc 描述檔...")
+    file_name = payload["data"]["attributes"]["name"]
+    url = f"{config.api_base_url}/profiles"
     headers = get_headers(token)
     response = http_client.post(url, headers=headers, json=payload)
     new_profile = validate_api_response(response.json(), "create_new_profile")
@@ -102,6 +109,10 @@ def create_new_profile(token, cert_id, file_name, bundle_id, device_ids):
     logging.info(f"成功建立描述檔：{file_name}（ID: {profile_id}）")
     return new_profile["attributes"]["profileContent"]
 
+def create_new_profile(token, cert_id, file_name, bundle_id, device_ids):
+    """創建新的 Ad Hoc Provisioning Profile"""
+    return submit_profile(token, build_profile_payload(cert_id, file_name, bundle_id, device_ids))
+
 def download_profile(output_path, profile_content):
     """儲存 Base64 編碼的 Provisioning Profile 到本地檔案"""
     if not profile_content:
@@ -118,17 +129,17 @@ def download_profile(output_path, profile_content):
 def list_all_bundle_ids(token):
     """列出 Apple Developer 帳號內所有的 Bundle ID"""
     logging.info("正在獲取所有 Bundle ID...")
-    url = f"{API_BASE_URL}/bundleIds"
+    url = f"{config.api_base_url}/bundleIds"
     headers = get_headers(token)
-    response = http_client.get(url, headers=headers)
-    bundles = validate_api_response(response.json(), "list_all_bundle_ids")
+    bundles = validate_api_response(http_client.get_json(url, headers=headers), "list_all_bundle_ids")
     
     if not bundles:
         raise ValueError("未找到任何 Bundle ID，請確認帳號是否已註冊 App ID")
     
-    logging.info("找到以下 Bundle ID：")
-    for item in bundles:
-        logging.info(f"- {item['attributes']['identifier']} (ID: {item['id']})")
+    logging.info(f"找到 {len(bundles)} 個 Bundle ID")
+    if logging.isEnabledFor(DEBUG):  # 逐筆明細只在 DEBUG 輸出
+        for item in bundles:
+            logging.debug("- %s (ID: %s)", item['attributes']['identifier'], item['id'])
     return bundles
 
 def create_bundle_id(token, identifier, name=None, platform="IOS"):
@@ -149,9 +160,10 @@ def create_bundle_id(token, identifier, name=None, platform="IOS"):
             }
         }
     }
-    url = f"{API_BASE_URL}/bundleIds"
+    url = f"{config.api_base_url}/bundleIds"
     headers = get_headers(token)
-    
+    import requests
+
     try:
         response = http_client.post(url, headers=headers, json=payload)
         bundle_data = validate_api_response(response.json(), "create_bundle_id")
@@ -163,12 +175,57 @@ def create_bundle_id(token, identifier, name=None, platform="IOS"):
         logging.error(error_msg)
         raise ValueError(error_msg) from e
 
-def get_provisioning_profile(apple_id, progress=None, task_id=None):
-    """主函數：獲取或重新創建最新的 Provisioning Profile 並下載"""
+def resolve_bundle_id(token, identifier):
+    """把 com.example... 這類的 identifier 轉成網站上的 Bundle ID 索引，不存在時自動建立"""
+    for bundle in list_all_bundle_ids(token):
+        if bundle["attributes"]["identifier"] == identifier:
+            return bundle["id"]
+    return create_bundle_id(token, identifier)
+
+def _run_graph(nodes, on_done=None):
+    """ 🕸 依相依關係執行節點：相依的節點都完成後立即開始，彼此獨立的節點同時執行
+
+    Args:
+        nodes (dict): {名稱: (相依節點名稱的 tuple, 函式)}，函式接收相依節點結果組成的 dict
+        on_done (callable): 每個節點完成時以節點名稱呼叫（在呼叫端執行緒）
+
+    Returns:
+        dict: 各節點的結果。任一節點失敗時等執行中的節點結束後拋出該例外，尚未開始的節點不再執行。
+    """
+    results, running, error = {}, {}, None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        while True:
+            if error is None:
+                for name, (deps, func) in nodes.items():
+                    if name not in results and name not in running.values() and all(dep in results for dep in deps):
+                        # 子執行緒沿用呼叫端的 log_context 與目前的統計階段
+                        context = contextvars.copy_context()
+                        inputs = {dep: results[dep] for dep in deps}
+                        running[executor.submit(context.run, func, inputs)] = name
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                results[name] = future.result()
+                if on_done:
+                    on_done(name)
+    if error is not None:
+        raise error
+    if len(results) != len(nodes):
+        raise ValueError(f"描述檔流程的相依關係無法完成: {sorted(set(nodes) - set(results))}")
+    return results
+
+def get_provisioning_profile(apple_id, progress=None, task_id=None, bundle_id=None):
+    """主函數：獲取或重新創建最新的 Provisioning Profile 並下載（bundle_id 預設為 .env 的 BUNDLE_ID）
+
+    裝置、Bundle ID 與現有描述檔的查詢彼此獨立，同時進行；三者都完成後，刪除舊描述檔與組出建立請求同時進行，
+    整體耗時約為最長的一條相依路徑，而不是所有 API 往返的總和。
+    """
     logging.info("啟動 Provisioning Profile 處理流程...")
-    steps = 6  # 總步驟數
-    step_increment = 100 / steps if progress and task_id else 0
-    
     account = apple_accounts.get_account_by_apple_id(apple_id)
     if not account:
         raise ValueError(f"找不到 Apple ID: {apple_id}")
@@ -176,56 +233,67 @@ def get_provisioning_profile(apple_id, progress=None, task_id=None):
     if not cert_id:
         raise ValueError(f"Apple ID: {apple_id} 沒有對應的 cert_id")
     # 檢查.env bundle id是否有正確配置
-    env_bundle_id = config.bundle_id
+    env_bundle_id = bundle_id or config.bundle_id
     if not env_bundle_id:
         raise ValueError(f"未找到 BUNDLE_ID 請檢查 .env BUNDLE_ID是否有配置")
-    if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 1: 初始化
-    
+
     token = get_api_token(apple_id)
-    filename = f"adhoc_{cert_id}.mobileprovision"
+    filename = profile_filename(cert_id, env_bundle_id)
     output_path = get_profile_path(filename)
-    
-    if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 2: 獲取裝置
-    device_ids = get_all_devices(token, return_ids_only=True)
-    
-    if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 3: 獲取 Bundle ID
-
-    all_bundles = list_all_bundle_ids(token)
-    # 這裡開始 bundle_id 會是網站上的bundle_id的索引 不會是com.example....這類的
-    bundle_id = None
-    for bundle in all_bundles:
-        if bundle["attributes"]["identifier"] == env_bundle_id:
-            bundle_id = bundle["id"]
-            break
-    if not bundle_id:
-        bundle_id = create_bundle_id(token, env_bundle_id)
-    
-    if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 4: 處理現有描述檔
-    profile_id = find_existing_profile(token, filename)
-    if profile_id:
-        delete_existing_profile(token, profile_id)
-    
-    if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 5: 創建新描述檔
-    profile_content = create_new_profile(token, cert_id, filename, bundle_id, device_ids)
-    
+
+    nodes = {
+        "devices": ((), lambda _: get_all_devices(token, return_ids_only=True)),
+        # 這裡開始 bundle_id 會是網站上的bundle_id的索引 不會是com.example....這類的
+        "bundle_id": ((), lambda _: resolve_bundle_id(token, env_bundle_id)),
+        "existing": ((), lambda _: find_existing_profile(token, filename)),
+        # 裝置與 Bundle ID 都取得後才刪除舊描述檔：查詢失敗時帳號仍保有舊描述檔
+        "delete": (("existing", "devices", "bundle_id"), lambda r: delete_existing_profile(token, r["existing"])),
+        "payload": (("devices", "bundle_id"),
+                    lambda r: build_profile_payload(cert_id, filename, r["bundle_id"], r["devices"])),
+        "create": (("delete", "payload"), lambda r: submit_profile(token, r["payload"])),
+        "download": (("create",), lambda r: download_profile(output_path, r["create"])),
+    }
+    step_increment = 100 / (len(nodes) + 1) if progress and task_id else 0
     if progress and task_id:
-        progress.update(task_id, advance=step_increment)  # 步驟 6: 下載
-    download_profile(output_path, profile_content)
-    
+        progress.update(task_id, advance=step_increment)  # 初始化
+
+    def on_done(name):
+        if progress and task_id:
+            progress.update(task_id, advance=step_increment)
+
+    _run_graph(nodes, on_done)
+
     logging.info("Provisioning Profile 處理流程完成")
     if progress and task_id:
         progress.update(task_id, completed=100)
 
-def register_device(apple_id, device_name, device_udid):
-    """在 Apple Developer 帳號中註冊新裝置"""
+def refresh_all_profiles():
+    """重新產生所有已有憑證帳號的 Provisioning Profile，回傳成功與失敗的 Apple ID"""
+    refreshed, failed = [], []
+    for account in apple_accounts.get_accounts():
+        apple_id = account["apple_id"]
+        if not account["cert_id"]:
+            logging.info(f"Apple ID {apple_id} 尚未建立憑證，跳過更新描述檔")
+            continue
+        try:
+            get_provisioning_profile(apple_id)
+            refreshed.append(apple_id)
+        except Exception as e:
+            logging.error(f"更新描述檔失敗 Apple ID {apple_id}: {e}")
+            failed.append(apple_id)
+    logging.info(f"描述檔更新完成，成功 {len(refreshed)} 個，失敗 {len(failed)} 個")
+    return {"refreshed": refreshed, "failed": failed}
+
+def register_device(apple_id, device_name, device_udid, refresh_profile_on_conflict=True):
+    """在 Apple Developer 帳號中註冊新裝置
+
+    裝置已存在時預設會直接更新描述檔；若呼叫端之後會自行更新描述檔，
+    可傳入 refresh_profile_on_conflict=False 避免重複產生。
+    回傳 True 代表新註冊，False 代表裝置已存在。
+    """
     logging.info(f"正在註冊新裝置：{device_name} (UDID: {device_udid})...")
     token = get_api_token(apple_id)
-    url = f"{API_BASE_URL}/devices"
+    url = f"{config.api_base_url}/devices"
     headers = get_headers(token)
     payload = {
         "data": {
@@ -237,14 +305,20 @@ def register_device(apple_id, device_name, device_udid):
             }
         }
     }
+    import requests
     try:
         response = http_client.post(url, headers=headers, json=payload)
         device_info = response.json()["data"]
         logging.info(f"成功註冊裝置：{device_info['attributes']['name']} (ID: {device_info['id']})")
+        return True
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 409 and "already exists on this team" in e.response.text:
+            if not refresh_profile_on_conflict:
+                logging.info(f"裝置已存在：{device_udid}")
+                return False
             logging.info(f"裝置已存在，繼續執行 get_provisioning_profile")
             get_provisioning_profile(apple_id)
+            return False
         else:
             raise Exception(f"註冊裝置失敗: {e}")
         
@@ -266,7 +340,7 @@ def disable_device(token, udid):
     try:
         device_id = get_device_id_by_udid(token, udid)
         logging.info(f"正在停用裝置 ID: {device_id}（UDID: {udid}）...")
-        url = f"{API_BASE_URL}/devices/{device_id}"
+        url = f"{config.api_base_url}/devices/{device_id}"
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
         payload = {
             "data": {
@@ -285,10 +359,9 @@ def disable_device(token, udid):
 def get_all_profiles(token):
     """獲取 Apple Developer 帳號下所有 Provisioning Profile"""
     logging.info("正在獲取所有描述檔列表...")
-    url = f"{API_BASE_URL}/profiles"
+    url = f"{config.api_base_url}/profiles"
     headers = get_headers(token)
-    response = http_client.get(url, headers=headers)
-    profiles = validate_api_response(response.json(), "get_all_profiles")
+    profiles = validate_api_response(http_client.get_json(url, headers=headers), "get_all_profiles")
     
     if not profiles:
         logging.info("未找到任何描述檔")
@@ -296,46 +369,70 @@ def get_all_profiles(token):
     logging.info(f"找到 {len(profiles)} 個描述檔")
     return profiles
 
-def is_profile_valid(profile):
-    """檢查描述檔是否有效（未過期）"""
-    expiration_date_str = profile["attributes"].get("expirationDate")
-    profile_state = profile["attributes"].get("profileState")
-    
+def parse_expiration(value):
+    """把 API 的到期時間（例如 2025-01-01T00:00:00.000+0000）轉成 UNIX 時間戳，缺少時回傳 None"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp()
+
+def is_profile_valid(profile, expires_at=None, now=None):
+    """檢查描述檔是否有效（未過期）
+
+    批次檢查時可以傳入預先解析好的 expires_at（parse_expiration）與同一個 now，避免每筆重新解析日期與取得時間。
+    """
+    attributes = profile["attributes"]
+
     # 檢查 profileState 是否為 INVALID
-    if profile_state == "INVALID":
-        logging.debug(f"描述檔 {profile['attributes']['name']} 狀態為 INVALID，視為無效")
+    if attributes.get("profileState") == "INVALID":
+        logging.debug("描述檔 %s 狀態為 INVALID，視為無效", attributes['name'])
         return False
-    
-    if not expiration_date_str:
-        logging.warning(f"描述檔 {profile['attributes']['name']} 缺少 expirationDate，視為無效")
+
+    if expires_at is None:
+        expires_at = parse_expiration(attributes.get("expirationDate"))
+    if expires_at is None:
+        logging.warning(f"描述檔 {attributes['name']} 缺少 expirationDate，視為無效")
         return False
-    
-    exp_date = datetime.strptime(expiration_date_str, "%Y-%m-%dT%H:%M:%S.%f%z")
-    
-    is_valid = exp_date > datetime.now(exp_date.tzinfo)
-    logging.debug(f"檢查描述檔 {profile['attributes']['name']}：過期日期 {exp_date}, 是否有效: {is_valid}")
+
+    is_valid = expires_at > (time.time() if now is None else now)
+    logging.debug("檢查描述檔 %s：過期時間 %s, 是否有效: %s", attributes['name'], attributes.get("expirationDate"), is_valid)
     return is_valid
 
 def delete_profile(token, profile_id):
     """刪除指定的 Provisioning Profile"""
     logging.info(f"正在刪除描述檔（ID: {profile_id}）...")
-    url = f"{API_BASE_URL}/profiles/{profile_id}"
+    url = f"{config.api_base_url}/profiles/{profile_id}"
     headers = get_headers(token)
     http_client.delete(url, headers=headers)
     logging.info(f"成功刪除描述檔（ID: {profile_id}）")
 
-def cleanup_invalid_profiles(apple_id, progress=None, task_id=None):
-    """取得所有描述檔並刪除無效的描述檔"""
+def find_invalid_profiles(profiles, now=None):
+    """挑出無效的描述檔：每筆的到期時間只解析一次，所有描述檔與同一個時間點比較"""
+    now = time.time() if now is None else now
+    return [
+        profile for profile in profiles
+        if not is_profile_valid(profile, parse_expiration(profile["attributes"].get("expirationDate")), now)
+    ]
+
+def cleanup_invalid_profiles(apple_id, progress=None, task_id=None, dry_run=False, concurrency=None):
+    """取得所有描述檔並刪除無效的描述檔（同一帳號內同時刪除最多 PROFILE_DELETE_CONCURRENCY 個）
+
+    Returns:
+        dict: {"apple_id", "total", "invalid", "deleted", "failed"}；dry_run 時只計數、不刪除
+    """
     logging.info("開始清理無效的 Provisioning Profile...")
+    report = {"apple_id": apple_id, "total": 0, "invalid": 0, "deleted": 0, "failed": 0}
     token = get_api_token(apple_id)
     
     # 步驟 1: 獲取所有描述檔
     profiles = get_all_profiles(token)
     if not profiles:
         logging.info("無描述檔需要清理")
-        return
+        return report
     
-    total_profiles = len(profiles)
+    report["total"] = len(profiles)
     steps = 2  # 獲取描述檔 + 處理無效描述檔
     step_increment = 100 / steps if progress and task_id else 0
     
@@ -343,27 +440,90 @@ def cleanup_invalid_profiles(apple_id, progress=None, task_id=None):
         progress.update(task_id, advance=step_increment)  # 步驟 1 完成
     
     # 步驟 2: 檢查並刪除無效描述檔
-    invalid_profiles = [p for p in profiles if not is_profile_valid(p)]
+    invalid_profiles = find_invalid_profiles(profiles)
+    report["invalid"] = len(invalid_profiles)
     if not invalid_profiles:
         logging.info("未找到無效的描述檔")
-        return
+        return report
+    if dry_run:
+        logging.info(f"找到 {len(invalid_profiles)} 個無效描述檔（dry-run，不刪除）")
+        for profile in invalid_profiles:
+            logging.debug("將清理描述檔：%s（ID: %s）", profile["attributes"]["name"], profile["id"])
+        return report
     
     logging.info(f"找到 {len(invalid_profiles)} 個無效描述檔，將進行清理")
+    cleanup_task = None
     if progress and task_id:
         cleanup_task = progress.add_task("[yellow]清理無效描述檔", total=len(invalid_profiles))
-    
-    for profile in invalid_profiles:
-        profile_id = profile["id"]
-        profile_name = profile["attributes"]["name"]
-        try:
-            delete_profile(token, profile_id)
-            logging.info(f"已清理無效描述檔：{profile_name}（ID: {profile_id}）")
-            if progress and cleanup_task:
-                progress.update(cleanup_task, advance=1)
-        except Exception as e:
-            logging.error(f"清理描述檔 {profile_name}（ID: {profile_id}）失敗: {e}")
+
+    def delete(profile):
+        delete_profile(token, profile["id"])
+        return profile
+
+    workers = min(concurrency or config.profile_delete_concurrency or 1, len(invalid_profiles))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # 子執行緒沿用呼叫端的 log_context
+        futures = {executor.submit(contextvars.copy_context().run, delete, profile): profile
+                   for profile in invalid_profiles}
+        for future in concurrent.futures.as_completed(futures):
+            profile = futures[future]
+            profile_id = profile["id"]
+            profile_name = profile["attributes"]["name"]
+            try:
+                future.result()
+                report["deleted"] += 1
+                logging.info(f"已清理無效描述檔：{profile_name}（ID: {profile_id}）")
+                if cleanup_task is not None:
+                    progress.update(cleanup_task, advance=1)
+            except Exception as e:
+                report["failed"] += 1
+                logging.error(f"清理描述檔 {profile_name}（ID: {profile_id}）失敗: {e}")
     
     if progress and task_id:
         progress.update(task_id, advance=step_increment)  # 步驟 2 完成
     logging.info("無效描述檔清理完成")
+    return report
+
+def cleanup_all_profiles(apple_id=None, max_workers=None, dry_run=False):
+    """🧹 清理所有帳號（或指定 Apple ID）的無效描述檔，同時處理最多 PROFILE_CLEANUP_WORKERS 個帳號
+
+    結束時依帳號列出描述檔總數、無效數、已刪除與失敗數，回傳各帳號的報告。
+    """
+    if apple_id:
+        apple_ids = [apple_id]
+    else:
+        apple_ids = [account["apple_id"] for account in apple_accounts.get_accounts()]
+    if not apple_ids:
+        logging.info("沒有任何帳號需要清理描述檔")
+        return []
+    max_workers = min(max_workers or config.profile_cleanup_workers or 1, len(apple_ids))
+    logging.info(f"開始清理 {len(apple_ids)} 個帳號的無效描述檔，最大並行數: {max_workers}" + ("（dry-run）" if dry_run else ""))
+
+    def cleanup(apple_id):
+        with log_context(apple_id=apple_id, job_id=new_job_id()):
+            try:
+                return cleanup_invalid_profiles(apple_id, dry_run=dry_run)
+            except Exception as e:
+                logging.error(f"清理 Apple ID {apple_id} 的描述檔失敗: {e}")
+                return {"apple_id": apple_id, "total": None, "invalid": None, "deleted": 0, "failed": 0, "error": str(e)}
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reports = list(executor.map(cleanup, apple_ids))
 
+    action = "將刪除" if dry_run else "已刪除"
+    lines = [f"  {'Apple ID':<40}{'描述檔':>8}{'無效':>8}{action:>8}{'失敗':>8}"]
+    for report in reports:
+        if report.get("error"):
+            lines.append(f"  {report['apple_id']:<40}  ❌ {report['error']}")
+            continue
+        removed = report["invalid"] if dry_run else report["deleted"]
+        lines.append(f"  {report['apple_id']:<40}{report['total']:>8}{report['invalid']:>8}{removed:>8}{report['failed']:>8}")
+    invalid = sum(report["invalid"] or 0 for report in reports)
+    deleted = sum(report["deleted"] for report in reports)
+    errors = sum(1 for report in reports if report.get("error"))
+    summary = (f"找到 {invalid} 個無效描述檔（dry-run，未刪除）" if dry_run
+               else f"刪除 {deleted} / {invalid} 個無效描述檔")
+    logging.info(f"🧹 描述檔清理完成（{len(reports)} 個帳號，失敗 {errors} 個）：{summary}，"
+                 f"總耗時 {time.perf_counter() - started:.1f} 秒\n" + "\n".join(lines))
+    return reports
@@ -3,24 +3,51 @@ import os
 import shutil
 import plistlib
 import logging
+import zipfile
+import time
+import contextvars
 import concurrent.futures
-from rich.progress import Progress
 from apple_cert_manager.config import config
 from . import apple_accounts
-from . import keychain
 from . import certificate
+from . import code_signer
+from . import profile
+from . import artifact_store
+from . import ipa_fingerprint
+from . import ipa_zip
+from . import workspace
+from . import mobileprovision
+from .logging_config import log_context, new_job_id
+from . import metrics
+from . import runner
 
-def extract_ipa(apple_ipa_dir, ipa_dest_path, unzip_dir):
+def extract_ipa(apple_ipa_dir, ipa_dest_path, unzip_dir, ipa_path=None):
     os.makedirs(apple_ipa_dir, exist_ok=True)
-    shutil.copy2(config.ipa_path, ipa_dest_path)
+    shutil.copy2(ipa_path or config.ipa_path, ipa_dest_path)
     shutil.rmtree(unzip_dir, ignore_errors=True)
     try:
-        subprocess.run(["unzip", "-q", ipa_dest_path, "-d", unzip_dir], check=True, text=True, capture_output=True)
+        runner.run(["unzip", "-q", ipa_dest_path, "-d", unzip_dir])
     except subprocess.CalledProcessError as e:
         logging.error(f"解壓 IPA 文件失敗: {e.stderr or e.stdout or str(e)}")
         raise
     return unzip_dir
 
+def extract_template(ipa_path, template_dir):
+    """把 IPA 解壓成範本目錄，供同一個 IPA 的多個重簽名工作複製使用"""
+    shutil.rmtree(template_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(template_dir), exist_ok=True)
+    try:
+        runner.run(["unzip", "-q", ipa_path, "-d", template_dir])
+    except subprocess.CalledProcessError as e:
+        logging.error(f"解壓 IPA 範本失敗: {e.stderr or e.stdout or str(e)}")
+        raise
+    return template_dir
+
+def get_uncompressed_size(ipa_path):
+    """從 zip 中央目錄讀出解壓後的總大小（不需要解壓）"""
+    with zipfile.ZipFile(ipa_path) as zf:
+        return sum(info.file_size for info in zf.infolist())
+
 def get_app_dir(unzip_dir):
     payload_path = os.path.join(unzip_dir, "Payload")
     app_dir = next(
@@ -44,16 +71,12 @@ def replace_bundle_id(app_dir, new_bundle_id):
     return new_bundle_id
 
 def extract_entitlements(provisioning_profile_path, entitlements_path):
+    """在程式內解析描述檔（不需呼叫 `security cms`），把 Entitlements 寫到 entitlements_path"""
     try:
-        output = subprocess.run(
-            ["security", "cms", "-D", "-i", provisioning_profile_path],
-            check=True, text=True, capture_output=True
-        ).stdout
-    except subprocess.CalledProcessError as e:
-        logging.error(f"解析描述文件失敗: {e.stderr or e.stdout or str(e)}")
+        entitlements = mobileprovision.load(provisioning_profile_path)["entitlements"]
+    except ValueError as e:
+        logging.error(f"解析描述文件失敗: {e}")
         raise
-    plist_data = plistlib.loads(output.encode())
-    entitlements = plist_data.get("Entitlements", {})
     with open(entitlements_path, "wb") as plist_file:
         plistlib.dump(entitlements, plist_file)
     logging.info(f"已提取 Entitlements 至: {entitlements_path}")
@@ -72,162 +95,226 @@ def remove_code_signature(app_dir):
         shutil.rmtree(code_signature_path)
         logging.info(f"已移除舊簽名: {code_signature_path}")
 
-def sign_app(app_dir, signing_identity, entitlements_path, keychain_path):
-    # 簽名嵌套應用和擴展
+def sign_app(app_dir, signer, entitlements_path):
+    """依序簽名嵌套應用、框架與主應用；signer 為 code_signer 建立的簽名器（codesign 或 python）"""
+    # 簽名嵌套應用和擴展（彼此沒有包含關係時可以同時簽名）
+    nested_paths = []
     for root, dirs, _ in os.walk(app_dir):
         for d in dirs:
             if d.endswith((".app", ".appex")):
-                nested_path = os.path.join(root, d)
-                #logging.info(f"簽名嵌套應用: {nested_path}")
-                sign_single_app(nested_path, signing_identity, entitlements_path, keychain_path)
+                nested_paths.append(os.path.join(root, d))
+    independent = not any(
+        other != path and other.startswith(path + os.sep) for path in nested_paths for other in nested_paths
+    )
+    if independent:
+        signer.sign_many(nested_paths, entitlements_path, "嵌套應用")
+    else:
+        # 由內而外簽名：外層的 CodeResources 需要記錄內層簽名後的結果
+        for nested_path in sorted(nested_paths, key=lambda path: path.count(os.sep), reverse=True):
+            sign_single_app(nested_path, signer, entitlements_path)
 
-    # 簽名框架和動態庫
+    # 簽名框架、動態庫與 OnDemandResources（互相獨立，同時簽名）
+    leaf_paths = []
     frameworks_dir = os.path.join(app_dir, "Frameworks")
     if os.path.exists(frameworks_dir):
         for item in os.listdir(frameworks_dir):
             if item.endswith((".framework", ".dylib")):
-                framework_path = os.path.join(frameworks_dir, item)
-                #logging.info(f"簽名框架: {framework_path}")
-                try:
-                    subprocess.run([
-                        "codesign", "--force", "--sign", signing_identity,
-                        "--keychain", keychain_path, "--generate-entitlement-der",
-                        framework_path
-                    ], check=True, text=True, capture_output=True)
-                except subprocess.CalledProcessError as e:
-                    logging.error(f"簽名框架失敗: {framework_path}: {e.stderr or e.stdout or str(e)}")
-                    raise
-
-    # 簽名 OnDemandResources
+                leaf_paths.append(os.path.join(frameworks_dir, item))
     odr_dir = os.path.join(os.path.dirname(app_dir), "OnDemandResources")
     if os.path.exists(odr_dir):
         for item in os.listdir(odr_dir):
             if item.endswith(".assetpack"):
                 assetpack_path = os.path.join(odr_dir, item)
                 remove_code_signature(assetpack_path)
-                #logging.info(f"簽名 OnDemandResource: {assetpack_path}")
-                try:
-                    subprocess.run([
-                        "codesign", "--force", "--sign", signing_identity,
-                        "--keychain", keychain_path, "--generate-entitlement-der",
-                        assetpack_path
-                    ], check=True, text=True, capture_output=True)
-                except subprocess.CalledProcessError as e:
-                    logging.error(f"簽名 OnDemandResource 失敗: {assetpack_path}: {e.stderr or e.stdout or str(e)}")
-                    raise
+                leaf_paths.append(assetpack_path)
+    signer.sign_many(leaf_paths, description="框架 / OnDemandResource")
 
     # 簽名主應用
-    sign_single_app(app_dir, signing_identity, entitlements_path, keychain_path)
-
-def sign_single_app(app_path, signing_identity, entitlements_path, keychain_path):
-    command = [
-        "codesign", "--force", "--sign", signing_identity,
-        "--entitlements", entitlements_path, "--keychain", keychain_path,
-        "--generate-entitlement-der", "--timestamp", "--options", "runtime",
-        app_path
-    ]
-    try:
-        subprocess.run(command, check=True, text=True, capture_output=True)
-        logging.info(f"已成功簽名應用: {app_path}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"簽名應用失敗: {app_path}: {e.stderr or e.stdout or str(e)}")
-        raise
+    sign_single_app(app_dir, signer, entitlements_path)
+
+def sign_single_app(app_path, signer, entitlements_path):
+    signer.sign(app_path, entitlements_path)
+    logging.info(f"已成功簽名應用: {app_path}")
 
-def repackage_ipa(unzip_dir, resigned_ipa_path):
+def repackage_ipa(unzip_dir, resigned_ipa_path, source_ipa_path=None, extracted_at=None):
+    """重新打包；有原始 IPA 時預設只重新壓縮有變更的成員
+
+    IPA_REPACKAGE_MODE=full 時整個 Payload 在程式內平行重新壓縮，zip 則改用 zip 指令。
+    """
+    mode = config.ipa_repackage_mode
+    options = {
+        "compress_level": config.ipa_compress_level,
+        "workers": config.ipa_compress_workers or None,
+        "stored_extensions": config.ipa_stored_extensions,
+    }
+    if mode == "delta" and source_ipa_path and extracted_at is not None:
+        try:
+            stats = ipa_zip.delta_repackage(source_ipa_path, unzip_dir, resigned_ipa_path, extracted_at, **options)
+            metrics.record_io(read=stats["read_bytes"], written=stats["written_bytes"])
+            return resigned_ipa_path
+        except (ValueError, zipfile.BadZipFile) as e:
+            logging.warning(f"⚠️ 增量打包失敗，改為整個重新打包: {e}")
+    if mode != "zip":
+        stats = ipa_zip.pack_directory(unzip_dir, resigned_ipa_path, **options)
+        metrics.record_io(read=stats["read_bytes"], written=stats["written_bytes"])
+        return resigned_ipa_path
     if os.path.exists(resigned_ipa_path):
         os.remove(resigned_ipa_path)
+    os.makedirs(os.path.dirname(resigned_ipa_path), exist_ok=True)
     try:
-        subprocess.run(["zip", "-qr", resigned_ipa_path, "Payload"], cwd=unzip_dir, check=True, text=True, capture_output=True)
+        runner.run(["zip", "-qr", resigned_ipa_path, "Payload"], cwd=unzip_dir)
         #logging.info(f"已成功重新打包 IPA 文件: {resigned_ipa_path}")
     except subprocess.CalledProcessError as e:
         logging.error(f"重新打包 IPA 文件失敗: {e.stderr or e.stdout or str(e)}")
         raise
+    metrics.record_io(read=get_uncompressed_size(resigned_ipa_path), written=os.path.getsize(resigned_ipa_path))
     return resigned_ipa_path
 
-def clean_up(unzip_dir, copy_ipa_path):
+def clean_up(unzip_dir, copy_ipa_path, entitlements_path=None):
     if os.path.exists(unzip_dir):
         shutil.rmtree(unzip_dir)
     if os.path.exists(copy_ipa_path):
         os.remove(copy_ipa_path)
+    if entitlements_path and os.path.exists(entitlements_path):
+        os.remove(entitlements_path)
 
-def validate_signing_identity(signing_identity):
-    try:
-        output = subprocess.run(
-            ["security", "find-identity", "-v", "-p", "codesigning"],
-            check=True, text=True, capture_output=True
-        ).stdout
-    except subprocess.CalledProcessError as e:
-        logging.error(f"無法驗證簽名身份: {e.stderr or e.stdout or str(e)}")
-        raise
-    if signing_identity not in output:
-        raise ValueError(f"簽名身份無效或不在鑰匙圈中: {signing_identity}")
-    logging.info(f"簽名身份驗證通過: {signing_identity}")
+def validate_signing_identity(signing_identity, cert_id):
+    code_signer.create_signer(signing_identity, cert_id).validate()
+
+def collect_inputs(signing_identity, profile_path, entitlements_path, bundle_id, ipa_path=None):
+    """重簽名結果只取決於這些輸入，全部相同時產物也會相同"""
+    return {
+        "source_ipa": ipa_fingerprint.fingerprint(ipa_path or config.ipa_path)["digest"],
+        "cert_sha1": signing_identity,
+        "profile": artifact_store.file_digest(profile_path),
+        "entitlements": artifact_store.file_digest(entitlements_path),
+        "bundle_id": bundle_id,
+    }
+
+def resign_ipa(apple_id, force=False, ipa_path=None, bundle_id=None, output_path=None,
+               artifact_key=None, get_template=None):
+    """重簽名並回傳產物路徑；輸入與上次相同時直接沿用快取的產物（force=True 則一律重建）
 
-def resign_ipa(apple_id):
+    ipa_path、bundle_id 預設取 `.env` 的 IPA_PATH、BUNDLE_ID；批量矩陣 (resign_matrix) 會指定每個項目
+    各自的 IPA、Bundle ID 與輸出路徑。get_template 回傳同一個 IPA 共用的解壓範本目錄，
+    只有真的需要解壓時才會呼叫。解壓與簽名在 SCRATCH_DIR_PATH 下的暫存工作目錄進行，結束後一定刪除；
+    開始解壓前會先向磁碟預算申請預估用量，空間不足時等待其他工作完成。
+    """
     account = apple_accounts.get_account_by_apple_id(apple_id)
+    ipa_path = ipa_path or config.ipa_path
     apple_id_prefix = apple_id.split("@")[0]
-    apple_ipa_dir = os.path.join(config.ipa_dir_path, apple_id_prefix)
-    ipa_dest_path = os.path.join(apple_ipa_dir, os.path.basename(config.ipa_path))
-    unzip_dir = os.path.join(apple_ipa_dir, "unzip")
     cert_id = account['cert_id']
-    profile_path = os.path.join(config.profile_dir_path, f"adhoc_{cert_id}.mobileprovision")
-    entitlements_path = os.path.join(unzip_dir, "entitlements.plist")
-    keychain_path = os.path.expanduser(config.keychain_path)
-    resigned_ipa_path = os.path.join(apple_ipa_dir, "resigned.ipa")
-    
-    signing_identity = certificate.get_cer_sha1(cert_id)
-    validate_signing_identity(signing_identity)
-    
-    try:
-        output = subprocess.run(["security", "list-keychains"], check=True, text=True, capture_output=True).stdout
-        original_keychains = [kc.strip().strip('"') for kc in output.splitlines()]
-    except subprocess.CalledProcessError as e:
-        logging.error(f"獲取鑰匙圈列表失敗: {e.stderr or e.stdout or str(e)}")
-        raise
-    
-    try:
-        keychain.unlock_keychain()
-        keychain.install_apple_wwdr_certificate()
-        keychain.configure_keychain_search()
-        keychain.set_key_partition_list()
-        
-        extract_ipa(apple_ipa_dir, ipa_dest_path, unzip_dir)
-        app_dir = get_app_dir(unzip_dir)
-        new_bundle_id = config.bundle_id  # 假設從 config 中獲取
-        replace_bundle_id(app_dir, new_bundle_id)
-        replace_provisioning_profile(unzip_dir, profile_path)
-        extract_entitlements(profile_path, entitlements_path)
-        remove_code_signature(app_dir)
-        sign_app(app_dir, signing_identity, entitlements_path, keychain_path)
-        repackage_ipa(unzip_dir, resigned_ipa_path)
-        return resigned_ipa_path
-    except Exception as e:
-        logging.error(f"重簽名失敗: {e}")
-        raise
-    finally:
-        keychain.restore_default_keychain(original_keychains)
-        clean_up(unzip_dir, ipa_dest_path)
+    new_bundle_id = bundle_id or config.bundle_id
+    profile_path = os.path.join(config.profile_dir_path, profile.profile_filename(cert_id, new_bundle_id))
+    resigned_ipa_path = output_path or os.path.join(config.ipa_dir_path, apple_id_prefix, "resigned.ipa")
+    artifact_key = artifact_key or apple_id
 
-def resign_single_account(account):
+    with workspace.job_workspace(apple_id_prefix) as work_dir:
+        ipa_dest_path = os.path.join(work_dir, os.path.basename(ipa_path))
+        unzip_dir = os.path.join(work_dir, "unzip")
+        # 放在解壓目錄外：解壓前就需要用來判斷輸入是否有變更
+        entitlements_path = os.path.join(work_dir, "entitlements.plist")
+
+        with metrics.span("extract_entitlements"):
+            extract_entitlements(profile_path, entitlements_path)
+        # 沿用快取產物前也要確認簽名身份仍然有效（憑證被撤銷或私鑰已移除時不能交出舊產物）
+        with metrics.span("validate_identity"):
+            signing_identity = certificate.get_cer_sha1(cert_id)
+            signer = code_signer.create_signer(signing_identity, cert_id)
+            signer.validate()
+        with metrics.span("fingerprint"):
+            inputs = collect_inputs(signing_identity, profile_path, entitlements_path, new_bundle_id, ipa_path)
+            cached_path = None if force else artifact_store.lookup(artifact_key, inputs)
+            if cached_path:
+                artifact_store.materialize(cached_path, resigned_ipa_path)
+        if cached_path:
+            logging.info(f"♻️ 輸入未變更，沿用上次的產物: {resigned_ipa_path}")
+            return resigned_ipa_path
+
+        with metrics.span("wait_disk"):
+            estimate = workspace.estimate_workspace_bytes(ipa_path, resigned_ipa_path, use_template=bool(get_template))
+            budget = workspace.disk_budget()
+            budget.acquire(estimate)
+        try:
+            with metrics.span("keychain_setup"):
+                signer.prepare()
+
+            with metrics.span("extract") as stage:
+                extracted_at = time.time()
+                extracted_size = get_uncompressed_size(ipa_path)
+                if get_template:
+                    # 直接複製已解壓的範本，不必每個帳號都複製 IPA 再解壓一次
+                    shutil.copytree(get_template(), unzip_dir, symlinks=True)
+                    stage.add_io(read=extracted_size, written=extracted_size)
+                else:
+                    extract_ipa(work_dir, ipa_dest_path, unzip_dir, ipa_path)
+                    ipa_size = os.path.getsize(ipa_dest_path)
+                    # 複製原始 IPA（讀 + 寫）再解壓（讀 + 寫出完整目錄）
+                    stage.add_io(read=ipa_size * 2, written=ipa_size + extracted_size)
+                app_dir = get_app_dir(unzip_dir)
+            with metrics.span("replace_bundle_id"):
+                replace_bundle_id(app_dir, new_bundle_id)
+            with metrics.span("embed_profile"):
+                replace_provisioning_profile(unzip_dir, profile_path)
+            with metrics.span("remove_signature"):
+                remove_code_signature(app_dir)
+            with metrics.span("sign"):
+                sign_app(app_dir, signer, entitlements_path)
+            with metrics.span("repackage"):
+                repackage_ipa(unzip_dir, resigned_ipa_path, ipa_path, extracted_at)
+            with metrics.span("store_artifact"):
+                try:
+                    artifact_store.store(artifact_key, inputs, resigned_ipa_path)
+                except OSError as e:
+                    logging.warning(f"⚠️ 無法保存重簽名產物快取: {e}")
+            return resigned_ipa_path
+        except Exception as e:
+            logging.error(f"重簽名失敗: {e}")
+            raise
+        finally:
+            with metrics.span("cleanup"):
+                budget.release(estimate)
+                clean_up(unzip_dir, ipa_dest_path, entitlements_path)
+
+def resign_single_account(account, force=False):
     apple_id = account["apple_id"]
-    logging.info(f"開始重簽名 Apple ID: {apple_id}")
-    try:
-        result = resign_ipa(apple_id)
-        logging.info(f"Apple ID {apple_id} 簽名成功: {result}")
-        return apple_id, result
-    except Exception as e:
-        logging.error(f"Apple ID {apple_id} 簽名失敗: {e}")
-        return apple_id, None
-
-def batch_resign_all_accounts(max_workers=min(os.cpu_count() or 1, 10)):
+    with log_context(apple_id=apple_id, job_id=new_job_id()):
+        logging.info(f"開始重簽名 Apple ID: {apple_id}")
+        try:
+            result = resign_ipa(apple_id, force=force)
+            logging.info(f"Apple ID {apple_id} 簽名成功: {result}")
+            return apple_id, result
+        except Exception as e:
+            logging.error(f"Apple ID {apple_id} 簽名失敗: {e}")
+            return apple_id, None
+
+def batch_resign_all_accounts(max_workers=min(os.cpu_count() or 1, 10), force=False):
     accounts = apple_accounts.get_accounts()
     logging.info(f"開始批量重簽名，最大並行數: {max_workers}")
+    try:
+        _, changes = ipa_fingerprint.detect_changes(config.ipa_path)
+        logging.info(f"📦 {ipa_fingerprint.describe_changes(changes)}")
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ 無法比對來源 IPA 變更: {e}")
+    workspace.cleanup_stale()
+    budget = workspace.disk_budget()
+    budget.reset_peak()
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_account = {executor.submit(resign_single_account, acc): acc for acc in accounts}
+    started = time.perf_counter()
+    with metrics.collect() as run_spans, concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 每個工作帶著這次批量的 context 執行，各階段耗時只彙總這一批
+        future_to_account = {
+            executor.submit(contextvars.copy_context().run, resign_single_account, acc, force): acc for acc in accounts
+        }
         for future in concurrent.futures.as_completed(future_to_account):
             results.append(future.result())
+    from rich.progress import Progress
     with Progress() as progress:
         task_id = progress.add_task("[green]批量重簽名", total=len(accounts))
         for _ in results:
             progress.update(task_id, advance=1)
+    succeeded = sum(1 for _, result in results if result)
+    logging.info(f"批量重簽名完成: 成功 {succeeded} / {len(results)}，總耗時 {time.perf_counter() - started:.1f} 秒")
+    logging.info(budget.format_summary())
+    logging.info(run_spans.format_summary("重簽名各階段耗時"))
+    return results
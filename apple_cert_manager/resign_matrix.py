@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import contextvars
+import concurrent.futures
+from apple_cert_manager.config import config
+from . import apple_accounts
+from . import profile
+from . import resign_ipa
+from . import ipa_fingerprint
+from . import metrics
+from . import workspace
+from .logging_config import log_context, new_job_id
+
+logging = logging.getLogger(__name__)
+
+
+class _Once:
+    """ 同一個 key 只執行一次：其他執行緒等待並共用結果（失敗時共用同一個例外） """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._locks = {}
+
+    def run(self, key, func, *args):
+        with self._lock:
+            if key in self._results:
+                return self._unwrap(self._results[key])
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._results:
+                    return self._unwrap(self._results[key])
+            try:
+                result = (True, func(*args))
+            except Exception as e:
+                result = (False, e)
+            with self._lock:
+                self._results[key] = result
+        return self._unwrap(result)
+
+    @staticmethod
+    def _unwrap(result):
+        ok, value = result
+        if not ok:
+            raise value
+        return value
+
+
+def load_matrix(manifest_path):
+    """ 📂 讀取矩陣描述檔，回傳正規化後的項目列表
+
+    格式（相對路徑以描述檔所在目錄為準，accounts 省略或為 "all" 代表所有已有憑證的帳號）：
+
+        {"entries": [
+            {"name": "app1", "ipa": "app1.ipa", "bundle_id": "com.example.app1",
+             "accounts": ["a@example.com"], "output_dir": "out/app1"}
+        ]}
+    """
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    raw_entries = data.get("entries") if isinstance(data, dict) else data
+    if not isinstance(raw_entries, list) or not raw_entries:
+        raise ValueError(f"❌ 矩陣描述檔沒有任何項目: {manifest_path}")
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    entries, names = [], set()
+    for index, raw in enumerate(raw_entries):
+        ipa_path = raw.get("ipa")
+        bundle_id = raw.get("bundle_id")
+        if not ipa_path or not bundle_id:
+            raise ValueError(f"❌ 第 {index + 1} 個項目缺少 ipa 或 bundle_id")
+        ipa_path = os.path.join(base_dir, os.path.expanduser(ipa_path))
+        if not os.path.exists(ipa_path):
+            raise FileNotFoundError(f"❌ 找不到 IPA: {ipa_path}")
+        name = raw.get("name") or bundle_id
+        if name in names:
+            raise ValueError(f"❌ 項目名稱重複: {name}")
+        names.add(name)
+        accounts = raw.get("accounts", "all")
+        if accounts != "all" and not isinstance(accounts, list):
+            raise ValueError(f"❌ 項目 {name} 的 accounts 必須是 Apple ID 列表或 \"all\"")
+        output_dir = raw.get("output_dir")
+        output_dir = os.path.join(base_dir, os.path.expanduser(output_dir)) if output_dir \
+            else os.path.join(config.ipa_dir_path, "matrix", name)
+        entries.append({
+            "name": name,
+            "ipa": ipa_path,
+            "bundle_id": bundle_id,
+            "accounts": accounts,
+            "output_dir": output_dir,
+        })
+    return entries
+
+def _ensure_profile(apple_id, cert_id, bundle_id):
+    """ 該 Bundle ID 的描述檔不存在時才向 Apple 建立 """
+    profile_path = profile.get_profile_path(profile.profile_filename(cert_id, bundle_id))
+    if not os.path.exists(profile_path):
+        logging.info(f"📥 {apple_id} 尚無 {bundle_id} 的描述檔，開始建立")
+        profile.get_provisioning_profile(apple_id, bundle_id=bundle_id)
+    return profile_path
+
+def _resign_job(entry, account, templates, profiles, templates_dir, force):
+    apple_id = account["apple_id"]
+    apple_id_prefix = apple_id.split("@")[0]
+    record = {
+        "entry": entry["name"],
+        "apple_id": apple_id,
+        "bundle_id": entry["bundle_id"],
+        "output": None,
+        "status": "failed",
+        "error": None,
+        "seconds": 0.0,
+    }
+    started = time.perf_counter()
+    with log_context(apple_id=apple_id, job_id=new_job_id()):
+        logging.info(f"開始重簽名 {entry['name']}（{entry['bundle_id']}）")
+        try:
+            profiles.run((apple_id, entry["bundle_id"]), _ensure_profile,
+                         apple_id, account["cert_id"], entry["bundle_id"])
+            ipa_path = os.path.realpath(entry["ipa"])
+            template_dir = os.path.join(templates_dir, ipa_fingerprint.fingerprint(ipa_path)["digest"][:16])
+            record["output"] = resign_ipa.resign_ipa(
+                apple_id,
+                force=force,
+                ipa_path=ipa_path,
+                bundle_id=entry["bundle_id"],
+                output_path=os.path.join(entry["output_dir"], f"{apple_id_prefix}.ipa"),
+                artifact_key=f"{apple_id}__{entry['name']}",
+                get_template=lambda: templates.run(template_dir, resign_ipa.extract_template, ipa_path, template_dir),
+            )
+            record["status"] = "succeeded"
+            logging.info(f"{entry['name']} 簽名成功: {record['output']}")
+        except Exception as e:
+            record["error"] = str(e)
+            logging.error(f"{entry['name']} 簽名失敗: {e}")
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+def _expand_jobs(entries):
+    """ 展開 (項目 × 帳號)，回傳要執行的工作與直接略過的紀錄 """
+    accounts = {account["apple_id"]: account for account in apple_accounts.get_accounts()}
+    jobs, skipped = [], []
+    for entry in entries:
+        apple_ids = list(accounts) if entry["accounts"] == "all" else entry["accounts"]
+        for apple_id in apple_ids:
+            account = accounts.get(apple_id)
+            reason = None
+            if account is None:
+                reason = "找不到 Apple ID"
+            elif not account["cert_id"]:
+                reason = "尚未建立憑證"
+            if reason:
+                skipped.append({
+                    "entry": entry["name"], "apple_id": apple_id, "bundle_id": entry["bundle_id"],
+                    "output": None, "status": "skipped", "error": reason, "seconds": 0.0,
+                })
+                continue
+            jobs.append((entry, account))
+    return jobs, skipped
+
+def run_matrix(manifest_path, max_workers=min(os.cpu_count() or 1, 10), force=False, report_path=None):
+    """ 🔄 依矩陣描述檔重簽名所有 (IPA, Bundle ID, 帳號) 組合，全部放進同一個工作池
+
+    同一個 IPA 只解壓一次作為範本、同一個帳號與 Bundle ID 的描述檔只處理一次，
+    API token 則沿用 auth 的快取。結束後輸出彙總報告 (JSON)。
+    """
+    entries = load_matrix(manifest_path)
+    jobs, records = _expand_jobs(entries)
+    report_path = report_path or os.path.join(config.ipa_dir_path, "matrix_report.json")
+    logging.info(f"開始批量重簽名矩陣: {len(entries)} 個項目，共 {len(jobs)} 個工作，最大並行數: {max_workers}")
+
+    for ipa_path in sorted({os.path.realpath(entry["ipa"]) for entry in entries}):
+        try:
+            _, changes = ipa_fingerprint.detect_changes(ipa_path)
+            logging.info(f"📦 {os.path.basename(ipa_path)}: {ipa_fingerprint.describe_changes(changes)}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ 無法比對來源 IPA 變更: {ipa_path}: {e}")
+
+    workspace.cleanup_stale()
+    budget = workspace.disk_budget()
+    budget.reset_peak()
+    templates, profiles = _Once(), _Once()
+    templates_dir = tempfile.mkdtemp(prefix=f"templates-{os.getpid()}-", dir=workspace.scratch_dir())
+    started = time.perf_counter()
+    try:
+        with metrics.collect() as run_spans, concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 每個工作帶著這次矩陣的 context 執行，各階段耗時只彙總這一次
+            futures = [
+                executor.submit(contextvars.copy_context().run, _resign_job, entry, account, templates, profiles,
+                                templates_dir, force)
+                for entry, account in jobs
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                records.append(future.result())
+    finally:
+        shutil.rmtree(templates_dir, ignore_errors=True)
+
+    summary = {}
+    for entry in entries:
+        entry_records = [record for record in records if record["entry"] == entry["name"]]
+        summary[entry["name"]] = {
+            status: sum(1 for record in entry_records if record["status"] == status)
+            for status in ("succeeded", "failed", "skipped")
+        }
+    report = {
+        "manifest": os.path.abspath(manifest_path),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total_seconds": round(time.perf_counter() - started, 3),
+        "summary": summary,
+        "disk": budget.summary(),
+        "jobs": sorted(records, key=lambda record: (record["entry"], record["apple_id"])),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, counts in summary.items():
+        logging.info(f"📊 {name}: 成功 {counts['succeeded']}，失敗 {counts['failed']}，略過 {counts['skipped']}")
+    logging.info(budget.format_summary())
+    logging.info(f"批量重簽名矩陣完成，總耗時 {report['total_seconds']:.1f} 秒，報告: {report_path}")
+    logging.info(run_spans.format_summary("重簽名各階段耗時"))
+    return report
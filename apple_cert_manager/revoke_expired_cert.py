@@ -4,6 +4,7 @@ from apple_cert_manager.config import config
 from . import apple_accounts 
 from . import match
 from . import local_file
+from .logging_config import flush_logging
 import logging
 
 logging = logging.getLogger(__name__)
@@ -66,6 +67,35 @@ def revoke_expired_certificates():
         logging.error(f"刪除過期憑證出現錯誤: {e}")
     
 
+def scan_certificate_expiry(warning_days=None):
+    """ 掃描所有帳戶目前使用中的憑證，回報即將過期（或已過期）的憑證 """
+    warning_days = config.cert_expiry_warning_days if warning_days is None else warning_days
+    report = []
+    for account in apple_accounts.get_accounts():
+        apple_id = account['apple_id']
+        cert_id = account['cert_id']
+        if not cert_id:
+            logging.warning(f"⚠️ Apple ID {apple_id} 尚未建立憑證")
+            report.append({"apple_id": apple_id, "cert_id": None, "days_left": None})
+            continue
+        try:
+            certificates = certificate.list_certificates(apple_id)
+        except Exception as e:
+            logging.error(f"❌ 掃描 Apple ID {apple_id} 憑證失敗: {e}")
+            continue
+        current = next((cert for cert in certificates if cert['id'] == cert_id), None)
+        if not current:
+            logging.warning(f"⚠️ Apple ID {apple_id} 的憑證 {cert_id} 已不存在於 App Store Connect")
+            report.append({"apple_id": apple_id, "cert_id": cert_id, "days_left": None})
+            continue
+        exp_date = datetime.strptime(current['attributes']['expirationDate'], "%Y-%m-%dT%H:%M:%S.%f%z")
+        days_left = (exp_date - datetime.now(exp_date.tzinfo)).days
+        if days_left <= warning_days:
+            logging.warning(f"⚠️ Apple ID {apple_id} 的憑證 {cert_id} 將於 {days_left} 天後過期")
+        report.append({"apple_id": apple_id, "cert_id": cert_id, "days_left": days_left})
+    logging.info(f"✅ 憑證到期掃描完成，共 {len(report)} 個帳戶")
+    return report
+
 def revoke_certificate(apple_id):
     """刪除指定的證書"""
     certificates = certificate.list_certificates(apple_id)
@@ -73,7 +103,11 @@ def revoke_certificate(apple_id):
     if not certificates:
         logging.info(f"⚠️ Apple ID `{apple_id}` 沒有可撤銷的憑證")
         return
-    # 🚀 **提示輸入憑證 ID**
+    for cert in certificates:
+        attributes = cert['attributes']
+        logging.info(f"憑證ID: {cert['id']}, 名稱: {attributes['name']} 類型: {attributes['certificateType']} 到期日期: {certificate.format_expiration_date(attributes['expirationDate'])}")
+    # 🚀 **提示輸入憑證 ID**（先把佇列中的日誌輸出完，避免提示訊息插在憑證列表前面）
+    flush_logging()
     while True:
         cert_id = input("\n請輸入要刪除的證書 ID: ").strip()
         
@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import date, timedelta
+from cryptography import x509
+from apple_cert_manager.config import config
+from . import apple_accounts
+from . import certificate
+from . import local_file
+from . import profile
+from .logging_config import log_context, new_job_id
+
+logging = logging.getLogger(__name__)
+
+# 最晚在到期前幾天換發（到期當天的簽名與安裝已經不可靠）
+RENEWAL_MARGIN_DAYS = 1
+# 新憑證建立後，描述檔更新最多嘗試幾次
+PROFILE_ATTEMPTS = 2
+STATE_FILENAME = "rotation_state.json"
+
+
+def _state_path():
+    return os.path.join(os.path.expanduser(config.cert_dir_path), STATE_FILENAME)
+
+def _load_state(today):
+    """ 讀取今天已嘗試換發的帳號（含失敗，換日後重新計算） """
+    try:
+        with open(_state_path(), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    if state.get("date") != today.isoformat():
+        state = {"date": today.isoformat(), "renewed": []}
+    return state
+
+def _save_state(state):
+    path = _state_path()
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def certificate_expiry(cert_id):
+    """ 從本地 `.cer` 讀取憑證到期日（不呼叫 API），檔案不存在時回傳 None """
+    try:
+        with open(certificate.get_cert_path(cert_id), "rb") as f:
+            cert = x509.load_der_x509_certificate(f.read())
+    except (OSError, ValueError) as e:
+        logging.warning(f"⚠️ 無法讀取憑證 {cert_id} 的到期日: {e}")
+        return None
+    return cert.not_valid_after_utc.date()
+
+def _preferred_offset(apple_id, span):
+    """ 依 Apple ID 在換發區間內固定挑一天 """
+    return int.from_bytes(hashlib.sha1(apple_id.encode("utf-8")).digest()[:4], "big") % span
+
+def plan_rotation(today=None, window_days=None, daily_cap=None, accounts=None):
+    """ 📅 規劃憑證換發日期：在到期前 window_days 天內分散換發，每天最多 daily_cap 個
+
+    同一天建立的帳號憑證也會在同一天到期；這裡依到期日由近到遠分配，每個帳號優先排在區間內固定的一天，
+    該天已滿就往後（再往前）找有空位的日期。到期前已經排不進去的帳號會超出當天上限（overflow），
+    已過期或今天就是最後期限的帳號一律排在今天。今天已嘗試換發的數量（rotation_state.json，含失敗）會先計入今天的上限。
+
+    Returns:
+        list: 依換發日期排序的 dict（apple_id、cert_id、expires、window_start、scheduled、overflow），日期為 ISO 字串
+    """
+    today = today or date.today()
+    window_days = window_days or config.cert_rotation_window_days
+    daily_cap = daily_cap or config.cert_rotation_daily_cap
+    accounts = apple_accounts.get_accounts() if accounts is None else accounts
+
+    candidates = []
+    for account in accounts:
+        cert_id = account["cert_id"]
+        if not cert_id:
+            continue
+        expires = certificate_expiry(cert_id)
+        if expires is None:
+            continue
+        window_start = expires - timedelta(days=window_days)
+        window_end = max(expires - timedelta(days=RENEWAL_MARGIN_DAYS), window_start)
+        # 偏好日期以完整的區間計算，區間開始後每天重新規劃，偏好日期也不會改變
+        preferred = window_start + timedelta(days=_preferred_offset(account["apple_id"], (window_end - window_start).days + 1))
+        latest = max(window_end, today)
+        earliest = max(window_start, today)
+        preferred = min(max(preferred, earliest), latest)
+        candidates.append((latest, account["apple_id"], cert_id, expires, earliest, preferred))
+
+    load = {today: len(_load_state(today)["renewed"])}
+    plan = []
+    for latest, apple_id, cert_id, expires, earliest, preferred in sorted(candidates):
+        days = [earliest + timedelta(days=i) for i in range((latest - earliest).days + 1)]
+        days = [day for day in days if day >= preferred] + [day for day in days if day < preferred]  # 偏好日期及之後優先，再往前找
+        scheduled = next((day for day in days if load.get(day, 0) < daily_cap), None)
+        overflow = scheduled is None
+        if overflow:
+            scheduled = min(days, key=lambda day: (load.get(day, 0), day))
+        load[scheduled] = load.get(scheduled, 0) + 1
+        plan.append({
+            "apple_id": apple_id,
+            "cert_id": cert_id,
+            "expires": expires.isoformat(),
+            "window_start": earliest.isoformat(),
+            "scheduled": scheduled.isoformat(),
+            "overflow": overflow,
+        })
+    plan.sort(key=lambda entry: (entry["scheduled"], entry["expires"], entry["apple_id"]))
+    return plan
+
+def format_plan(plan, days=14, today=None):
+    """ 依日期彙總換發計畫（只列出最近 days 天） """
+    today = today or date.today()
+    if not plan:
+        return "📅 憑證換發計畫: 沒有需要換發的憑證"
+    per_day = {}
+    for entry in plan:
+        per_day.setdefault(entry["scheduled"], []).append(entry)
+    horizon = (today + timedelta(days=days)).isoformat()
+    lines = [f"📅 憑證換發計畫（共 {len(plan)} 個，每天上限 {config.cert_rotation_daily_cap}，區間 {config.cert_rotation_window_days} 天）:"]
+    for day, entries in sorted(per_day.items()):
+        if day > horizon:
+            lines.append(f"  … 其後 {sum(len(e) for d, e in per_day.items() if d > horizon)} 個排在 {horizon} 之後")
+            break
+        overflow = sum(1 for entry in entries if entry["overflow"])
+        names = ", ".join(entry["apple_id"] for entry in entries[:3]) + ("…" if len(entries) > 3 else "")
+        lines.append(f"  {day}  {len(entries):>4} 個" + (f"（超出上限 {overflow}）" if overflow else "") + f"  {names}")
+    return "\n".join(lines)
+
+def show_rotation_plan(days=14):
+    """ 🔍 輸出換發計畫（CLI / 常駐服務） """
+    plan = plan_rotation()
+    logging.info(format_plan(plan, days))
+    return plan
+
+def renew_certificate(apple_id, old_cert_id):
+    """ 🔄 換發單一帳號的憑證：建立新憑證與描述檔後才移除本地的舊身分
+
+    舊憑證留在 App Store Connect 直到自然到期（已安裝的 App 不受影響），帳號的發佈憑證達上限時
+    建立新憑證前會先刪除最早到期的一張。帳號改指向新憑證後就不會再被排入換發計畫，
+    所以描述檔重試後仍失敗時也會移除舊身分（下次重簽名會重新產生描述檔），再回報失敗的步驟；
+    移除舊身分或本地檔案失敗只記錄警告，換發仍視為成功。
+    """
+    try:
+        cert_id = certificate.create_certificate(apple_id)
+    except Exception as e:
+        raise RuntimeError(f"建立新憑證失敗: {e}") from e
+    try:
+        apple_accounts.update_cert_id(apple_id, cert_id)
+    except Exception as e:
+        raise RuntimeError(f"新憑證 {cert_id} 已建立，但更新帳號憑證 ID 失敗: {e}") from e
+
+    profile_error = None
+    for attempt in range(1, PROFILE_ATTEMPTS + 1):
+        try:
+            profile.get_provisioning_profile(apple_id)
+            profile_error = None
+            break
+        except Exception as e:
+            profile_error = e
+            logging.warning(f"⚠️ Apple ID {apple_id} 新憑證 {cert_id} 的描述檔更新失敗（第 {attempt}/{PROFILE_ATTEMPTS} 次）: {e}")
+
+    # 新憑證已經生效，舊身分清不掉只影響本地的整潔，不算換發失敗
+    try:
+        certificate.remove_keychain_certificate_by_id(old_cert_id)
+    except Exception as e:
+        logging.warning(f"⚠️ Apple ID {apple_id} 無法移除舊憑證 {old_cert_id} 的身分: {e}")
+    try:
+        local_file.remove_local_files(old_cert_id)
+    except OSError as e:
+        logging.warning(f"⚠️ Apple ID {apple_id} 無法刪除舊憑證 {old_cert_id} 的本地檔案: {e}")
+    if profile_error:
+        raise RuntimeError(f"新憑證 {cert_id} 已生效、已清理舊身分 {old_cert_id}，但描述檔更新失敗: {profile_error}") from profile_error
+    logging.info(f"✅ Apple ID {apple_id} 憑證已換發: {old_cert_id} → {cert_id}")
+    return cert_id
+
+def rotate_certs(dry_run=False, today=None):
+    """ 🔄 換發今天（以及先前漏掉的）排定的憑證，其餘留到計畫中的日期
+
+    Returns:
+        dict: {"due": 今天到期的換發數, "renewed": [...], "failed": [...], "remaining": 之後日期的換發數}
+    """
+    today = today or date.today()
+    plan = plan_rotation(today)
+    due = [entry for entry in plan if entry["scheduled"] <= today.isoformat()]
+    report = {"due": len(due), "renewed": [], "failed": [], "remaining": len(plan) - len(due)}
+    if not due:
+        logging.info(f"📅 今天沒有排定換發的憑證（之後還有 {report['remaining']} 個）")
+        return report
+    if dry_run:
+        logging.info(f"📅 今天排定換發 {len(due)} 個憑證（dry-run，不換發）: {', '.join(entry['apple_id'] for entry in due)}")
+        return report
+
+    logging.info(f"🔄 開始換發 {len(due)} 個憑證（之後還有 {report['remaining']} 個）")
+    state = _load_state(today)
+    for entry in due:
+        apple_id = entry["apple_id"]
+        with log_context(apple_id=apple_id, job_id=new_job_id()):
+            # 先記錄再換發：部分失敗時新憑證可能已經建立，同樣要計入今天的上限
+            state["renewed"].append(apple_id)
+            _save_state(state)
+            try:
+                renew_certificate(apple_id, entry["cert_id"])
+                report["renewed"].append(apple_id)
+            except Exception as e:
+                logging.error(f"❌ Apple ID {apple_id} 憑證換發失敗（到期日 {entry['expires']}）: {e}")
+                report["failed"].append(apple_id)
+    logging.info(f"🔄 憑證換發完成: 成功 {len(report['renewed'])} / {len(due)}，之後還有 {report['remaining']} 個")
+    return report
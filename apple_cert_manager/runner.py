@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+import subprocess
+from . import metrics
+
+logging = logging.getLogger(__name__)
+
+# 📌 各工具預設的逾時（秒）；簽大型 App 或解壓大型 IPA 需要較久
+DEFAULT_TIMEOUTS = {
+    "codesign": 600,
+    "security": 60,
+    "openssl": 30,
+    "unzip": 600,
+    "zip": 600,
+}
+FALLBACK_TIMEOUT = 120
+
+
+def default_timeout(command):
+    return DEFAULT_TIMEOUTS.get(os.path.basename(command[0]), FALLBACK_TIMEOUT)
+
+
+class SubprocessBackend:
+    """ 實際執行外部指令 """
+
+    def run(self, command, timeout, cwd=None, input=None):
+        result = subprocess.run(command, cwd=cwd, input=input, capture_output=True, timeout=timeout)
+        return result.returncode, result.stdout, result.stderr
+
+    async def run_async(self, command, timeout, cwd=None, input=None):
+        process = await asyncio.create_subprocess_exec(
+            *command, cwd=cwd,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(command, timeout)
+        return process.returncode, stdout, stderr
+
+
+class FakeBackend:
+    """ 🧪 不執行任何指令的替身：依工具名稱（`security` 可加上子指令）交給註冊的 handler
+
+    handler 接收 (command, cwd, input)，回傳 (returncode, stdout, stderr) 或 None（視為成功、無輸出）；
+    沒有註冊的工具一律成功。所有呼叫都記錄在 calls，方便檢查流程呼叫了哪些指令。
+
+        fake = runner.FakeBackend()
+        fake.register("security find-identity", lambda command, cwd, input: (0, b'1) ABC "Apple Distribution"', b""))
+        with runner.use_backend(fake):
+            ...
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def register(self, name, handler):
+        self.handlers[name] = handler
+        return self
+
+    def run(self, command, timeout, cwd=None, input=None):
+        with self._lock:
+            self.calls.append(list(command))
+        handler = self.handlers.get(metrics.command_template(command)) or self.handlers.get(os.path.basename(command[0]))
+        result = handler(command, cwd, input) if handler else None
+        return result or (0, b"", b"")
+
+    async def run_async(self, command, timeout, cwd=None, input=None):
+        return self.run(command, timeout, cwd, input)
+
+
+_backend = SubprocessBackend()
+
+def set_backend(backend):
+    """ 替換執行外部指令的 backend，回傳原本的 backend """
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+@contextlib.contextmanager
+def use_backend(backend):
+    previous = set_backend(backend)
+    try:
+        yield backend
+    finally:
+        set_backend(previous)
+
+def _decode(value, text):
+    if text and isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value
+
+def _prepare(command, timeout, input, text):
+    command = [str(part) for part in command]
+    if timeout is None:
+        timeout = default_timeout(command)
+    if text and isinstance(input, str):
+        input = input.encode("utf-8")
+    return command, timeout, input
+
+def _finish(command, started, outcome, check, text):
+    """ 記錄統計並轉成 CompletedProcess；失敗時拋出與 subprocess.run 相同的例外 """
+    seconds = time.perf_counter() - started
+    metrics.record_subprocess(seconds)
+    if isinstance(outcome, subprocess.TimeoutExpired):
+        metrics.tool_metrics.record(command, "timeout", seconds)
+        logging.error(f"⏱ 指令逾時（{outcome.timeout} 秒）: {metrics.command_template(command)}")
+        raise outcome
+    if isinstance(outcome, BaseException):
+        metrics.tool_metrics.record(command, "error", seconds)
+        raise outcome
+    returncode, stdout, stderr = outcome
+    metrics.tool_metrics.record(command, returncode, seconds)
+    result = subprocess.CompletedProcess(command, returncode, _decode(stdout, text), _decode(stderr, text))
+    if check:
+        result.check_returncode()
+    return result
+
+def run(command, check=True, text=True, timeout=None, cwd=None, input=None):
+    """ 🛠 執行外部指令（一律擷取輸出）
+
+    未指定 timeout 時依工具使用 DEFAULT_TIMEOUTS；耗時記到目前的階段與 tool_metrics。
+    失敗時拋出 subprocess.CalledProcessError / subprocess.TimeoutExpired（check=False 時不檢查結束碼）。
+    """
+    command, timeout, input = _prepare(command, timeout, input, text)
+    started = time.perf_counter()
+    try:
+        outcome = _backend.run(command, timeout, cwd, input)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        outcome = e
+    return _finish(command, started, outcome, check, text)
+
+async def run_async(command, check=True, text=True, timeout=None, cwd=None, input=None):
+    """ 🛠 run 的非同步版本（asyncio.create_subprocess_exec），同一個事件迴圈內可同時執行多個指令 """
+    command, timeout, input = _prepare(command, timeout, input, text)
+    started = time.perf_counter()
+    try:
+        outcome = await _backend.run_async(command, timeout, cwd, input)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        outcome = e
+    return _finish(command, started, outcome, check, text)
+
+def run_many(commands, max_concurrency=None, **kwargs):
+    """ 🚀 在一個事件迴圈內同時執行多個指令（最多 max_concurrency 個，預設為 CPU 數），依原順序回傳結果
+
+    任何一個指令失敗時，等其他指令結束後拋出第一個錯誤。
+    """
+    if not commands:
+        return []
+
+    async def gather():
+        semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+
+        async def run_one(command):
+            async with semaphore:
+                return await run_async(command, **kwargs)
+
+        results = await asyncio.gather(*(run_one(command) for command in commands), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    return asyncio.run(gather())
@@ -0,0 +1,170 @@
+import os
+import shutil
+import logging
+import zipfile
+import tempfile
+import threading
+import contextlib
+from apple_cert_manager.config import config
+
+logging = logging.getLogger(__name__)
+
+# 等待空間釋放時，每隔多久重新檢查一次剩餘空間（空間也可能被其他程式釋放）
+POLL_INTERVAL = 5.0
+MB = 1024 * 1024
+
+
+def scratch_dir():
+    """ 重簽名工作目錄的根目錄（可指向 tmpfs 等較快的磁碟） """
+    path = config.scratch_dir_path or os.path.join(config.ipa_dir_path, ".work")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _same_device(path, other):
+    try:
+        return os.stat(path).st_dev == os.stat(other).st_dev
+    except OSError:
+        return False
+
+def estimate_workspace_bytes(ipa_path, output_path, use_template=False):
+    """ 估計一個重簽名工作在工作目錄所在磁碟上最多會用掉的空間
+
+    包含複製的 IPA（使用解壓範本時不需要）、解壓後的目錄，以及輸出在同一個磁碟時的產物。
+    """
+    ipa_size = os.path.getsize(ipa_path)
+    with zipfile.ZipFile(ipa_path) as zf:
+        extracted_size = sum(info.file_size for info in zf.infolist())
+    estimate = extracted_size + (0 if use_template else ipa_size)
+    if _same_device(scratch_dir(), os.path.dirname(output_path) or "."):
+        estimate += ipa_size
+    return estimate
+
+
+class DiskBudget:
+    """ 📏 依磁碟剩餘空間決定是否讓重簽名工作開始
+
+    剩餘空間扣掉保留空間與執行中工作的預估用量後，放得下新工作的預估用量才會放行，否則等待。
+    執行中的工作一律以完整預估用量計算（即使已經寫了一部分），寧可少跑幾個也不要塞滿磁碟。
+    沒有任何工作在執行時一定放行，避免單一工作比可用空間還大時永遠等待。
+    """
+
+    def __init__(self, path, reserve_bytes=0):
+        self.path = path
+        self.reserve_bytes = reserve_bytes
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._active = 0
+        self.reset_peak()
+
+    def reset_peak(self):
+        """ 以目前的磁碟用量為基準，重新統計峰值 """
+        with self._condition:
+            self._baseline_used = shutil.disk_usage(self.path).used
+            self.peak_used_bytes = 0
+            self.peak_reserved_bytes = self._in_use
+            self.peak_active = self._active
+            self.waits = 0
+
+    def _sample(self):
+        used = shutil.disk_usage(self.path).used - self._baseline_used
+        self.peak_used_bytes = max(self.peak_used_bytes, used)
+
+    def acquire(self, estimate):
+        with self._condition:
+            waited = False
+            while True:
+                available = shutil.disk_usage(self.path).free - self.reserve_bytes - self._in_use
+                if estimate <= available or self._active == 0:
+                    break
+                if not waited:
+                    logging.info(f"⏳ 工作目錄空間不足（需要 {estimate // MB} MB，可用 {max(available, 0) // MB} MB），"
+                                 f"等待其他工作完成")
+                    self.waits += 1
+                    waited = True
+                self._condition.wait(timeout=POLL_INTERVAL)
+            if estimate > available:
+                logging.warning(f"⚠️ 工作目錄可用空間 ({max(available, 0) // MB} MB) 小於預估用量 ({estimate // MB} MB)")
+            self._in_use += estimate
+            self._active += 1
+            self.peak_reserved_bytes = max(self.peak_reserved_bytes, self._in_use)
+            self.peak_active = max(self.peak_active, self._active)
+            self._sample()
+
+    def release(self, estimate):
+        with self._condition:
+            self._sample()  # 工作目錄清除前是用量最高的時候
+            self._in_use -= estimate
+            self._active -= 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, estimate):
+        self.acquire(estimate)
+        try:
+            yield
+        finally:
+            self.release(estimate)
+
+    def summary(self):
+        with self._condition:
+            self._sample()
+            return {
+                "scratch_dir": self.path,
+                "peak_used_bytes": self.peak_used_bytes,
+                "peak_reserved_bytes": self.peak_reserved_bytes,
+                "peak_active": self.peak_active,
+                "waits": self.waits,
+            }
+
+    def format_summary(self):
+        summary = self.summary()
+        return (f"💽 工作目錄 {summary['scratch_dir']}: 磁碟用量峰值 {summary['peak_used_bytes'] / MB:.1f} MB，"
+                f"預估用量峰值 {summary['peak_reserved_bytes'] / MB:.1f} MB，最多同時 {summary['peak_active']} 個工作，"
+                f"因空間不足等待 {summary['waits']} 次")
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+def disk_budget():
+    """ 同一個行程內所有重簽名工作（批量、矩陣、HTTP API、常駐服務）共用同一份磁碟預算 """
+    global _budget
+    with _budget_lock:
+        path = scratch_dir()
+        if _budget is None or _budget.path != path:
+            _budget = DiskBudget(path, config.scratch_reserve_mb * MB)
+        return _budget
+
+@contextlib.contextmanager
+def job_workspace(prefix):
+    """ 建立一個工作目錄，離開時一定刪除（名稱包含 PID，行程中斷留下的目錄可由 cleanup_stale 清除） """
+    path = tempfile.mkdtemp(prefix=f"{prefix}-{os.getpid()}-", dir=scratch_dir())
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def cleanup_stale():
+    """ 🧹 刪除已結束的行程留下的工作目錄 """
+    removed = 0
+    root = scratch_dir()
+    for name in os.listdir(root):
+        parts = name.rsplit("-", 2)
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        pid = int(parts[1])
+        if pid != os.getpid() and not _pid_alive(pid):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            removed += 1
+    if removed:
+        logging.info(f"🧹 已清除 {removed} 個中斷的工作目錄")
+    return removed
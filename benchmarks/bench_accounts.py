@@ -0,0 +1,253 @@
+"""⏱ 帳號管理流程 benchmark（對本地 App Store Connect 替身伺服器）
+
+依序量測 `insert_from_json`、`match_apple_account`、`revoke_expired_certificates`、`register_device`，
+回報每個帳號的 API 呼叫數、總耗時與實際達到的並行度（替身伺服器同時處理中的請求數），結果存成 JSON。
+
+每個帳號數各建立一個全新的環境（暫存目錄、假 `security`、替身伺服器），彼此不互相影響：
+
+    python3 -m benchmarks.bench_accounts --accounts 10,100,1000 --latency 0.05 --page-size 20
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.mock_app_store_connect import MAX_PAGE_LIMIT, start_mock_server
+from benchmarks.stub_tools import install_stub_tools
+
+SCENARIOS = ("insert_from_json", "match_apple_account", "revoke_expired_certificates", "register_device",
+             "refresh_all_profiles", "cleanup_profiles", "rotate_certs")
+
+ENV_TEMPLATE = """ROOT_DIR="{root}"
+BUNDLE_ID="com.bench.accounts"
+KEYCHAIN_PATH="{root}/bench.keychain-db"
+KEYCHAIN_PASSWORD="0000"
+API_KEY_DIR_PATH="{root}/api_key"
+DB_PATH="{root}/apple_account.sqlite"
+CERT_DIR_PATH="{root}/certs"
+PROFILE_DIR_PATH="{root}/profiles"
+IPA_DIR_PATH="{root}/ipa"
+IPA_PATH="{root}/app.ipa"
+JSON_PATH="{root}/accounts.json"
+APP_STORE_CONNECT_API_URL="{api_url}"
+"""
+
+
+def _write_api_keys(api_key_dir, key_ids):
+    """所有帳號共用同一把 EC 私鑰（替身伺服器不驗證簽章），只是檔名不同"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    private_key = ec.generate_private_key(ec.SECP256R1()).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    os.makedirs(api_key_dir, exist_ok=True)
+    for key_id in key_ids:
+        with open(os.path.join(api_key_dir, f"AuthKey_{key_id}.p8"), "wb") as f:
+            f.write(private_key)
+
+
+def prepare_environment(root, server, account_count):
+    """建立 `.env`、API 金鑰、帳號 JSON 與假工具，回傳帳號列表"""
+    for name in ("certs", "profiles", "ipa"):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    keychain_path = os.path.join(root, "bench.keychain-db")
+    open(keychain_path, "wb").close()
+    identities_path = os.path.join(root, "identities.txt")
+    open(identities_path, "w").close()
+    os.environ.update(install_stub_tools(os.path.join(root, "bin"), identities_path, keychain_path))
+
+    accounts = [
+        {"apple_id": f"bench{i:05d}@example.com", "issuer_id": f"issuer-{i:05d}", "key_id": f"KEY{i:05d}"}
+        for i in range(account_count)
+    ]
+    _write_api_keys(os.path.join(root, "api_key"), [account["key_id"] for account in accounts])
+    with open(os.path.join(root, "accounts.json"), "w", encoding="utf-8") as f:
+        json.dump(accounts, f)
+
+    env_path = os.path.join(root, ".env")
+    with open(env_path, "w") as f:
+        f.write(ENV_TEMPLATE.format(root=root, api_url=server.base_url))
+    return env_path, accounts
+
+
+def _for_each_account(func, accounts, workers):
+    """以執行緒池對每個帳號執行 func，回傳失敗數"""
+    def call(account):
+        try:
+            func(account)
+            return True
+        except Exception:
+            return False
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(1 for ok in executor.map(call, accounts) if not ok)
+
+
+def run_scenario(name, func, server, account_count):
+    from apple_cert_manager import metrics
+    server.reset_stats()
+    metrics.http_metrics.clear()
+    started = time.perf_counter()
+    failures = func() or 0
+    wall = time.perf_counter() - started
+    stats = server.stats()
+    client = metrics.http_metrics.snapshot()
+    result = {
+        "scenario": name,
+        "accounts": account_count,
+        "failures": failures,
+        "wall_seconds": round(wall, 4),
+        "api_calls": stats["requests"],
+        "api_calls_per_account": round(stats["requests"] / account_count, 2),
+        "client_calls": sum(entry["calls"] for entry in client.values()),
+        "client_retries": sum(entry["retries"] for entry in client.values()),
+        "client_coalesced": sum(entry.get("coalesced", 0) for entry in client.values()),
+        "max_concurrency": stats["max_in_flight"],
+        "avg_concurrency": round(stats["busy_seconds"] / wall, 2) if wall else None,
+        "endpoints": stats["endpoints"],
+        "statuses": stats["statuses"],
+        "client_latency": {template: entry["latency"] for template, entry in client.items()},
+    }
+    print(f"📊 {name} ({account_count} 帳號): {wall:.2f} 秒，API 呼叫 {stats['requests']} 次"
+          f"（每帳號 {result['api_calls_per_account']}），最大並行 {stats['max_in_flight']}，"
+          f"平均並行 {result['avg_concurrency']}，失敗 {failures}")
+    return result
+
+
+def run_account_count(account_count, args):
+    """以全新環境量測一個帳號數下的所有情境"""
+    from apple_cert_manager import apple_accounts, auth, match, metrics, profile, revoke_expired_cert, rotation
+    from apple_cert_manager.config import config
+
+    server = start_mock_server(
+        latency=args.latency, jitter=args.jitter, page_size=args.page_size, rate_limit=args.rate_limit,
+        error_rate=args.error_rate, devices_per_team=args.devices,
+    )
+    results = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="acm-bench-accounts-") as root:
+            env_path, accounts = prepare_environment(root, server, account_count)
+            # 每輪換一個環境：重新載入設定並清掉上一輪的 token 與資料庫狀態（load_dotenv 不會覆蓋已存在的變數）
+            for line in ENV_TEMPLATE.splitlines():
+                os.environ.pop(line.split("=", 1)[0], None)
+            config.load_called = False
+            config.load(env_path)
+            apple_accounts.DATABASE_INITIALIZED = False
+            auth.clear_token_cache()
+
+            def insert():
+                try:
+                    apple_accounts.insert_from_json(os.path.join(root, "accounts.json"))
+                except Exception as e:
+                    print(f"⚠️ insert_from_json 中斷: {e}")
+                return sum(1 for account in apple_accounts.get_accounts() if not account["cert_id"])
+
+            def match_all():
+                return _for_each_account(lambda account: match.match_apple_account(account["apple_id"]),
+                                         accounts, args.workers)
+
+            def revoke():
+                for account in accounts:
+                    server.seed_certificates(account["issuer_id"], args.expired_certs, expired=True)
+                revoke_expired_cert.revoke_expired_certificates()
+
+            def register():
+                return _for_each_account(
+                    lambda account: profile.register_device(account["apple_id"], "Bench Device",
+                                                            f"bench-{account['key_id']}"),
+                    accounts, args.workers,
+                )
+
+            def refresh():
+                return len(profile.refresh_all_profiles()["failed"])
+
+            def cleanup():
+                for account in accounts:
+                    server.seed_profiles(account["issuer_id"], args.stale_profiles, expired=True)
+                reports = profile.cleanup_all_profiles(max_workers=args.workers)
+                return sum(1 for report in reports if report.get("error") or report["failed"])
+
+            def rotate():
+                # 同一批匯入的憑證同一天到期：從換發區間開始逐日執行，確認每天的換發數不超過上限
+                expiries = [rotation.certificate_expiry(account["cert_id"]) for account in apple_accounts.get_accounts()
+                            if account["cert_id"]]
+                start = min(expiry for expiry in expiries if expiry) - timedelta(days=config.cert_rotation_window_days)
+                server.certificate_validity_days = 365 + 2 * config.cert_rotation_window_days
+                per_day, failures = [], 0
+                try:
+                    for offset in range(config.cert_rotation_window_days):
+                        report = rotation.rotate_certs(today=start + timedelta(days=offset))
+                        per_day.append(len(report["renewed"]))
+                        failures += len(report["failed"])
+                finally:
+                    server.certificate_validity_days = 365
+                print(f"🔄 rotate_certs: {sum(per_day)} 個憑證分散在 {sum(1 for n in per_day if n)} 天換發，"
+                      f"單日最多 {max(per_day)} 個（上限 {config.cert_rotation_daily_cap}）")
+                return failures
+
+            scenarios = {
+                "insert_from_json": insert,
+                "match_apple_account": match_all,
+                "revoke_expired_certificates": revoke,
+                "register_device": register,
+                "refresh_all_profiles": refresh,
+                "cleanup_profiles": cleanup,
+                "rotate_certs": rotate,
+            }
+            for name in args.scenarios:
+                results.append(run_scenario(name, scenarios[name], server, account_count))
+    finally:
+        server.shutdown()
+        server.server_close()
+        metrics.http_metrics.clear()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="⏱ 帳號管理流程 benchmark")
+    parser.add_argument("--accounts", default="10,100", help="要量測的帳號數，以逗號分隔（例如 10,100,1000）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"要執行的情境（{', '.join(SCENARIOS)}）")
+    parser.add_argument("--workers", type=int, default=None, help="match / register_device 的並行數（預設同 insert_from_json）")
+    parser.add_argument("--latency", type=float, default=0.02, help="替身伺服器每個請求的延遲（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="額外的隨機延遲上限（秒）")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_LIMIT, help="列表每頁筆數")
+    parser.add_argument("--rate-limit", type=int, default=0, help="每個 team 每小時的請求上限（0 為不限制）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入 500 / 503 的比例（0~1）")
+    parser.add_argument("--devices", type=int, default=3, help="每個 team 預設的裝置數")
+    parser.add_argument("--expired-certs", type=int, default=1, help="revoke 情境中每個 team 預先建立的過期憑證數")
+    parser.add_argument("--stale-profiles", type=int, default=20, help="cleanup 情境中每個 team 預先建立的過期描述檔數")
+    parser.add_argument("--output", default=f"bench-accounts-{time.strftime('%Y%m%d-%H%M%S')}.json", help="結果 JSON 路徑")
+    parser.add_argument("--log-level", default="ERROR", help="流程本身的日誌等級")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知的情境: {', '.join(unknown)}")
+
+    from apple_cert_manager.logging_config import configure_logging
+    configure_logging(level=args.log_level.upper())
+
+    results = []
+    for account_count in (int(value) for value in args.accounts.split(",")):
+        results.extend(run_account_count(account_count, args))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "log_level")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
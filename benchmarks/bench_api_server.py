@@ -0,0 +1,171 @@
+"""⏱ 本地 HTTP API 檢查與 benchmark（假註冊 / 假描述檔 / 假簽名器）
+
+以可注入的替身動作啟動 `ApiServer`，透過 HTTP 走完「提交 → 輪詢 → 下載」：
+
+* 每個帳號連續提交 `--requests` 次 `/resign`，確認合併情況與每個工作下載到的 IPA 都是自己的（同帳號之後的工作不會覆蓋之前的檔案）
+* 下載完成後讓工作過期，確認每個工作的 IPA 都會被刪除
+
+任何檢查失敗時以非零狀態結束，結果存成 JSON：
+
+    python3 -m benchmarks.bench_api_server --accounts 4 --requests 3 --resign-delay 0.05
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+import urllib.request
+
+
+def _request(base_url, method, path, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data else {})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.status, response.read()
+
+
+class FakeActions:
+    """替身動作：重簽名時在輸出路徑寫入每次都不同的內容，並記錄每個路徑應有的雜湊"""
+
+    def __init__(self, resign_delay):
+        self.resign_delay = resign_delay
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.expected = {}  # output_path -> sha256
+
+    def register_device(self, apple_id, device_name, device_udid):
+        return True
+
+    def refresh_profile(self, apple_id):
+        pass
+
+    def resign(self, apple_id, output_path):
+        time.sleep(self.resign_delay)
+        with self.lock:
+            self.counter += 1
+            content = f"{apple_id}#{self.counter}".encode("utf-8") * 256
+            self.expected[output_path] = hashlib.sha256(content).hexdigest()
+        with open(output_path, "wb") as f:
+            f.write(content)
+        return output_path
+
+
+def _poll(base_url, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        _, body = _request(base_url, "GET", f"/jobs/{job_id}")
+        job = json.loads(body)
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(f"工作 {job_id} 逾時未完成")
+
+
+def run(args):
+    from apple_cert_manager import api_server
+
+    fake = FakeActions(args.resign_delay)
+    accounts = [{"apple_id": f"api{i:03d}@example.com"} for i in range(args.accounts)]
+    errors = []
+    with tempfile.TemporaryDirectory(prefix="acm-bench-api-") as root:
+        output_dir = os.path.join(root, "api-jobs")
+        manager = api_server.JobManager(
+            max_workers=args.workers, register_device=fake.register_device,
+            refresh_profile=fake.refresh_profile, resign=fake.resign, output_dir=output_dir,
+        )
+        server = api_server.ApiServer(host="127.0.0.1", port=0, manager=manager, get_accounts=lambda: accounts)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            started = time.perf_counter()
+            # 每個帳號依序提交並等待完成，同帳號的每個工作都會各自產生 IPA
+            def submit_and_download(account):
+                downloads = []
+                for _ in range(args.requests):
+                    status, body = _request(base_url, "POST", "/resign", {"apple_id": account["apple_id"]})
+                    if status != 202:
+                        errors.append(f"{account['apple_id']}: 提交回傳 {status}")
+                        continue
+                    job = _poll(base_url, json.loads(body)["job"]["id"])
+                    if job["state"] != "done" or not job["ipa_ready"]:
+                        errors.append(f"{job['id']}: 狀態 {job['state']}，錯誤 {job['error']}")
+                        continue
+                    downloads.append(job["id"])
+                # 全部完成後才下載，確認先完成的工作沒有被之後的工作覆蓋
+                for job_id in downloads:
+                    _, content = _request(base_url, "GET", f"/jobs/{job_id}/ipa")
+                    expected = fake.expected.get(os.path.join(output_dir, f"{job_id}.ipa"))
+                    if hashlib.sha256(content).hexdigest() != expected:
+                        errors.append(f"{job_id}: 下載的 IPA 與工作產生的內容不符")
+                return len(downloads)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.accounts) as executor:
+                downloaded = sum(executor.map(submit_and_download, accounts))
+            wall = time.perf_counter() - started
+
+            # 讓所有工作過期（提交新請求時同樣會執行 _prune），確認 IPA 一併刪除
+            files_before_prune = len(os.listdir(output_dir))
+            original_ttl = api_server.FINISHED_JOB_TTL
+            api_server.FINISHED_JOB_TTL = -1
+            try:
+                with manager.lock:
+                    manager._prune()
+            finally:
+                api_server.FINISHED_JOB_TTL = original_ttl
+            files_after_prune = len(os.listdir(output_dir))
+            if files_after_prune:
+                errors.append(f"工作過期後仍留下 {files_after_prune} 個 IPA")
+        finally:
+            server.shutdown()
+            server.server_close()
+            manager.shutdown()
+
+    result = {
+        "accounts": args.accounts,
+        "requests_per_account": args.requests,
+        "wall_seconds": round(wall, 4),
+        "downloaded": downloaded,
+        "files_before_prune": files_before_prune,
+        "files_after_prune": files_after_prune,
+        "errors": errors,
+    }
+    print(f"📊 HTTP API: {args.accounts} 帳號 × {args.requests} 次，{wall:.2f} 秒，下載 {downloaded} 個 IPA，"
+          f"過期清理 {files_before_prune} → {files_after_prune}，錯誤 {len(errors)}")
+    for error in errors:
+        print(f"❌ {error}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 HTTP API 檢查與 benchmark")
+    parser.add_argument("--accounts", type=int, default=4, help="帳號數")
+    parser.add_argument("--requests", type=int, default=3, help="每個帳號依序提交的重簽名次數")
+    parser.add_argument("--workers", type=int, default=4, help="JobManager 執行緒數")
+    parser.add_argument("--resign-delay", type=float, default=0.05, help="假簽名器每次的耗時（秒）")
+    parser.add_argument("--output", default="bench_api_server.json", help="結果 JSON 路徑")
+    args = parser.parse_args()
+
+    result = run(args)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "result": result,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入: {args.output}")
+    if result["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
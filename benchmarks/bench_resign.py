@@ -0,0 +1,318 @@
+"""⏱ 重簽名吞吐量 benchmark
+
+產生合成 IPA 與一組假帳號，端到端執行 `resign_ipa` 與 `batch_resign_all_accounts`，
+回報總耗時、吞吐量（IPA/分鐘）、最高記憶體用量（RSS）與各階段結束時的磁碟用量，結果存成 JSON 方便比較。
+
+預設在暫存目錄建立獨立環境，並把假的 `codesign` / `security` 放到 PATH（見 `stub_tools.py`），
+不會動到真實鑰匙圈；加上 `--env` 則改用既有的 `.env` 與真實工具（只替換 IPA），
+`--signer python` 則不呼叫 codesign，改在程式內簽名。
+
+    python3 -m benchmarks.bench_resign --size-mb 200 --accounts 8 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import plistlib
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.stub_tools import install_stub_tools, wrap_unsigned_cms
+from benchmarks.synthetic_ipa import generate_ipa
+
+ENV_TEMPLATE = """ROOT_DIR="{root}"
+BUNDLE_ID="com.bench.resigned"
+KEYCHAIN_PATH="{root}/bench.keychain-db"
+KEYCHAIN_PASSWORD="0000"
+API_KEY_DIR_PATH="{root}/api_key"
+DB_PATH="{root}/apple_account.sqlite"
+CERT_DIR_PATH="{root}/certs"
+PROFILE_DIR_PATH="{root}/profiles"
+IPA_DIR_PATH="{root}/ipa"
+IPA_PATH="{ipa_path}"
+JSON_PATH="{root}/accounts.json"
+SIGNER_BACKEND="{signer}"
+"""
+
+
+def _disk_usage(path):
+    """實際佔用的區塊大小（與 `du` 相同），路徑不存在時為 0"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                continue  # 其他執行緒正在清理
+    return total
+
+
+def _peak_rss():
+    """回傳 (本程序, 子程序) 的最高 RSS（位元組）；macOS 的 ru_maxrss 單位是位元組，Linux 是 KB"""
+    scale = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+class DiskMonitor:
+    """📀 量測磁碟用量：每個階段結束時記錄該帳號目錄的大小，另以背景執行緒取樣整體峰值"""
+
+    def __init__(self, ipa_dir, interval=0.2):
+        self.ipa_dir = ipa_dir
+        self.interval = interval
+        self.stages = {}
+        self.peak = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def on_span(self, span):
+        apple_id = span.labels.get("apple_id")
+        if not apple_id:
+            return
+        usage = _disk_usage(os.path.join(self.ipa_dir, apple_id.split("@")[0]))
+        with self._lock:
+            stage = self.stages.setdefault(span.name, {"max_bytes": 0, "total_bytes": 0, "count": 0})
+            stage["max_bytes"] = max(stage["max_bytes"], usage)
+            stage["total_bytes"] += usage
+            stage["count"] += 1
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _disk_usage(self.ipa_dir))
+
+    def __enter__(self):
+        from apple_cert_manager import metrics
+        metrics.recorder.add_listener(self.on_span)
+        self._thread = threading.Thread(target=self._sample, name="disk-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        from apple_cert_manager import metrics
+        self._stop.set()
+        self._thread.join()
+        metrics.recorder.remove_listener(self.on_span)
+
+    def report(self):
+        return {
+            "peak_bytes": self.peak,
+            "stages": {
+                name: {"max_bytes": stage["max_bytes"], "avg_bytes": stage["total_bytes"] // stage["count"]}
+                for name, stage in self.stages.items()
+            },
+        }
+
+
+def _bench_identity(cert_id):
+    """自簽的簽名身分：回傳 (DER 憑證, 以 KEYCHAIN_PASSWORD 加密的 PKCS#12)，供 SIGNER_BACKEND=python 使用"""
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COMMON_NAME, f"Apple Distribution: Bench ({cert_id})"),
+        x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, "BENCHTEAM"),
+    ])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=365)).sign(key, hashes.SHA256()))
+    p12 = pkcs12.serialize_key_and_certificates(
+        cert_id.encode(), key, cert, None, serialization.BestAvailableEncryption(b"0000"))
+    return cert.public_bytes(serialization.Encoding.DER), p12
+
+
+def prepare_synthetic_environment(root, ipa_path, account_count, codesign_delay, signer="codesign"):
+    """建立 `.env`、帳號、憑證、描述檔與假工具，回傳 `.env` 路徑"""
+    env_path = os.path.join(root, ".env")
+    with open(env_path, "w") as f:
+        f.write(ENV_TEMPLATE.format(root=root, ipa_path=ipa_path, signer=signer))
+    for name in ("certs", "profiles", "ipa", "api_key"):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    keychain_path = os.path.join(root, "bench.keychain-db")
+    open(keychain_path, "wb").close()  # 已存在就不會嘗試建立新的鑰匙圈
+
+    identities = []
+    accounts = []
+    for i in range(account_count):
+        cert_id = f"BENCHCERT{i:04d}"
+        cert_bytes, p12 = _bench_identity(cert_id)
+        with open(os.path.join(root, "certs", f"{cert_id}.cer"), "wb") as f:
+            f.write(cert_bytes)
+        with open(os.path.join(root, "certs", f"{cert_id}.p12"), "wb") as f:
+            f.write(p12)
+        identities.append(hashlib.sha1(cert_bytes).hexdigest().upper())
+        profile = {
+            "Name": f"adhoc_{cert_id}",
+            "Entitlements": {
+                "application-identifier": "BENCHTEAM.com.bench.resigned",
+                "com.apple.developer.team-identifier": "BENCHTEAM",
+                "get-task-allow": False,
+            },
+        }
+        with open(os.path.join(root, "profiles", f"adhoc_{cert_id}.mobileprovision"), "wb") as f:
+            f.write(wrap_unsigned_cms(plistlib.dumps(profile)))
+        accounts.append((f"bench{i:04d}@example.com", f"issuer-{i}", f"KEY{i:04d}", cert_id))
+
+    identities_path = os.path.join(root, "identities.txt")
+    with open(identities_path, "w") as f:
+        f.write("\n".join(identities))
+    os.environ.update(install_stub_tools(os.path.join(root, "bin"), identities_path, keychain_path, codesign_delay))
+
+    # 直接寫入資料庫：`insert_account` 會觸發 App Store Connect 的帳號配對
+    from apple_cert_manager import database
+    from apple_cert_manager.config import config
+    config.load(env_path)
+    database.initialize_database()
+    conn = sqlite3.connect(config.db_path)
+    conn.executemany(
+        "INSERT INTO accounts (apple_id, issuer_id, key_id, cert_id, created_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+        accounts,
+    )
+    conn.commit()
+    conn.close()
+    return env_path
+
+
+def _stage_summary():
+    from apple_cert_manager import metrics
+    return {
+        name: {
+            "count": stage["count"],
+            "total_seconds": round(stage["total"], 4),
+            "avg_seconds": round(stage["total"] / stage["count"], 4),
+            "subprocess_seconds": round(stage["subprocess_seconds"], 4),
+            "bytes_read": stage["bytes_read"],
+            "bytes_written": stage["bytes_written"],
+            "errors": stage["errors"],
+        }
+        for name, stage in metrics.recorder.summary().items()
+    }
+
+
+def run_scenario(name, func, ipa_count):
+    """執行一個情境，回傳耗時、吞吐量、記憶體與磁碟用量"""
+    from apple_cert_manager import metrics
+    from apple_cert_manager.config import config
+    metrics.recorder.clear()
+    shutil.rmtree(config.ipa_dir_path, ignore_errors=True)
+    os.makedirs(config.ipa_dir_path, exist_ok=True)
+    with DiskMonitor(config.ipa_dir_path) as disk:
+        started = time.perf_counter()
+        succeeded = func()
+        wall = time.perf_counter() - started
+    rss_self, rss_children = _peak_rss()
+    result = {
+        "scenario": name,
+        "ipas": ipa_count,
+        "succeeded": succeeded,
+        "wall_seconds": round(wall, 4),
+        "ipas_per_minute": round(succeeded / wall * 60, 2) if wall else None,
+        "peak_rss_bytes": rss_self,
+        "peak_rss_children_bytes": rss_children,
+        "disk": disk.report(),
+        "stages": _stage_summary(),
+    }
+    print(f"📊 {name}: {succeeded}/{ipa_count} 成功，{wall:.2f} 秒，{result['ipas_per_minute']} IPA/分鐘，"
+          f"磁碟峰值 {disk.peak / 1024 / 1024:.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="⏱ 重簽名吞吐量 benchmark")
+    parser.add_argument("--size-mb", type=float, default=50, help="合成 IPA 未壓縮大小（MB）")
+    parser.add_argument("--files", type=int, default=500, help="資源檔數量")
+    parser.add_argument("--appex", type=int, default=2, help="嵌套 .appex 數量")
+    parser.add_argument("--frameworks", type=int, default=3, help="framework 數量")
+    parser.add_argument("--assetpacks", type=int, default=2, help="OnDemandResources assetpack 數量")
+    parser.add_argument("--compressible", type=float, default=0.5, help="可壓縮內容比例（0~1）")
+    parser.add_argument("--accounts", type=int, default=4, help="批量重簽名的帳號數")
+    parser.add_argument("--workers", type=int, default=4, help="批量重簽名的並行數")
+    parser.add_argument("--repeat", type=int, default=3, help="單一帳號 resign_ipa 的重複次數")
+    parser.add_argument("--signer", choices=("codesign", "python"), default="codesign",
+                        help="簽名方式：假 codesign，或在程式內簽名（macho_signer）")
+    parser.add_argument("--codesign-delay", type=float, default=0.0, help="假 codesign 每次呼叫的延遲（秒）")
+    parser.add_argument("--use-cache", action="store_true", help="允許沿用重簽名產物快取（預設每次都重建）")
+    parser.add_argument("--ipa", help="改用既有的 IPA，而不是產生合成 IPA")
+    parser.add_argument("--env", help="使用既有 .env 與真實的 codesign / security（不建立假環境）")
+    parser.add_argument("--output", default=f"bench-resign-{time.strftime('%Y%m%d-%H%M%S')}.json", help="結果 JSON 路徑")
+    parser.add_argument("--log-level", default="WARNING", help="重簽名過程的日誌等級")
+    args = parser.parse_args()
+
+    from apple_cert_manager.logging_config import configure_logging
+    configure_logging(level=args.log_level.upper())
+
+    with tempfile.TemporaryDirectory(prefix="acm-bench-resign-") as root:
+        ipa_path = args.ipa
+        ipa_info = None
+        if not ipa_path:
+            ipa_path = os.path.join(root, "synthetic.ipa")
+            ipa_info = generate_ipa(
+                ipa_path, size_mb=args.size_mb, file_count=args.files, appex_count=args.appex,
+                framework_count=args.frameworks, assetpack_count=args.assetpacks,
+                compressible_ratio=args.compressible,
+            )
+            print(f"🧪 合成 IPA: {ipa_info['members']} 個檔案，未壓縮 {ipa_info['uncompressed_bytes'] / 1024 / 1024:.1f} MB，"
+                  f"壓縮後 {ipa_info['ipa_bytes'] / 1024 / 1024:.1f} MB")
+
+        from apple_cert_manager.config import config
+        if args.env:
+            config.load(args.env)
+            config.ipa_path = ipa_path
+        else:
+            prepare_synthetic_environment(root, ipa_path, args.accounts, args.codesign_delay, args.signer)
+
+        from apple_cert_manager import apple_accounts, resign_ipa
+        apple_ids = [account["apple_id"] for account in apple_accounts.get_accounts() if account["cert_id"]]
+        if not apple_ids:
+            raise SystemExit("❌ 沒有可用來重簽名的帳號（需要已有 cert_id）")
+
+        def single():
+            succeeded = 0
+            for _ in range(args.repeat):
+                try:
+                    resign_ipa.resign_ipa(apple_ids[0], force=not args.use_cache)
+                    succeeded += 1
+                except Exception as e:
+                    logging.getLogger(__name__).error(f"❌ resign_ipa 失敗: {e}")
+            return succeeded
+
+        def batch():
+            results = resign_ipa.batch_resign_all_accounts(max_workers=args.workers, force=not args.use_cache)
+            return sum(1 for _, result in results if result)
+
+        results = [
+            run_scenario("resign_ipa", single, args.repeat),
+            run_scenario("batch_resign_all_accounts", batch, len(apple_ids)),
+        ]
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stub_tools": not args.env,
+        },
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "log_level")},
+        "ipa": ipa_info,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ 結果已寫入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
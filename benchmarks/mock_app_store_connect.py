@@ -0,0 +1,390 @@
+"""🎭 本地 App Store Connect 替身伺服器
+
+實作 `/v1/certificates`、`/v1/devices`、`/v1/bundleIds`、`/v1/profiles` 流程會用到的部分，
+資料依 JWT 的 `iss`（Issuer ID）分開存放，等同每個帳號一個 team。可調整：
+
+- 延遲：每個請求固定延遲加上隨機抖動
+- 分頁：列表的每頁筆數（回應帶 `links.next`，也接受 `limit` 參數）
+- 速率限制：每個 team 每小時的請求上限，回應帶 `X-Rate-Limit`，超過時回 429
+- 錯誤注入：依比例回 500 / 503
+
+並統計總請求數、各端點次數與同時處理中的請求數（達到的並行度）。
+
+    python3 -m benchmarks.mock_app_store_connect --port 9000 --latency 0.05
+    # .env: APP_STORE_CONNECT_API_URL="http://127.0.0.1:9000/v1"
+"""
+import argparse
+import base64
+import json
+import plistlib
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from benchmarks.stub_tools import wrap_unsigned_cms
+
+# App Store Connect 列表的 `limit` 上限
+MAX_PAGE_LIMIT = 200
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000%z"
+RESOURCES = ("certificates", "devices", "bundleIds", "profiles")
+
+
+def _expiration(days):
+    return (datetime.now(timezone.utc) + timedelta(days=days)).strftime(DATE_FORMAT)
+
+
+_issuer_key = None
+_issuer_lock = threading.Lock()
+
+def _issue_certificate(csr_content, validity_days=365):
+    """以替身 CA 簽發 CSR 的憑證（DER），讓流程能以真正的私鑰與憑證組成 PKCS#12；CSR 無法解析時回傳隨機內容"""
+    global _issuer_key
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.x509.oid import NameOID
+    try:
+        csr = x509.load_der_x509_csr(base64.b64decode(csr_content or ""))
+    except ValueError:
+        return random.randbytes(1024)
+    with _issuer_lock:
+        if _issuer_key is None:
+            _issuer_key = ec.generate_private_key(ec.SECP256R1())
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(csr.subject)
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Mock WWDR CA")]))
+        .public_key(csr.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=validity_days))
+        .sign(_issuer_key, hashes.SHA256())
+    )
+    return certificate.public_bytes(Encoding.DER)
+
+
+def _issuer_from_token(authorization):
+    """只解出 JWT payload 的 `iss`，不驗證簽章"""
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+    try:
+        payload = authorization[len("Bearer "):].split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("iss")
+    except (IndexError, ValueError):
+        return None
+
+
+class Team:
+    """一個 team 的資源與速率限制計數"""
+
+    def __init__(self):
+        self.resources = {name: {} for name in RESOURCES}
+        self.window_start = time.time()
+        self.window_requests = 0
+
+    def add(self, resource, attributes, resource_id=None):
+        resource_id = resource_id or uuid.uuid4().hex[:10].upper()
+        item = {"type": resource, "id": resource_id, "attributes": attributes}
+        self.resources[resource][resource_id] = item
+        return item
+
+
+class MockAppStoreConnect(ThreadingHTTPServer):
+    """🎭 替身伺服器；`port=0` 時自動挑選可用的埠"""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, page_size=MAX_PAGE_LIMIT,
+                 rate_limit=0, error_rate=0.0, devices_per_team=3, seed=0):
+        super().__init__((host, port), _MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.devices_per_team = devices_per_team
+        # 新憑證的有效天數（量測換發時可以調長，讓換發後的憑證落在模擬期間之外）
+        self.certificate_validity_days = 365
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.teams = {}
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def team(self, issuer_id):
+        with self.lock:
+            team = self.teams.get(issuer_id)
+            if team is None:
+                team = self.teams[issuer_id] = Team()
+                for i in range(self.devices_per_team):
+                    team.add("devices", {"name": f"Seed Device {i}", "udid": f"seed-{issuer_id}-{i}",
+                                         "platform": "IOS", "status": "ENABLED"})
+                # 真實帳號至少會有一個 App ID，流程中的 `list_all_bundle_ids` 在沒有任何 Bundle ID 時會失敗
+                team.add("bundleIds", {"identifier": "com.example.seed", "name": "Seed", "platform": "IOS"})
+            return team
+
+    def seed_certificates(self, issuer_id, count, expired=False, certificate_type="IOS_DISTRIBUTION"):
+        """預先建立憑證（例如已過期的憑證，用來量測撤銷流程）"""
+        team = self.team(issuer_id)
+        with self.lock:
+            for i in range(count):
+                team.add("certificates", {
+                    "name": f"Seed Certificate {i}",
+                    "certificateType": certificate_type,
+                    "expirationDate": _expiration(-1 if expired else 365),
+                    "certificateContent": base64.b64encode(self.random.randbytes(512)).decode(),
+                })
+
+    def seed_profiles(self, issuer_id, count, expired=False):
+        """預先建立描述檔（例如已過期的描述檔，用來量測清理流程）"""
+        team = self.team(issuer_id)
+        with self.lock:
+            for i in range(count):
+                team.add("profiles", {
+                    "name": f"Seed Profile {i}",
+                    "profileType": "IOS_APP_ADHOC",
+                    "profileState": "EXPIRED" if expired else "ACTIVE",
+                    "expirationDate": _expiration(-1 if expired else 365),
+                })
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.endpoints = {}
+            self.statuses = {}
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.busy_seconds = 0.0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "endpoints": dict(self.endpoints),
+                "statuses": {str(status): count for status, count in self.statuses.items()},
+                "max_in_flight": self.max_in_flight,
+                "busy_seconds": round(self.busy_seconds, 4),
+            }
+
+    def _begin(self, endpoint):
+        with self.lock:
+            self.requests += 1
+            self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _end(self, status, seconds):
+        with self.lock:
+            self.in_flight -= 1
+            self.busy_seconds += seconds
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def _consume_rate_limit(self, team):
+        """回傳 (是否允許, 剩餘次數)；未設定上限時永遠允許"""
+        if not self.rate_limit:
+            return True, None
+        with self.lock:
+            if time.time() - team.window_start >= 3600:
+                team.window_start, team.window_requests = time.time(), 0
+            team.window_requests += 1
+            return team.window_requests <= self.rate_limit, max(0, self.rate_limit - team.window_requests)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return status
+
+    def _error(self, status, title, detail, headers=None):
+        return self._send(status, {"errors": [{"status": str(status), "title": title, "detail": detail}]}, headers)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _handle(self, method):
+        server = self.server
+        split = urlsplit(self.path)
+        parts = [part for part in split.path.strip("/").split("/") if part]
+        resource = parts[1] if len(parts) >= 2 and parts[0] == "v1" else None
+        endpoint = f"{method} /v1/{resource}" + ("/{id}" if len(parts) > 2 else "")
+        server._begin(endpoint)
+        started = time.perf_counter()
+        status = 500
+        try:
+            delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+            if delay:
+                time.sleep(delay)
+            status = self._dispatch(method, resource, parts[2:], parse_qs(split.query))
+        finally:
+            server._end(status, time.perf_counter() - started)
+
+    def _dispatch(self, method, resource, rest, query):
+        server = self.server
+        if resource not in RESOURCES:
+            return self._error(404, "NOT_FOUND", f"未支援的資源: {self.path}")
+        issuer_id = _issuer_from_token(self.headers.get("Authorization"))
+        if not issuer_id:
+            return self._error(401, "NOT_AUTHORIZED", "缺少或無效的 Bearer token")
+        team = server.team(issuer_id)
+        allowed, remaining = server._consume_rate_limit(team)
+        headers = {}
+        if remaining is not None:
+            headers["X-Rate-Limit"] = f"user-hour-lim:{server.rate_limit};user-hour-rem:{remaining};"
+        if not allowed:
+            return self._error(429, "RATE_LIMIT_EXCEEDED", "已超過每小時請求上限", headers)
+        if server.error_rate and server.random.random() < server.error_rate:
+            status = server.random.choice((500, 503))
+            return self._error(status, "INJECTED_ERROR", "替身伺服器注入的錯誤", headers)
+
+        if method == "GET" and not rest:
+            return self._list(team, resource, query, headers)
+        if method == "POST" and not rest:
+            return self._create(team, resource, self._read_json(), headers)
+        if method in ("DELETE", "PATCH") and len(rest) == 1:
+            with server.lock:
+                item = team.resources[resource].get(rest[0])
+                if item and method == "DELETE":
+                    del team.resources[resource][rest[0]]
+                elif item:
+                    item["attributes"].update(self._read_json().get("data", {}).get("attributes", {}))
+            if not item:
+                return self._error(404, "NOT_FOUND", f"找不到 {resource}/{rest[0]}", headers)
+            return self._send(204, headers=headers) if method == "DELETE" else self._send(200, {"data": item}, headers)
+        return self._error(405, "METHOD_NOT_ALLOWED", f"{method} {self.path}", headers)
+
+    def _list(self, team, resource, query, headers):
+        with self.server.lock:
+            items = list(team.resources[resource].values())
+        for key, values in query.items():
+            if key.startswith("filter[") and key.endswith("]"):
+                field = key[len("filter["):-1]
+                accepted = set(",".join(values).split(","))
+                items = [item for item in items if str(item["attributes"].get(field)) in accepted]
+        limit = min(int(query.get("limit", [self.server.page_size])[0]), MAX_PAGE_LIMIT)
+        cursor = int(query.get("cursor", ["0"])[0])
+        page = items[cursor:cursor + limit]
+        links = {"self": f"{self.server.base_url}/{resource}"}
+        if cursor + limit < len(items):
+            params = {key: ",".join(values) for key, values in query.items() if key != "cursor"}
+            params.update(cursor=cursor + limit, limit=limit)
+            links["next"] = f"{self.server.base_url}/{resource}?{urlencode(params)}"
+        body = {"data": page, "links": links, "meta": {"paging": {"total": len(items), "limit": limit}}}
+        return self._send(200, body, headers)
+
+    def _create(self, team, resource, body, headers):
+        attributes = dict(body.get("data", {}).get("attributes", {}))
+        server = self.server
+        with server.lock:
+            if resource == "devices":
+                if any(item["attributes"]["udid"] == attributes.get("udid") for item in team.resources["devices"].values()):
+                    conflict = True
+                else:
+                    conflict = False
+                    attributes.setdefault("status", "ENABLED")
+                    item = team.add("devices", attributes)
+            elif resource == "certificates":
+                conflict = False
+                csr_content = attributes.pop("csrContent", None)
+                attributes.update(
+                    name=f"iOS Distribution {len(team.resources['certificates']) + 1}",
+                    expirationDate=_expiration(self.server.certificate_validity_days),
+                    certificateContent=base64.b64encode(
+                        _issue_certificate(csr_content, self.server.certificate_validity_days)
+                    ).decode(),
+                )
+                item = team.add("certificates", attributes)
+            elif resource == "bundleIds":
+                conflict = any(item["attributes"]["identifier"] == attributes.get("identifier")
+                               for item in team.resources["bundleIds"].values())
+                if not conflict:
+                    item = team.add("bundleIds", attributes)
+            else:
+                conflict = False
+                relationships = body.get("data", {}).get("relationships", {})
+                device_ids = [device["id"] for device in relationships.get("devices", {}).get("data", [])]
+                profile = wrap_unsigned_cms(plistlib.dumps({
+                    "Name": attributes.get("name"),
+                    "ProvisionedDevices": device_ids,
+                    "Entitlements": {"application-identifier": "MOCKTEAM.*", "get-task-allow": False},
+                    "ExpirationDate": datetime.now(timezone.utc) + timedelta(days=365),
+                }))
+                attributes.update(profileState="ACTIVE", expirationDate=_expiration(365),
+                                  profileContent=base64.b64encode(profile).decode())
+                item = team.add("profiles", attributes)
+        if conflict:
+            detail = f"A {resource[:-1]} with this identifier already exists on this team."
+            return self._error(409, "ENTITY_ERROR.ATTRIBUTE.INVALID", detail, headers)
+        return self._send(201, {"data": item}, headers)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+
+def start_mock_server(**kwargs):
+    """在背景執行緒啟動替身伺服器並回傳"""
+    server = MockAppStoreConnect(**kwargs)
+    threading.Thread(target=server.serve_forever, name="mock-asc", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="🎭 App Store Connect 替身伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的固定延遲（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="額外的隨機延遲上限（秒）")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_LIMIT, help="列表每頁筆數")
+    parser.add_argument("--rate-limit", type=int, default=0, help="每個 team 每小時的請求上限（0 為不限制）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 500 / 503 的比例（0~1）")
+    parser.add_argument("--devices", type=int, default=3, help="每個 team 預設的裝置數")
+    args = parser.parse_args()
+
+    server = MockAppStoreConnect(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                                 page_size=args.page_size, rate_limit=args.rate_limit,
+                                 error_rate=args.error_rate, devices_per_team=args.devices)
+    print(f"🎭 替身伺服器已啟動: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
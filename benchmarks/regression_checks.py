@@ -0,0 +1,118 @@
+"""✅ 回歸檢查：以替身伺服器 / 假執行後端（runner.FakeBackend）重現曾經出錯的情況，任何檢查失敗時以非零狀態結束
+
+    python3 -m benchmarks.regression_checks
+    python3 -m benchmarks.regression_checks --only http_retry_exhausted
+"""
+import argparse
+import base64
+import json
+import os
+import sqlite3
+import tempfile
+import traceback
+
+from benchmarks.mock_app_store_connect import start_mock_server
+
+
+def _bearer(issuer_id):
+    """替身伺服器只解出 payload 的 `iss`，不驗證簽章"""
+    def segment(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).rstrip(b"=").decode("ascii")
+    return f"Bearer {segment({'alg': 'ES256', 'kid': 'CHECK'})}.{segment({'iss': issuer_id})}.sig"
+
+
+def check_http_retry_exhausted():
+    """伺服器一直回 503、重試用盡時，端點統計仍要記到 urllib3 的重試次數"""
+    import requests
+    from apple_cert_manager import metrics
+    from apple_cert_manager.http_client import HttpClient
+
+    retries = 3
+    server = start_mock_server(error_rate=1.0)
+    try:
+        client = HttpClient(timeout=5, retries=retries, backoff_factor=0)
+        metrics.http_metrics.clear()
+        try:
+            client.get(f"{server.base_url}/certificates", headers={"Authorization": _bearer("check-issuer")})
+        except requests.exceptions.RequestException:
+            pass
+        else:
+            raise AssertionError("伺服器一直回 503，請求應該失敗")
+        entry = metrics.http_metrics.snapshot()["GET /v1/certificates"]
+        hits = server.stats()["requests"]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert hits == retries + 1, f"伺服器收到 {hits} 次，預期 {retries + 1} 次"
+    assert entry["calls"] == 1, f"端點呼叫數 {entry['calls']}，預期 1"
+    assert entry["retries"] == retries, f"端點重試數 {entry['retries']}，預期 {retries}"
+    assert entry["statuses"] == {"error": 1}, f"端點狀態 {entry['statuses']}，預期 {{'error': 1}}"
+
+
+def check_remove_identity_without_private_key():
+    """Keychain 中找不到私鑰時，只移除分片紀錄，不執行 `security delete-identity`"""
+    from apple_cert_manager import certificate, keychain_shards, runner
+    from apple_cert_manager.config import config
+
+    cert_id = "CHECKCERT01"
+    saved = {name: getattr(config, name) for name in
+             ("db_path", "keychain_path", "keychain_password", "cert_dir_path", "keychain_shards", "identity_backend")}
+    fake = runner.FakeBackend()
+    fake.register("openssl", lambda command, cwd, input: (0, b"subject=CN = Apple Distribution: Check (TEAM123456)\n", b""))
+    fake.register("security find-identity", lambda command, cwd, input: (0, b"     0 valid identities found\n", b""))
+    with tempfile.TemporaryDirectory(prefix="acm-check-") as root:
+        try:
+            config.db_path = os.path.join(root, "apple_account.sqlite")
+            config.keychain_path = os.path.join(root, "check.keychain-db")
+            config.keychain_password = "0000"
+            config.cert_dir_path = root
+            config.keychain_shards = 2
+            config.identity_backend = "keychain"
+            keychain_shards._table_ready = False
+            open(config.keychain_path, "wb").close()
+            open(certificate.get_cert_path(cert_id), "wb").close()
+            keychain_shards.assign(cert_id)
+
+            with runner.use_backend(fake):
+                certificate.remove_keychain_certificate_by_id(cert_id)
+
+            conn = sqlite3.connect(config.db_path)
+            try:
+                row = conn.execute("SELECT shard FROM keychain_shards WHERE cert_id = ?", (cert_id,)).fetchone()
+            finally:
+                conn.close()
+        finally:
+            for name, value in saved.items():
+                setattr(config, name, value)
+            keychain_shards._table_ready = False
+    deletes = [command for command in fake.calls if command[:2] == ["security", "delete-identity"]]
+    assert not deletes, f"找不到私鑰時不應執行 delete-identity: {deletes}"
+    assert row is None, f"分片紀錄應被移除，仍在分片 {row[0]}"
+
+
+CHECKS = {
+    "http_retry_exhausted": check_http_retry_exhausted,
+    "remove_identity_without_private_key": check_remove_identity_without_private_key,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回歸檢查")
+    parser.add_argument("--only", choices=sorted(CHECKS), action="append", help="只執行指定的檢查（可重複）")
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.only or CHECKS:
+        try:
+            CHECKS[name]()
+            print(f"✅ {name}")
+        except Exception:
+            failed.append(name)
+            print(f"❌ {name}")
+            traceback.print_exc()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""🧪 假的 `codesign` / `security`
+
+放到 PATH 最前面，讓重簽名流程在沒有 macOS 工具（或不想動到真實鑰匙圈）的機器上也能完整跑完。
+行為只做到流程需要的程度：
+
+- `security find-identity`：列出 `ACM_STUB_IDENTITIES` 檔案內的 SHA-1
+- `security cms -D -i <path>`：直接輸出檔案內容（重簽名流程已改在程式內解析描述檔，不會再呼叫）
+- `security list-keychains`：輸出 `ACM_STUB_KEYCHAIN`
+- `security find-certificate`：回報已安裝 WWDR 憑證（避免下載）
+- `security create-keychain`：建立空檔案（Keychain 分片存在後就不會再重建）
+- `codesign ... <path>`：在目錄內寫入 `_CodeSignature/CodeResources`，可用 `ACM_STUB_CODESIGN_DELAY` 模擬耗時
+"""
+import os
+import stat
+import sys
+
+_SECURITY = r'''#!{python}
+import os, sys
+args = sys.argv[1:]
+command = args[0] if args else ""
+if command == "find-identity":
+    path = os.environ.get("ACM_STUB_IDENTITIES")
+    identities = open(path).read().split() if path and os.path.exists(path) else []
+    for index, sha1 in enumerate(identities, 1):
+        print(f'  {{index}}) {{sha1}} "Apple Distribution: Bench ({{index}})"')
+    print(f"     {{len(identities)}} valid identities found")
+elif command == "cms":
+    path = args[args.index("-i") + 1]
+    with open(path, "rb") as f:
+        sys.stdout.buffer.write(f.read())
+elif command == "list-keychains":
+    if "-s" not in args:
+        print(f'    "{{os.environ.get("ACM_STUB_KEYCHAIN", "login.keychain-db")}}"')
+elif command == "create-keychain":
+    open(args[-1], "ab").close()
+elif command == "find-certificate":
+    print('keychain: "stub"\n    "labl"<blob>="Apple Worldwide Developer Relations Certification Authority"')
+'''
+
+_CODESIGN = r'''#!{python}
+import os, sys, time
+delay = float(os.environ.get("ACM_STUB_CODESIGN_DELAY") or 0)
+if delay:
+    time.sleep(delay)
+target = sys.argv[-1]
+if os.path.isdir(target):
+    signature_dir = os.path.join(target, "_CodeSignature")
+    os.makedirs(signature_dir, exist_ok=True)
+    with open(os.path.join(signature_dir, "CodeResources"), "w") as f:
+        f.write("<?xml version=\"1.0\" encoding=\"UTF-8\"?><plist version=\"1.0\"><dict/></plist>\n")
+'''
+
+
+def _der(tag, content):
+    length = len(content)
+    if length < 0x80:
+        encoded_length = bytes([length])
+    else:
+        size = (length.bit_length() + 7) // 8
+        encoded_length = bytes([0x80 | size]) + length.to_bytes(size, "big")
+    return bytes([tag]) + encoded_length + content
+
+
+def wrap_unsigned_cms(content):
+    """把 plist 包成沒有簽署者的 CMS SignedData（結構與真正的 .mobileprovision 相同）"""
+    oid_signed_data = _der(0x06, bytes.fromhex("2a864886f70d010702"))
+    oid_data = _der(0x06, bytes.fromhex("2a864886f70d010701"))
+    encap_content_info = _der(0x30, oid_data + _der(0xA0, _der(0x04, content)))
+    signed_data = _der(0x30, _der(0x02, b"\x01") + _der(0x31, b"") + encap_content_info + _der(0x31, b""))
+    return _der(0x30, oid_signed_data + _der(0xA0, signed_data))
+
+def install_stub_tools(bin_dir, identities_path, keychain_path, codesign_delay=0.0):
+    """寫出假工具並回傳要套用的環境變數（PATH 已把 bin_dir 放在最前面）"""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, template in (("security", _SECURITY), ("codesign", _CODESIGN)):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write(template.format(python=sys.executable))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return {
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "ACM_STUB_IDENTITIES": identities_path,
+        "ACM_STUB_KEYCHAIN": keychain_path,
+        "ACM_STUB_CODESIGN_DELAY": str(codesign_delay),
+    }
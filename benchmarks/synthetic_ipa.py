@@ -0,0 +1,123 @@
+"""🧪 產生測試用的合成 IPA
+
+結構比照真實 App：主程式、嵌套的 `.appex`、`Frameworks/*.framework`、
+`OnDemandResources/*.assetpack`，以及大量資源檔。可調整總大小與可壓縮比例。
+"""
+import os
+import plistlib
+import random
+import struct
+import zipfile
+
+# 64 位元 arm64 Mach-O 標頭（只用來讓檔案看起來像執行檔，內容不會被執行）
+MACHO_MAGIC_64 = 0xFEEDFACF
+CPU_TYPE_ARM64 = 0x0100000C
+MH_EXECUTE = 0x2
+MH_DYLIB = 0x6
+LC_SEGMENT_64 = 0x19
+MACHO_PAGE_SIZE = 0x4000
+
+
+def _segment(name, vmaddr, fileoff, filesize, sections=()):
+    command = struct.pack("<II16sQQQQiiII", LC_SEGMENT_64, 72 + 80 * len(sections), name.encode(),
+                          vmaddr, _page_align(filesize), fileoff, filesize, 5, 5, len(sections), 0)
+    for sectname, offset, size in sections:
+        command += struct.pack("<16s16sQQIIIIIIII", sectname.encode(), name.encode(),
+                               vmaddr + offset, size, offset, 2, 0, 0, 0x80000400, 0, 0, 0)
+    return command
+
+
+def _page_align(value):
+    return (value + MACHO_PAGE_SIZE - 1) // MACHO_PAGE_SIZE * MACHO_PAGE_SIZE
+
+
+def _macho_bytes(size, filetype, rng):
+    """最小但結構完整的 arm64 Mach-O（__TEXT + __LINKEDIT），可以實際加入簽名"""
+    text_size = _page_align(max(size, MACHO_PAGE_SIZE * 2))
+    code_size = text_size - MACHO_PAGE_SIZE
+    linkedit_size = 64
+    commands = (_segment("__TEXT", 0x100000000, 0, text_size, [("__text", MACHO_PAGE_SIZE, code_size)])
+                + _segment("__LINKEDIT", 0x100000000 + text_size, text_size, linkedit_size))
+    header = struct.pack("<IiiIIIII", MACHO_MAGIC_64, CPU_TYPE_ARM64, 0, filetype, 2, len(commands), 0, 0)
+    padding = b"\0" * (MACHO_PAGE_SIZE - len(header) - len(commands))
+    return header + commands + padding + rng.randbytes(code_size) + rng.randbytes(linkedit_size)
+
+
+def _payload_bytes(size, compressible_ratio, rng):
+    """前段隨機（不可壓縮），後段重複內容（可壓縮）"""
+    random_part = int(size * (1 - compressible_ratio))
+    repeated = b"AppleCertManager synthetic resource\n"
+    filler = (repeated * (size // len(repeated) + 1))[:size - random_part]
+    return rng.randbytes(random_part) + filler
+
+
+def _info_plist(bundle_id, executable, package_type="APPL"):
+    return plistlib.dumps({
+        "CFBundleIdentifier": bundle_id,
+        "CFBundleExecutable": executable,
+        "CFBundleName": executable,
+        "CFBundlePackageType": package_type,
+        "CFBundleShortVersionString": "1.0",
+        "CFBundleVersion": "1",
+    })
+
+
+def generate_ipa(output_path, size_mb=50, file_count=500, appex_count=2, framework_count=3,
+                 assetpack_count=2, compressible_ratio=0.5, seed=0, bundle_id="com.bench.app"):
+    """產生合成 IPA，回傳實際寫入的成員數與未壓縮大小
+
+    Args:
+        output_path (str): 輸出的 `.ipa` 路徑。
+        size_mb (float): 未壓縮內容的總大小（MB）。
+        file_count (int): 主程式內的資源檔數量。
+        appex_count (int): 嵌套 `.appex` 數量。
+        framework_count (int): `Frameworks/*.framework` 數量。
+        assetpack_count (int): `OnDemandResources/*.assetpack` 數量。
+        compressible_ratio (float): 每個檔案可壓縮內容的比例（0~1）。
+        seed (int): 亂數種子，相同參數會產生相同內容。
+    """
+    rng = random.Random(seed)
+    total = int(size_mb * 1024 * 1024)
+    app = "Payload/Bench.app"
+
+    # 📐 大小分配：主程式 30%、framework 25%、appex 10%、assetpack 10%、其餘為資源檔
+    main_binary = int(total * 0.30)
+    framework_size = int(total * 0.25 / framework_count) if framework_count else 0
+    appex_size = int(total * 0.10 / appex_count) if appex_count else 0
+    assetpack_size = int(total * 0.10 / assetpack_count) if assetpack_count else 0
+    used = main_binary + framework_size * framework_count + appex_size * appex_count + assetpack_size * assetpack_count
+    resource_size = max(1, (total - used) // max(1, file_count))
+
+    def members():
+        # 逐一產生，避免大 IPA 整包放在記憶體裡
+        yield f"{app}/Info.plist", _info_plist(bundle_id, "Bench")
+        yield f"{app}/Bench", _macho_bytes(main_binary, MH_EXECUTE, rng)
+        yield f"{app}/_CodeSignature/CodeResources", plistlib.dumps({"files": {}})
+        yield f"{app}/embedded.mobileprovision", rng.randbytes(8 * 1024)
+        for i in range(appex_count):
+            appex = f"{app}/PlugIns/Extension{i}.appex"
+            yield f"{appex}/Info.plist", _info_plist(f"{bundle_id}.ext{i}", f"Extension{i}", "XPC!")
+            yield f"{appex}/Extension{i}", _macho_bytes(appex_size, MH_EXECUTE, rng)
+            yield f"{appex}/_CodeSignature/CodeResources", plistlib.dumps({"files": {}})
+        for i in range(framework_count):
+            framework = f"{app}/Frameworks/Lib{i}.framework"
+            yield f"{framework}/Info.plist", _info_plist(f"{bundle_id}.lib{i}", f"Lib{i}", "FMWK")
+            yield f"{framework}/Lib{i}", _macho_bytes(framework_size, MH_DYLIB, rng)
+            yield f"{framework}/_CodeSignature/CodeResources", plistlib.dumps({"files": {}})
+        for i in range(assetpack_count):
+            assetpack = f"Payload/OnDemandResources/{bundle_id}.tag{i}.assetpack"
+            yield f"{assetpack}/Info.plist", _info_plist(f"{bundle_id}.asset{i}", f"Asset{i}", "BNDL")
+            yield f"{assetpack}/data.bin", _payload_bytes(assetpack_size, compressible_ratio, rng)
+        for i in range(file_count):
+            extension = (".png", ".car", ".json", ".strings", ".nib")[i % 5]
+            yield (f"{app}/Resources/{i // 100:03d}/res{i}{extension}",
+                   _payload_bytes(resource_size, compressible_ratio, rng))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    count = uncompressed = 0
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        for name, data in members():
+            zf.writestr(name, data)
+            count += 1
+            uncompressed += len(data)
+    return {"members": count, "uncompressed_bytes": uncompressed, "ipa_bytes": os.path.getsize(output_path)}
@@ -0,0 +1,102 @@
+"""🚀 CLI 啟動效能檢查
+
+用 `python -X importtime` 執行 `cli.py query`，統計 import 耗時，
+並確認查詢類指令不會載入網路 / JWT 相關套件。超出預算或載入禁止的套件時以非 0 結束，
+可直接放進 CI 抓出啟動時間的退化。
+
+    python3 scripts/bench_startup.py --budget-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(REPO_ROOT, "scripts", "cli.py")
+
+# 📌 `query` 只需要 SQLite，以下套件出現代表又被提早載入了
+FORBIDDEN_MODULES = ("requests", "urllib3", "jwt", "cryptography")
+
+ENV_TEMPLATE = """ROOT_DIR="{root}"
+BUNDLE_ID="com.example"
+KEYCHAIN_PATH="{root}/bench.keychain-db"
+KEYCHAIN_PASSWORD="0000"
+API_KEY_DIR_PATH="{root}/api_key"
+DB_PATH="{root}/apple_account.sqlite"
+CERT_DIR_PATH="{root}/certs"
+PROFILE_DIR_PATH="{root}/profiles"
+IPA_DIR_PATH="{root}/ipa"
+IPA_PATH="{root}/app.ipa"
+JSON_PATH="{root}/accounts.json"
+"""
+
+
+def parse_importtime(stderr):
+    """解析 `-X importtime` 輸出，回傳 {模組: (self_us, cumulative_us)}"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return modules
+
+
+def run_importtime(argv):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *argv],
+        capture_output=True, text=True, env=env, cwd=REPO_ROOT, timeout=60,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"執行失敗: {result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def measure(command_args, root, baseline):
+    """只計算直譯器本身（site 等）以外、由 cli.py 帶進來的模組"""
+    env_path = os.path.join(root, ".env")
+    modules = run_importtime([CLI_PATH, "--env", env_path, "--no-daemon", *command_args])
+    return {name: times for name, times in modules.items() if name not in baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="📏 量測 cli.py 的 import 耗時")
+    parser.add_argument("--budget-ms", type=float, default=150, help="query 指令的 import 總耗時上限（毫秒）")
+    parser.add_argument("--runs", type=int, default=3, help="量測次數，取最小值以降低雜訊")
+    parser.add_argument("--top", type=int, default=10, help="列出最耗時的前 N 個模組")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="acm-bench-") as root:
+        with open(os.path.join(root, ".env"), "w") as f:
+            f.write(ENV_TEMPLATE.format(root=root))
+        baseline = run_importtime(["-c", "pass"])
+        runs = [measure(["query"], root, baseline) for _ in range(args.runs)]
+
+    best = min(runs, key=lambda modules: sum(v[0] for v in modules.values()))
+    total_ms = sum(self_us for self_us, _ in best.values()) / 1000
+    print(f"📦 cli.py 額外載入模組數: {len(best)}，import 總耗時: {total_ms:.1f} ms（預算 {args.budget_ms:.0f} ms）")
+    print("🐢 最耗時的頂層模組 (cumulative):")
+    top_level = {name: times for name, times in best.items() if "." not in name}
+    for name, (_, cumulative_us) in sorted(top_level.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    leaked = [name for name in FORBIDDEN_MODULES if name in best]
+    if leaked:
+        print(f"❌ query 不應載入: {', '.join(leaked)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"❌ import 總耗時 {total_ms:.1f} ms 超過預算 {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("✅ 啟動效能檢查通過")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
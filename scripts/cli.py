@@ -1,23 +1,71 @@
 import argparse
+import importlib
+import logging
+import os
 from apple_cert_manager.config import config
+from apple_cert_manager.logging_config import LOG_FORMATS, configure_logging
 
 
-def load_modules():
-    """📌 動態加載模組，確保 `.env` 先載入"""
-    global insert_account, delete_account, query_accounts, insert_from_json
-    global register_device_and_resign
-    global resign_ipa, batch_resign_all_accounts, resign_single_account
-    global revoke_expired_certificates, revoke_certificate
+# 📌 每個指令只載入自己需要的模組（例如 `query` 只需要 SQLite，不必載入 requests / jwt / rich）
+COMMAND_HANDLERS = {
+    "add": ("apple_cert_manager.apple_accounts", "insert_account"),
+    "delete": ("apple_cert_manager.apple_accounts", "delete_account"),
+    "query": ("apple_cert_manager.apple_accounts", "query_accounts"),
+    "import": ("apple_cert_manager.apple_accounts", "insert_from_json"),
+    "register_device": ("apple_cert_manager.register_device_and_resign", "register_device_and_resign"),
+    "resign_single": ("apple_cert_manager.resign_ipa", "resign_single_account"),
+    "resign_batch": ("apple_cert_manager.resign_ipa", "batch_resign_all_accounts"),
+    "resign_matrix": ("apple_cert_manager.resign_matrix", "run_matrix"),
+    "revoke_expired_cert": ("apple_cert_manager.revoke_expired_cert", "revoke_expired_certificates"),
+    "cleanup_profiles": ("apple_cert_manager.profile", "cleanup_all_profiles"),
+    "plan_rotation": ("apple_cert_manager.rotation", "show_rotation_plan"),
+    "rotate_certs": ("apple_cert_manager.rotation", "rotate_certs"),
+    "revoke_cert": ("apple_cert_manager.revoke_expired_cert", "revoke_certificate"),
+    "gc_artifacts": ("apple_cert_manager.artifact_store", "gc"),
+    "inspect_profile": ("apple_cert_manager.mobileprovision", "describe"),
+    "inspect_signature": ("apple_cert_manager.macho_signer", "inspect"),
+}
 
-    from apple_cert_manager.apple_accounts import (
-        insert_account,
-        delete_account,
-        query_accounts,
-        insert_from_json,
-    )
-    from apple_cert_manager.register_device_and_resign import register_device_and_resign
-    from apple_cert_manager.resign_ipa import resign_ipa, batch_resign_all_accounts, resign_single_account
-    from apple_cert_manager.revoke_expired_cert import revoke_expired_certificates, revoke_certificate
+def load_handler(name):
+    """📌 動態加載指令對應的函數，確保 `.env` 先載入"""
+    module_name, func_name = COMMAND_HANDLERS[name]
+    module = importlib.import_module(module_name)
+    return getattr(module, func_name)
+
+# 📌 可以交給常駐服務執行的指令（revoke_cert 需要互動輸入，只能在本地執行）
+DAEMON_FORWARD_COMMANDS = {
+    "add", "delete", "query", "import", "register_device", "resign", "revoke_expired_cert",
+    "rotate_certs", "plan_rotation",
+}
+
+def forward_to_daemon(args):
+    """📨 常駐服務執行中時，把指令交給常駐服務執行（CLI 變成輕量 client）"""
+    if args.no_daemon or args.command not in DAEMON_FORWARD_COMMANDS:
+        return False
+    # socket 檔案不存在就不必載入 daemon 模組
+    if not config.daemon_socket_path or not os.path.exists(config.daemon_socket_path):
+        return False
+
+    from apple_cert_manager import daemon
+    if not daemon.is_daemon_running():
+        return False
+
+    command_args = {key: value for key, value in vars(args).items() if key not in ("env", "command", "no_daemon", "log_format", "log_level", "metrics_out")}
+    print(f"📨 交由常駐服務執行: {args.command}")
+    response = daemon.send_command(args.command, command_args)
+    if not response.get("ok"):
+        print(f"❌ 常駐服務執行失敗: {response.get('error')}")
+        raise SystemExit(1)
+
+    result = response.get("result")
+    if args.command == "query":
+        if not result:
+            print("⚠️ 沒有任何帳戶資料")
+        for account in result or []:
+            print(f"📜 Apple ID: {account['apple_id']}, Issuer ID: {account['issuer_id']}, Key ID: {account['key_id']}, Cert ID: {account['cert_id'] or '❌ 無憑證'}, Created At: {account['created_at'] or 'N/A'}")
+    elif result is not None:
+        print(f"✅ 完成: {result}")
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description="🔧 Apple 開發者帳號與憑證管理工具")
@@ -26,6 +74,18 @@ def main():
     parser.add_argument(
         "--env", type=str, required=True, help="⚠️ 必須指定 `.env` 檔案"
     )
+    parser.add_argument(
+        "--no-daemon", action="store_true", help="不使用常駐服務，直接在本地執行指令"
+    )
+    parser.add_argument(
+        "--log-format", choices=LOG_FORMATS, default="rich", help="日誌格式：rich（彩色）或 json（一行一筆，輸出到 stderr）"
+    )
+    parser.add_argument(
+        "--metrics-out", type=str, default=None, help="指令結束後匯出各階段耗時（.prom 為 Prometheus 格式，其餘為 JSON lines）"
+    )
+    parser.add_argument(
+        "--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], type=str.upper, help="日誌等級"
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="可用指令")
 
@@ -56,52 +116,164 @@ def main():
     parser_resign.add_argument(
         "apple_id", nargs="?", default=None, help="Apple ID (Email)，可選。若不提供，則批量重簽所有帳號"
     )
+    parser_resign.add_argument(
+        "--force", action="store_true", help="忽略快取，即使輸入未變更也重新簽名"
+    )
+    parser_resign_matrix = subparsers.add_parser("resign_matrix", help="🔄 依矩陣描述檔重簽多個 IPA / Bundle ID / 帳號組合")
+    parser_resign_matrix.add_argument("manifest", help="矩陣描述檔 (JSON)")
+    parser_resign_matrix.add_argument("--workers", type=int, default=None, help="最大並行數 (預設為 CPU 數，最多 10)")
+    parser_resign_matrix.add_argument(
+        "--force", action="store_true", help="忽略快取，即使輸入未變更也重新簽名"
+    )
+    parser_resign_matrix.add_argument(
+        "--report", type=str, default=None, help="彙總報告輸出路徑 (預設為 ${IPA_DIR_PATH}/matrix_report.json)"
+    )
+    parser_gc_artifacts = subparsers.add_parser("gc_artifacts", help="🧹 清理重簽名產物快取")
+    parser_gc_artifacts.add_argument(
+        "--max-age-days", type=int, default=None, help="刪除超過 N 天未使用的產物 (預設為 ARTIFACT_MAX_AGE_DAYS)"
+    )
+    parser_gc_artifacts.add_argument(
+        "--max-size-mb", type=int, default=None, help="產物總量上限，超過時從最舊的開始刪除 (預設為 ARTIFACT_MAX_SIZE_MB)"
+    )
+    parser_gc_artifacts.add_argument("--dry-run", action="store_true", help="只列出會刪除的產物")
+
+    parser_inspect_profile = subparsers.add_parser("inspect_profile", help="🔍 顯示描述檔內容（Team、到期日、裝置、Entitlements）")
+    parser_inspect_profile.add_argument("path", help=".mobileprovision 檔案路徑")
+
+    parser_inspect_signature = subparsers.add_parser("inspect_signature", help="🔏 驗證並顯示 .app / Mach-O 的簽名（不需要 codesign）")
+    parser_inspect_signature.add_argument("path", help=".app、.appex、.framework 或 Mach-O 檔案路徑")
+    parser_inspect_signature.add_argument(
+        "--compare", type=str, default=None, help="與另一份簽名比對結構（例如 codesign 與 SIGNER_BACKEND=python 的產物）"
+    )
 
     # 🎯 **憑證管理**
     parser_revoke_expired_cert = subparsers.add_parser("revoke_expired_cert", help="🗑 刪除所有帳號過期的發佈憑證")
+    parser_cleanup_profiles = subparsers.add_parser("cleanup_profiles", help="🧹 清理所有帳號過期或無效的描述檔")
+    parser_cleanup_profiles.add_argument("apple_id", nargs="?", help="只清理指定的 Apple ID（預設為所有帳號）")
+    parser_cleanup_profiles.add_argument(
+        "--workers", type=int, default=None, help="同時處理的帳號數 (預設為 PROFILE_CLEANUP_WORKERS)"
+    )
+    parser_cleanup_profiles.add_argument("--dry-run", action="store_true", help="只統計每個帳號會刪除的描述檔數")
+    parser_plan_rotation = subparsers.add_parser("plan_rotation", help="📅 顯示憑證換發計畫（每天換發哪些帳號）")
+    parser_plan_rotation.add_argument("--days", type=int, default=14, help="列出最近 N 天的計畫 (預設 14)")
+    parser_rotate_certs = subparsers.add_parser("rotate_certs", help="🔄 換發今天排定的憑證")
+    parser_rotate_certs.add_argument("--dry-run", action="store_true", help="只列出今天會換發的帳號")
     parser_revoke_cert = subparsers.add_parser("revoke_cert", help="🗑 刪除指定 Apple ID 的憑證")
     parser_revoke_cert.add_argument("apple_id", help="Apple ID (Email)")
 
+    # 🎯 **常駐服務**
+    subparsers.add_parser("daemon", help="🛰 啟動常駐服務（定期掃描/續期憑證、更新描述檔，並接受本地 socket 指令）")
+    subparsers.add_parser("daemon_status", help="🛰 查詢常駐服務狀態")
+
+    # 🎯 **本地 HTTP API**
+    parser_serve = subparsers.add_parser("serve", help="🌐 啟動本地 HTTP API（帳號查詢、註冊設備、重簽名與下載 IPA）")
+    parser_serve.add_argument("--host", type=str, default=None, help="監聽位址 (預設為 API_SERVER_HOST 或 127.0.0.1)")
+    parser_serve.add_argument("--port", type=int, default=None, help="監聽埠號 (預設為 API_SERVER_PORT 或 8080)")
+
     args = parser.parse_args()
+    configure_logging(args.log_format, args.log_level)
 
     # 🚀 **先載入 `.env`**
     config.load(args.env)
-    
-    # 📌 **動態加載模組**
-    load_modules()
 
-    # 🛠 **執行對應的指令**
+    if args.command == "daemon":
+        from apple_cert_manager.daemon import run_daemon
+        run_daemon()
+        return
+
+    if args.command == "serve":
+        from apple_cert_manager.api_server import run_api_server
+        run_api_server(args.host, args.port)
+        return
+
+    if args.command == "daemon_status":
+        from apple_cert_manager import daemon
+        if not daemon.is_daemon_running():
+            print("⚠️ 常駐服務未執行")
+            return
+        print(daemon.send_command("status").get("result"))
+        return
+
+    # 📨 **常駐服務執行中則交給它處理**
+    if forward_to_daemon(args):
+        return
+    
+    # 🛠 **執行對應的指令（只載入該指令需要的模組）**
     if args.command == "add":
-        insert_account(args.apple_id, args.issuer_id, args.key_id)
+        load_handler("add")(args.apple_id, args.issuer_id, args.key_id)
 
     elif args.command == "delete":
-        delete_account(args.apple_id)
+        load_handler("delete")(args.apple_id)
 
     elif args.command == "query":
-        query_accounts()
+        load_handler("query")()
 
     elif args.command == "import":
         json_path = args.json or config.json_path
-        insert_from_json(json_path)
+        load_handler("import")(json_path)
 
     elif args.command == "register_device":
-        register_device_and_resign(args.apple_id, args.name, args.uuid)
+        load_handler("register_device")(args.apple_id, args.name, args.uuid)
 
     elif args.command == "resign":
         if args.apple_id:  # 如果提供了 apple_id
             account = {"apple_id": args.apple_id}  # 模擬 account 結構
-            resign_single_account(account)
+            load_handler("resign_single")(account, force=args.force)
         else:  # 沒有提供 apple_id，執行批量重簽
-            batch_resign_all_accounts()
+            load_handler("resign_batch")(force=args.force)
+
+    elif args.command == "resign_matrix":
+        kwargs = {"force": args.force, "report_path": args.report}
+        if args.workers:
+            kwargs["max_workers"] = args.workers
+        load_handler("resign_matrix")(args.manifest, **kwargs)
+
+    elif args.command == "gc_artifacts":
+        load_handler("gc_artifacts")(args.max_age_days, args.max_size_mb, dry_run=args.dry_run)
+
+    elif args.command == "inspect_profile":
+        load_handler("inspect_profile")(args.path)
+
+    elif args.command == "inspect_signature":
+        if load_handler("inspect_signature")(args.path, args.compare):
+            raise SystemExit(1)
 
     elif args.command == "revoke_expired_cert":
-        revoke_expired_certificates()
+        load_handler("revoke_expired_cert")()
+
+    elif args.command == "cleanup_profiles":
+        load_handler("cleanup_profiles")(args.apple_id, max_workers=args.workers, dry_run=args.dry_run)
+
+    elif args.command == "plan_rotation":
+        load_handler("plan_rotation")(args.days)
+
+    elif args.command == "rotate_certs":
+        load_handler("rotate_certs")(dry_run=args.dry_run)
 
     elif args.command == "revoke_cert":
-        revoke_certificate(args.apple_id)
+        load_handler("revoke_cert")(args.apple_id)
 
     else:
         parser.print_help()
+        return
+
+    report_metrics(args)
+
+def report_metrics(args):
+    """📊 指令結束時輸出 API 與外部工具呼叫統計，並依需要匯出各階段耗時"""
+    import sys
+    metrics = sys.modules.get("apple_cert_manager.metrics")
+    if metrics is None:  # 這次指令沒有任何計時或 API 呼叫
+        if not args.metrics_out:
+            return
+        from apple_cert_manager import metrics
+    if metrics.http_metrics.total_calls():
+        logging.getLogger("apple_cert_manager.cli").info(metrics.http_metrics.format_summary())
+    if metrics.tool_metrics.total_calls():
+        logging.getLogger("apple_cert_manager.cli").info(metrics.tool_metrics.format_summary())
+    if args.metrics_out:
+        metrics.export(args.metrics_out)
+        print(f"📊 已匯出統計資料: {args.metrics_out}")
 
 if __name__ == "__main__":
     main()